@@ -0,0 +1,118 @@
+# Memória e tempo de carga de um DataFrame de mtmtb em três caminhos:
+#
+#   fetchall  tuplas do cursor -> DataFrame (Decimal, str e date por linha)
+#   read_sql  pd.read_sql (o que os loaders usavam)
+#   typed     data._readFrame: COPY em CSV + read_csv com FRAME_TYPES
+#
+# Cada caminho roda num processo novo, para o pico de RSS ser só dele. Com
+# --check, confere que pnl/mtm do frame tipado, em centavos, batem com os
+# Decimal do banco linha a linha.
+#
+#   PNL_DSN="host=localhost dbname=pnl_bench" python -m benchmarks.bench_frames --rows 1000000
+#   PNL_DSN=... python -m benchmarks.bench_frames --rows 1000000 --reuse --keep --check
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import data
+from benchmarks.common import BENCH_PRODS, cleanup, requireDsn
+from benchmarks.synthetic import generate
+
+QUERY = """
+    SELECT idPnl, idTrade, prod, cat, ship, year, mtm, pnl, date, reg
+    FROM mtmtb
+    WHERE prod = ANY(%(prods)s)
+    ORDER BY idPnl
+    LIMIT %(rows)s
+"""
+MODES = ('fetchall', 'read_sql', 'typed')
+
+
+def load(mode, rows):
+    params = {'prods': BENCH_PRODS, 'rows': rows}
+    with data.dbConnection() as conn:
+        if mode == 'typed':
+            return data._readFrame(conn, QUERY, params)
+        if mode == 'read_sql':
+            return pd.read_sql(QUERY, conn, params=params)
+        cursor = conn.cursor()
+        cursor.execute(QUERY, params)
+        columns = [c.name for c in cursor.description]
+        df = pd.DataFrame(cursor.fetchall(), columns=columns)
+        cursor.close()
+        return df
+
+
+def child(mode, rows):
+    # conexão aberta antes da linha de base: o pico é só da carga
+    with data.dbConnection() as conn:
+        conn.cursor().execute("SELECT 1")
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t0 = time.perf_counter()
+    df = load(mode, rows)
+    seconds = time.perf_counter() - t0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base     # KB no Linux
+    frame = int(df.memory_usage(deep=True).sum())
+    return {'mode': mode, 'rows': len(df), 'seconds': round(seconds, 3),
+            'frameMB': round(frame / 2**20, 1), 'bytesPerRow': round(frame / max(len(df), 1), 1),
+            'peakMB': round(peak / 1024, 1),
+            'dtypes': {c: str(t) for c, t in df.dtypes.items()}}
+
+
+def check(rows):
+    # centavos do frame tipado == Decimal do banco, linha a linha
+    typed, exact = load('typed', rows), load('fetchall', rows)
+    bad = 0
+    for col in ('mtm', 'pnl'):
+        cents = np.rint(typed[col].to_numpy() * 100).astype(np.int64)
+        expected = np.array([int(v.scaleb(2)) for v in exact[col]], dtype=np.int64)
+        bad += int((cents != expected).sum())
+    return bad
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Memória dos frames de mtmtb (objetos x tipados)')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--modes', nargs='*', default=list(MODES), choices=MODES)
+    parser.add_argument('--reuse', action='store_true', help='reaproveita o livro sintético se as contagens baterem')
+    parser.add_argument('--keep', action='store_true', help='não apaga o livro sintético no fim')
+    parser.add_argument('--check', action='store_true', help='confere os centavos do frame tipado')
+    parser.add_argument('--child', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(child(args.child, args.rows)))
+        return 0
+
+    requireDsn()
+    loaded = generate(max(args.rows // 3, 1), args.rows, reuse=args.reuse)
+    print(f"livro: {args.rows} marcas" + (" (reaproveitado)" if loaded['reused'] else f" gerado em {loaded['seconds']:.1f}s"),
+          file=sys.stderr)
+    failures = 0
+    try:
+        results = []
+        for mode in args.modes:
+            out = subprocess.run([sys.executable, '-m', 'benchmarks.bench_frames', '--child', mode, '--rows', str(args.rows)],
+                                 capture_output=True, text=True, check=True)
+            result = json.loads(out.stdout.strip().splitlines()[-1])
+            results.append(result)
+            print(f"{mode:9} {result['rows']:>9,} linhas {result['seconds']:7.2f}s  frame {result['frameMB']:7.1f} MB "
+                  f"({result['bytesPerRow']:.0f} B/linha)  pico {result['peakMB']:7.1f} MB", file=sys.stderr)
+        if args.check:
+            failures = check(args.rows)
+            print(f"centavos divergentes: {failures}", file=sys.stderr)
+        print(json.dumps(results, indent=2))
+    finally:
+        if not args.keep:
+            cleanup()
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
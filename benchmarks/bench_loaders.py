@@ -0,0 +1,108 @@
+# Benchmark dos loaders do Overview: implementação original (SELECT de todo o
+# histórico + groupby/drop_duplicates/pivot no pandas) vs os loaders atuais,
+# que agregam no banco e trazem só as células da matriz.
+#
+#   PNL_DSN="host=localhost dbname=pnl_bench" python -m benchmarks.bench_loaders --rows 1000000
+#
+# Para cada loader mede latência (mediana de --repeat execuções) e o tamanho em
+# texto das linhas devolvidas pelo banco, que aproxima os bytes na rede.
+import argparse
+import statistics
+import time
+
+import pandas as pd
+
+import data
+from benchmarks.common import cleanup, recordQueries, requireDsn, resultBytes, seed, uncached
+
+PROD, YEAR = 'BenchC', 2095
+
+
+# Implementações originais, copiadas como estavam antes da agregação no banco
+def legacyLoadPnl(prod, year):
+    query = "SELECT * FROM mtmtb WHERE prod = %s AND year = %s ORDER BY reg DESC;"
+    with data.dbConnection() as conn:
+        df = pd.read_sql(query, conn, params=(prod, year))
+    df['date'] = pd.to_datetime(df['date'])
+    df['month'] = df['date'].dt.month_name().str[:3]
+    grouped = df.groupby(['cat', 'month'])['pnl'].sum().reset_index()
+    table = (grouped.pivot(index='cat', columns='month', values='pnl')
+             .reindex(columns=data.MONTHS, fill_value=0).reindex(data.CATEGORIES, fill_value=0).fillna(0))
+    table['Year'] = table.sum(axis=1)
+    total_row = table.sum(axis=0).to_frame().T
+    total_row.index = ['Total']
+    return pd.concat([table, total_row])
+
+
+def legacyLoadPos(prod, year):
+    query = "SELECT pos, cat, ship, year, reg FROM posTb WHERE prod = %s AND year = %s ORDER BY reg DESC;"
+    with data.dbConnection() as conn:
+        df = pd.read_sql(query, conn, params=(prod, year))
+    df_unique = df.sort_values('reg', ascending=False).drop_duplicates(subset=['cat', 'ship'], keep='first')
+    table = (df_unique.pivot(index='cat', columns='ship', values='pos')
+             .reindex(columns=data.MONTHS, fill_value=0).reindex(data.CATEGORIES, fill_value=0).fillna(0))
+    table['Year'] = table.sum(axis=1)
+    total_row = table.sum(axis=0).to_frame().T
+    total_row.index = ['Total']
+    return pd.concat([table, total_row])
+
+
+def legacyLoadMtm(prod, year):
+    query = "SELECT mtm, cat, ship, year, reg FROM mtmtb WHERE prod = %s AND year = %s ORDER BY reg DESC;"
+    with data.dbConnection() as conn:
+        df = pd.read_sql(query, conn, params=(prod, year))
+    df_unique = df.sort_values('reg', ascending=False).drop_duplicates(subset=['cat', 'ship'], keep='first')
+    return (df_unique.pivot(index='cat', columns='ship', values='mtm')
+            .reindex(columns=data.MONTHS, fill_value=0).reindex(data.CATEGORIES, fill_value=0))
+
+
+CASES = [
+    ('dbLoadPnl', legacyLoadPnl, uncached(data.dbLoadPnl)),
+    ('dbLoadPos', legacyLoadPos, uncached(data.dbLoadPos)),
+    ('dbLoadMtm', legacyLoadMtm, uncached(data.dbLoadMtm)),
+]
+
+
+def measure(fn, repeat):
+    _, queries = recordQueries(lambda: fn(PROD, YEAR))
+    size = rows = 0
+    for query in queries:
+        b, r = resultBytes(query)
+        size, rows = size + b, rows + r
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(PROD, YEAR)
+        times.append(time.perf_counter() - t0)
+    return {'seconds': statistics.median(times), 'bytes': size, 'rows': rows}
+
+
+def run(repeat):
+    results = {}
+    for name, legacy, current in CASES:
+        old, new = measure(legacy, repeat), measure(current, repeat)
+        results[name] = {'legacy': old, 'current': new}
+        print(f"{name:10} legacy {old['seconds'] * 1000:9.1f} ms {old['rows']:>8} rows {old['bytes']:>11} B   "
+              f"current {new['seconds'] * 1000:7.1f} ms {new['rows']:>4} rows {new['bytes']:>6} B")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark dos loaders do Overview')
+    parser.add_argument('--rows', type=int, default=1000000, help='linhas semeadas por tabela de histórico')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--keep', action='store_true', help='não apaga as linhas semeadas no fim')
+    args = parser.parse_args(argv)
+    requireDsn()
+    data.dbCreateTable()
+    cleanup()
+    seed(args.rows)
+    try:
+        run(args.repeat)
+    finally:
+        if not args.keep:
+            cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# Benchmark do Overview: os 3 painéis x N produtos carregados em série (como a
+# aba fazia) vs dbLoadPanels, que os dispara em paralelo no pool de threads.
+#
+#   PNL_DSN="host=localhost dbname=pnl_bench" python -m benchmarks.bench_overview --rtt 0 20 50
+#
+# --rtt simula a latência de rede por ida ao banco (ms), dormindo antes de cada
+# execute; com o banco local a latência real é ~0 e o ganho vem só do trabalho
+# do servidor em paralelo.
+import argparse
+import statistics
+import time
+
+import psycopg2.extensions
+
+import data
+from benchmarks.common import BENCH_PRODS, cleanup, requireDsn, seed
+
+YEAR = 2095
+
+
+class LatencyCursor(psycopg2.extensions.cursor):
+    rtt = 0.0
+
+    def execute(self, query, vars=None):
+        if LatencyCursor.rtt:
+            time.sleep(LatencyCursor.rtt)
+        return super().execute(query, vars)
+
+
+def serial():
+    data.dbCacheClear()
+    for prod in BENCH_PRODS:
+        for loader in data.PANELS.values():
+            loader(prod, YEAR)
+
+
+def concurrent():
+    data.dbCacheClear()
+    for _, _, _, error in data.dbLoadPanels(YEAR, BENCH_PRODS):
+        if error is not None:
+            raise error
+
+
+def median(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times)
+
+
+def run(rtts, repeat):
+    # todas as conexões do pool com o cursor que simula latência
+    pool = data.dbPool()
+    conns = [pool.getconn() for _ in range(data.POOL_SIZE)]
+    for conn in conns:
+        conn.cursor_factory = LatencyCursor
+        pool.putconn(conn)
+    for rtt in rtts:
+        LatencyCursor.rtt = rtt / 1000
+        concurrent()
+        s, c = median(serial, repeat), median(concurrent, repeat)
+        print(f"rtt {rtt:>4} ms  {len(BENCH_PRODS)} products x {len(data.PANELS)} panels: "
+              f"serial {s * 1000:7.1f} ms  concurrent {c * 1000:7.1f} ms  ({s / c:4.1f}x)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark do carregamento do Overview')
+    parser.add_argument('--rows', type=int, default=100000, help='linhas semeadas por tabela de histórico')
+    parser.add_argument('--rtt', type=float, nargs='+', default=[0, 20, 50])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+    requireDsn()
+    data.dbCreateTable()
+    cleanup()
+    seed(args.rows)
+    try:
+        run(args.rtt, args.repeat)
+    finally:
+        cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+# Benchmark/exatidão do motor pnl.py contra o loop por trade em Decimal que
+# existia na aba Insert MTM (com o arredondamento que o banco aplica ao gravar
+# NUMERIC(11,2)). Roda só em memória, sem banco:
+#
+#   python -m benchmarks.bench_pnl
+#   python -m benchmarks.bench_pnl --sizes 1000 100000 1000000 --legacy-max 100000
+#
+# Sai com código 1 se algum pnl divergir do loop.
+import argparse
+import statistics
+import sys
+import time
+from decimal import Decimal, ROUND_HALF_UP
+
+import numpy as np
+
+import data
+from pnl import Book
+
+PRODS = data.PRODUCTS + ['Other']   # 'Other' cai na conversão padrão (1)
+CATEGORIES = ['FOB Vessel', 'FOB Paper', 'C&F Vessel']
+SHIPMENTS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun']
+
+
+def synthetic(n, seed=0):
+    # Livro aleatório: metade dos trades já marcados uma vez
+    rng = np.random.default_rng(seed)
+    lvl = rng.integers(-9999, 10000, n)
+    mark = np.where(rng.random(n) < 0.5, rng.integers(-9999, 10000, n), np.nan)
+    return Book(np.arange(1, n + 1), rng.choice(PRODS, n), rng.choice(CATEGORIES, n), rng.choice(SHIPMENTS, n),
+                np.full(n, 2099), rng.choice(['Purchase', 'Sale'], n), rng.integers(1, 5000, n), lvl, mark)
+
+
+# Cópia da regra do loop antigo, trade a trade em Decimal
+def legacyRevalue(book, mtm):
+    out = []
+    for prod, sign, ton, lvl, mark in zip(book.prods, book.signs, book.tons, book.lvlCents, book.markCents):
+        mtmOld = Decimal(int(mark)).scaleb(-2)
+        diff = mtmOld - mtm if sign < 0 else mtm - mtmOld
+        pnl = diff * data.get_conversion_value(prod) * Decimal(str(ton))
+        out.append(pnl.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
+    return out
+
+
+def timed(fn, repeat=3):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times), result
+
+
+def run(sizes, legacyMax, marks):
+    failures = 0
+    for n in sizes:
+        book = synthetic(n)
+        line = f"{n:>8} trades"
+        for mark in marks:
+            mtm = Decimal(mark)
+            fast, result = timed(lambda: book.revalue(mtm, decimals=False))
+            line += f"  mtm={mark}: engine {fast * 1000:8.1f} ms"
+            if n <= legacyMax:
+                slow, expected = timed(lambda: legacyRevalue(book, mtm), repeat=1)
+                got = [Decimal(int(v)).scaleb(-2) for v in result['pnlCents']]
+                wrong = sum(a != b for a, b in zip(got, expected))
+                failures += wrong
+                line += f" legacy {slow * 1000:9.1f} ms ({slow / fast:6.0f}x) {'exact' if not wrong else f'{wrong} DIFF'}"
+        print(line)
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark do motor de PnL em memória')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--legacy-max', type=int, default=100000, help='maior N em que o loop Decimal também roda')
+    parser.add_argument('--marks', nargs='+', default=['12.34', '0.125', '-7.5'],
+                        help='marcas testadas (mais de 2 casas exercita a escala variável)')
+    args = parser.parse_args(argv)
+    sys.exit(1 if run(args.sizes, args.legacy_max, args.marks) else 0)
+
+
+if __name__ == '__main__':
+    main()
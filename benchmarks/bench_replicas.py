@@ -0,0 +1,146 @@
+# Leituras do dashboard x escritas de trade, com e sem réplicas de leitura.
+#
+# V threads "viewer" repetem os loaders do dashboard (Overview, página do Trade
+# Log, livro do Insert MTM) sem o cache de resultados, enquanto uma thread
+# grava um trade a cada --write-every s. Cada modo roda num processo novo:
+#
+#   primary   PNL_REPLICA_DSNS vazio: tudo no primário
+#   replicas  leituras nas réplicas de --replicas (ou de PNL_REPLICA_DSNS)
+#
+# Réplicas locais para teste (streaming a partir do primário em /tmp:5432):
+#   pg_basebackup -h /tmp -U postgres -D /tmp/r1 -R -X stream
+#   pg_ctl -D /tmp/r1 -o '-p 5433 -k /tmp' start        (idem r2 na 5434)
+#
+#   PNL_DSN="host=/tmp dbname=pnl_bench user=postgres" python -m benchmarks.bench_replicas \
+#       --replicas "host=/tmp port=5433 dbname=pnl_bench user=postgres; host=/tmp port=5434 dbname=pnl_bench user=postgres"
+#
+# Numa única máquina as réplicas dividem CPU e disco com o primário: o ganho
+# medido aqui é o da fila de conexões e locks, não o de hardware a mais.
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import data
+from benchmarks.common import BENCH_PRODS, CATEGORIES, SHIPMENTS, cleanup, requireDsn, uncached
+from benchmarks.synthetic import generate
+
+YEAR = 2095
+MODES = ('primary', 'replicas')
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+def child(viewers, seconds, writeEvery):
+    loaders = [
+        lambda i: uncached(data.dbLoadOverview)(YEAR, BENCH_PRODS),
+        lambda i: uncached(data.dbLoadTradePage)(prod=BENCH_PRODS[i % len(BENCH_PRODS)], limit=50),
+        lambda i: uncached(data.dbLoadBook)(BENCH_PRODS[i % len(BENCH_PRODS)], YEAR),
+    ]
+    stop = threading.Event()
+    reads, writes, errors = [], [], []
+
+    def viewer(n):
+        i = n
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            try:
+                loaders[i % len(loaders)](i)
+                reads.append(time.perf_counter() - t0)
+            except Exception as e:
+                errors.append(str(e))
+            i += 1
+
+    def writer():
+        i = 0
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            data.dbInsertTrade(BENCH_PRODS[i % len(BENCH_PRODS)], CATEGORIES[i % 3], SHIPMENTS[i % 12],
+                               YEAR, 'Purchase' if i % 2 else 'Sale', 1 + i % 50, 5, 0)
+            writes.append(time.perf_counter() - t0)
+            i += 1
+            stop.wait(max(writeEvery - (time.perf_counter() - t0), 0))
+
+    data.dbWarmPool(min(viewers, data.POOL_SIZE)).join()
+    threads = [threading.Thread(target=viewer, args=(n,)) for n in range(viewers)]
+    threads.append(threading.Thread(target=writer))
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    ms = lambda v: None if v is None else round(v * 1000, 1)
+    stats = data.dbPoolStats()
+    return {
+        'viewers': viewers, 'seconds': seconds,
+        'readsPerSec': round(len(reads) / seconds, 1),
+        'readP50': ms(percentile(reads, 0.5)), 'readP95': ms(percentile(reads, 0.95)),
+        'writes': len(writes),
+        'writeP50': ms(percentile(writes, 0.5)), 'writeP95': ms(percentile(writes, 0.95)),
+        'writeP99': ms(percentile(writes, 0.99)), 'writeMax': ms(max(writes) if writes else None),
+        'primaryWaits': stats['waits'],
+        'reads': stats.get('reads'),
+        'errors': errors[:3],
+    }
+
+
+def runMode(mode, args, replicas):
+    env = dict(os.environ, PNL_REPLICA_DSNS=replicas if mode == 'replicas' else '')
+    out = subprocess.run([sys.executable, '-m', 'benchmarks.bench_replicas', '--child',
+                          '--viewers', str(args.viewers), '--seconds', str(args.seconds),
+                          '--write-every', str(args.write_every)],
+                         env=env, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Leituras do dashboard x escritas, com e sem réplicas')
+    parser.add_argument('--replicas', default=os.environ.get('PNL_REPLICA_DSNS', ''),
+                        help="DSNs das réplicas separados por ';'")
+    parser.add_argument('--viewers', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--write-every', type=float, default=0.1, help='intervalo entre trades (s)')
+    parser.add_argument('--modes', nargs='*', default=list(MODES), choices=MODES)
+    parser.add_argument('--trades', type=int, default=30000)
+    parser.add_argument('--marks', type=int, default=100000)
+    parser.add_argument('--reuse', action='store_true', help='reaproveita o livro sintético se as contagens baterem')
+    parser.add_argument('--keep', action='store_true', help='não apaga o livro sintético no fim')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(child(args.viewers, args.seconds, args.write_every)))
+        return 0
+
+    requireDsn()
+    if 'replicas' in args.modes and not args.replicas:
+        sys.exit('Defina --replicas (ou PNL_REPLICA_DSNS) para o modo replicas.')
+    generate(args.trades, args.marks, reuse=args.reuse)
+    try:
+        results = []
+        for mode in args.modes:
+            result = dict(runMode(mode, args, args.replicas), mode=mode)
+            results.append(result)
+            print(f"{mode:8} {result['viewers']} viewers: {result['readsPerSec']:7.1f} leituras/s "
+                  f"(p50 {result['readP50']} ms, p95 {result['readP95']} ms)  "
+                  f"escrita p50 {result['writeP50']} / p95 {result['writeP95']} / p99 {result['writeP99']} / "
+                  f"máx {result['writeMax']} ms  esperas no pool {result['primaryWaits']}"
+                  + (f"  erros {len(result['errors'])}" if result['errors'] else ''), file=sys.stderr)
+        print(json.dumps(results, indent=2))
+    finally:
+        if not args.keep:
+            cleanup()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,112 @@
+# Benchmark: reavaliação MTM por trade (loop antigo do Streamlit) vs dbRevalueMtm.
+#
+# Roda contra o banco apontado por PNL_DSN (use um banco descartável):
+#   PNL_DSN="host=localhost dbname=pnl_bench" python -m benchmarks.bench_revalue
+#   PNL_DSN=... python -m benchmarks.bench_revalue --sizes 100 1000 10000 100000 --legacy-max 1000
+#
+# Cada tamanho semeia N trades abertos num produto próprio ('Bench') e mede duas
+# reavaliações: a primeira sem marcas anteriores (diff contra lvl) e a segunda
+# com marcas (diff contra a última marca de cada trade).
+import argparse
+import os
+import sys
+import time
+from decimal import Decimal
+
+import data
+from benchmarks.common import uncached
+
+BENCH_PROD = 'Bench'
+BENCH_YEAR = 2099
+CATEGORIES = ['FOB Vessel', 'FOB Paper', 'C&F Vessel']
+SHIPMENTS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+             'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+
+def cleanup():
+    with data.dbConnection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM mtmtb WHERE prod = %s", (BENCH_PROD,))
+        cursor.execute("DELETE FROM mtmCurTb WHERE prod = %s", (BENCH_PROD,))
+        cursor.execute("DELETE FROM tradeTb WHERE prod = %s", (BENCH_PROD,))
+        conn.commit()
+        cursor.close()
+
+
+def seed(n):
+    query = """
+        INSERT INTO tradeTb(prod, cat, ship, year, op, ton, lvl, notion)
+        SELECT %(prod)s,
+               (%(cats)s)[1 + i %% 3],
+               (%(ships)s)[1 + (i / 3) %% 12],
+               %(year)s,
+               CASE WHEN i %% 2 = 0 THEN 'Sale' ELSE 'Purchase' END,
+               1 + i %% 500,
+               round((random() * 10)::numeric, 2),
+               0
+        FROM generate_series(1, %(n)s) i;
+    """
+    with data.dbConnection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, {'prod': BENCH_PROD, 'year': BENCH_YEAR, 'n': n,
+                               'cats': CATEGORIES, 'ships': SHIPMENTS})
+        cursor.execute("ANALYZE tradeTb; ANALYZE mtmtb;")
+        conn.commit()
+        cursor.close()
+
+
+# Cópia fiel do loop que existia na aba Insert MTM
+def legacyRevalue(prod, year, mtm, categories, shipments):
+    updated = 0
+    for cat in categories:
+        for ship in shipments:
+            for id_trade, op_trade, ton_trade, lvl_trade in uncached(data.dbFetchTrade)(prod, cat, ship, year):
+                mtmOld = uncached(data.dbFetchMtM)(id_trade)
+                if mtmOld is None:
+                    diff = lvl_trade - mtm if op_trade == "Sale" else mtm - lvl_trade
+                else:
+                    diff = mtmOld - mtm if op_trade == "Sale" else mtm - mtmOld
+                pnl = diff * data.get_conversion_value(prod) * Decimal(str(ton_trade))
+                data.dbInsertPnl(id_trade, prod, cat, ship, year, mtm, pnl)
+                updated += 1
+    return updated
+
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    rows = fn(*args)
+    return time.perf_counter() - t0, rows
+
+
+def run(sizes, legacyMax):
+    results = []
+    for n in sizes:
+        cleanup()
+        seed(n)
+        row = {'trades': n}
+        row['set_first'], _ = timed(data.dbRevalueMtm, BENCH_PROD, BENCH_YEAR, Decimal('5.00'), CATEGORIES, SHIPMENTS)
+        row['set_marked'], _ = timed(data.dbRevalueMtm, BENCH_PROD, BENCH_YEAR, Decimal('5.25'), CATEGORIES, SHIPMENTS)
+        if n <= legacyMax:
+            row['legacy_marked'], _ = timed(legacyRevalue, BENCH_PROD, BENCH_YEAR, Decimal('5.50'), CATEGORIES, SHIPMENTS)
+        results.append(row)
+        legacy = f"{row['legacy_marked']:8.3f}s" if 'legacy_marked' in row else 'skipped'
+        print(f"{n:>8} trades  set(1st)={row['set_first']:8.3f}s  "
+              f"set(marked)={row['set_marked']:8.3f}s  legacy={legacy}")
+    cleanup()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark da reavaliação MTM')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000])
+    parser.add_argument('--legacy-max', type=int, default=1000,
+                        help='maior N em que o loop antigo também é medido (2N+9 idas ao banco)')
+    args = parser.parse_args(argv)
+    if not os.environ.get('PNL_DSN'):
+        sys.exit('Defina PNL_DSN apontando para um banco de benchmark.')
+    data.dbCreateTable()
+    run(args.sizes, args.legacy_max)
+
+
+if __name__ == '__main__':
+    main()
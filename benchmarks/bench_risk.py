@@ -0,0 +1,82 @@
+# VaR/ES histórico (risk.py): produtos carregados um a um no próprio
+# processo x em paralelo no pool de processos, para janelas curtas e longas.
+#
+#   PNL_DSN="host=localhost dbname=pnl_bench" python -m benchmarks.bench_risk --windows 250 1000 2000
+#
+# O livro sintético é gerado com --history dias de marcas. "pool (frio)" é a
+# primeira chamada com o pool, que inclui subir os processos (spawn importa
+# pandas/psycopg2 em cada um); as seguintes reaproveitam os processos. Os
+# cenários dos dois caminhos são comparados e precisam bater.
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.common import BENCH_PRODS, cleanup, requireDsn
+from benchmarks.synthetic import generate
+
+AS_OF = '2099-12-31'
+
+
+def timed(fn, repeat):
+    times, result = [], None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times), result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark do VaR histórico (processo x pool)')
+    parser.add_argument('--trades', type=int, default=5000)
+    parser.add_argument('--marks', type=int, default=500000)
+    parser.add_argument('--history', type=int, default=2500, help='dias de marcas gerados')
+    parser.add_argument('--windows', type=int, nargs='+', default=[250, 1000, 2000])
+    parser.add_argument('--workers', type=int, default=max(os.cpu_count() or 1, 2))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--reuse', action='store_true', help='reaproveita o livro sintético se as contagens baterem')
+    parser.add_argument('--keep', action='store_true', help='não apaga o livro sintético no fim')
+    args = parser.parse_args(argv)
+
+    requireDsn()
+    # sem cache de resultados aqui nem nos processos do pool (herdam o ambiente)
+    os.environ['PNL_CACHE_TTL'] = '0'
+    os.environ['PNL_RISK_PARALLEL_DAYS'] = '0'
+    import data
+    import risk
+
+    loaded = generate(args.trades, args.marks, days=args.history, reuse=args.reuse)
+    print(f"livro: {args.trades} trades, {args.marks} marcas em {args.history} dias"
+          + (" (reaproveitado)" if loaded['reused'] else f" gerado em {loaded['seconds']:.1f}s"), file=sys.stderr)
+    failures = 0
+    try:
+        def report(days, workers):
+            risk.riskCacheClear()
+            data.dbCacheClear()
+            return risk.riskReport(AS_OF, days, 1, BENCH_PRODS, workers=workers)
+
+        t0 = time.perf_counter()
+        report(args.windows[0], args.workers)
+        print(f"pool (frio): {time.perf_counter() - t0:.2f}s com {args.workers} processos", file=sys.stderr)
+        for days in args.windows:
+            serial, a = timed(lambda: report(days, 1), args.repeat)
+            pooled, b = timed(lambda: report(days, args.workers), args.repeat)
+            same = np.allclose(a['scenarios'].to_numpy(), b['scenarios'].to_numpy(), atol=1e-6)
+            failures += not same
+            total = a['summary'].set_index('prod').loc['Total']
+            print(f"{days:>5} dias ({a['days']} cenários): processo {serial * 1000:8.1f} ms  "
+                  f"pool {pooled * 1000:8.1f} ms ({serial / pooled:4.2f}x)  "
+                  f"VaR99 {total['VaR 99%']:,.0f}  ES99 {total['ES 99%']:,.0f}  "
+                  f"{'iguais' if same else 'DIFERENTES'}", file=sys.stderr)
+    finally:
+        if not args.keep:
+            cleanup()
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,139 @@
+# Regressão de planos: semeia mtmtb/posTb/tradeTb com ~1M linhas cada (os
+# triggers mantêm posCurTb/mtmCurTb/pnltb) e fecha alguns meses (pnlCloseTb),
+# executa os fetchers/loaders reais de data.py, captura o SQL que eles enviam
+# e confere com EXPLAIN que nenhum deles faz Seq Scan nas tabelas checadas e
+# que cada um chega por índice às tabelas que deveria ler.
+#
+#   PNL_DSN="host=localhost dbname=pnl_bench" python -m benchmarks.check_plans
+#   PNL_DSN=... python -m benchmarks.check_plans --rows 1000000 --keep
+#
+# Sai com código 1 se algum plano regrediu. Use um banco descartável: as linhas
+# semeadas usam produtos próprios ('BenchA'...'BenchE') e são apagadas no fim.
+# Com PNL_PARTITION (padrão year) o plano traz o nome da partição
+# (mtmtb_y2095, mtmtb_default, ...): cada partição conta como a tabela raiz.
+import argparse
+import sys
+
+import data
+from benchmarks.common import cleanup, explain, recordQueries, requireDsn, seed, uncached
+
+HISTORY_TABLES = {'mtmtb', 'postb', 'tradetb'}
+# estado corrente e rollup, que os fetchers/loaders leem hoje
+STATE_TABLES = {'mtmcurtb', 'poscurtb', 'pnltb', 'pnlclosetb'}
+CHECKED_TABLES = HISTORY_TABLES | STATE_TABLES
+INDEX_NODES = {'Index Scan', 'Index Only Scan', 'Bitmap Heap Scan'}
+# meses fechados na semeadura (datas das marcas semeadas começam em 2090)
+CLOSE_PERIODS = [f'2090-{m:02d}' for m in range(1, 13)] + [f'2091-{m:02d}' for m in range(1, 13)]
+
+
+def partitionRoots():
+    # partição -> tabela raiz, em minúsculas como no plano
+    with data.dbConnection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT relname, pg_partition_root(oid)::regclass::text
+            FROM pg_class WHERE relispartition AND relkind IN ('r', 'p');""")
+        roots = {name.lower(): root.lower() for name, root in cursor.fetchall()}
+        cursor.close()
+    return roots
+
+
+def seqScans(node, roots=None):
+    found = []
+    name = node.get('Relation Name', '').lower()
+    if node.get('Node Type') == 'Seq Scan' and (roots or {}).get(name, name) in CHECKED_TABLES:
+        found.append(node['Relation Name'])
+    for child in node.get('Plans', []):
+        found += seqScans(child, roots)
+    return found
+
+
+def indexedTables(node, roots=None):
+    # tabelas (raiz) lidas por índice em algum ponto do plano
+    found = set()
+    name = node.get('Relation Name', '').lower()
+    if node.get('Node Type') in INDEX_NODES:
+        found.add((roots or {}).get(name, name))
+    for child in node.get('Plans', []):
+        found |= indexedTables(child, roots)
+    return found
+
+
+# Chamadas cobertas, com as tabelas que cada uma tem que ler por índice;
+# todas leem só uma fatia (produto/ano/chave)
+CASES = [
+    ('dbFetchMtM', lambda: uncached(data.dbFetchMtM)(4242), {'mtmcurtb'}),
+    ('dbFetchPnl', lambda: uncached(data.dbFetchPnl)('BenchC', 'FOB Paper', 'Mar', 2095), {'mtmcurtb'}),
+    ('dbFetchPos', lambda: uncached(data.dbFetchPos)('BenchC', 'FOB Paper', 'Mar', 2095), {'poscurtb'}),
+    ('dbFetchTrade', lambda: uncached(data.dbFetchTrade)('BenchC', 'FOB Paper', 'Mar', 2095), {'tradetb'}),
+    ('dbLoadPnl', lambda: uncached(data.dbLoadPnl)('BenchC', 2095), {'pnltb', 'pnlclosetb'}),
+    ('dbLoadPos', lambda: uncached(data.dbLoadPos)('BenchC', 2095), {'poscurtb'}),
+    ('dbLoadMtm', lambda: uncached(data.dbLoadMtm)('BenchC', 2095), {'mtmcurtb'}),
+    ('dbLoadOverview', lambda: uncached(data.dbLoadOverview)(2095, ['BenchC']),
+     {'pnltb', 'pnlclosetb', 'poscurtb', 'mtmcurtb'}),
+]
+
+
+def check():
+    failures = []
+    roots = partitionRoots()
+    for name, call, tables in CASES:
+        _, queries = recordQueries(call)
+        scans, indexed = [], set()
+        for query in queries:
+            plan = explain(query)
+            found = seqScans(plan, roots)
+            indexed |= indexedTables(plan, roots)
+            if found:
+                failures.append((name, query.decode()))
+            scans += found
+        missing = sorted(tables - indexed)
+        if missing and not scans:
+            failures.append((name, b'\n'.join(queries).decode()))
+        status = 'FAIL' if scans or missing else 'ok'
+        detail = ', '.join(scans + [f'{t} sem índice' for t in missing]) or ', '.join(sorted(indexed))
+        print(f"{status:4} {name:14} {detail}")
+    return failures
+
+
+def closePeriods():
+    # snapshot de fechamento para pnlCloseTb ter linhas; devolve os meses
+    # fechados aqui, para reabrir no fim (o guard de período fechado recusaria
+    # o cleanup das marcas)
+    closed = set(data.dbClosedPeriods()['period'].astype(str).str[:7])
+    periods = [p for p in CLOSE_PERIODS if p not in closed]
+    for period in periods:
+        data.dbClosePeriod(period)
+    with data.dbConnection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("ANALYZE pnltb; ANALYZE pnlCloseTb;")
+        conn.commit()
+        cursor.close()
+    return periods
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Regressão de planos das buscas de data.py')
+    parser.add_argument('--rows', type=int, default=1000000, help='linhas semeadas por tabela')
+    parser.add_argument('--keep', action='store_true', help='não apaga as linhas semeadas no fim')
+    args = parser.parse_args(argv)
+    requireDsn()
+    data.dbCreateTable()
+    cleanup()
+    seed(args.rows)
+    periods = []
+    try:
+        periods = closePeriods()
+        failures = check()
+    finally:
+        for period in periods:
+            data.dbReopenPeriod(period)
+        if not args.keep:
+            cleanup()
+    for name, query in failures:
+        print(f"\n{name}:\n{query}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
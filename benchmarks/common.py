@@ -0,0 +1,126 @@
+# Utilitários compartilhados pelos benchmarks: guarda de PNL_DSN, carga
+# sintética via generate_series, captura do SQL enviado por data.py e medição
+# de planos/bytes.
+import inspect
+import json
+import os
+import sys
+
+import psycopg2.extensions
+
+import data
+
+BENCH_PRODS = ['BenchA', 'BenchB', 'BenchC', 'BenchD', 'BenchE']
+CATEGORIES = ['FOB Vessel', 'FOB Paper', 'C&F Vessel']
+SHIPMENTS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+             'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+TABLES = ('mtmtb', 'posTb', 'tradeTb', 'mtmCurTb', 'posCurTb', 'pnltb')
+
+# i percorre 5 produtos x 3 categorias x 12 embarques x 10 anos (2090-2099)
+SEED = {
+    'tradeTb': """
+        INSERT INTO tradeTb(prod, cat, ship, year, op, ton, lvl, notion)
+        SELECT (%(prods)s)[1 + i %% 5], (%(cats)s)[1 + (i / 5) %% 3],
+               (%(ships)s)[1 + (i / 15) %% 12], 2090 + (i / 180) %% 10,
+               CASE WHEN i %% 2 = 0 THEN 'Sale' ELSE 'Purchase' END,
+               1 + i %% 500, round((random() * 10)::numeric, 2), 0
+        FROM generate_series(0, %(n)s - 1) i;
+    """,
+    'mtmtb': """
+        INSERT INTO mtmtb(idTrade, prod, cat, ship, year, mtm, pnl, date, reg)
+        SELECT i %% 100000, (%(prods)s)[1 + i %% 5], (%(cats)s)[1 + (i / 5) %% 3],
+               (%(ships)s)[1 + (i / 15) %% 12], 2090 + (i / 180) %% 10,
+               round((random() * 10)::numeric, 2), round((random() * 1000)::numeric, 2),
+               DATE '2090-01-01' + (i %% 3650), TIMESTAMP '2090-01-01' + i * INTERVAL '1 minute'
+        FROM generate_series(0, %(n)s - 1) i;
+    """,
+    'posTb': """
+        INSERT INTO posTb(prod, cat, ship, year, pos, date, reg)
+        SELECT (%(prods)s)[1 + i %% 5], (%(cats)s)[1 + (i / 5) %% 3],
+               (%(ships)s)[1 + (i / 15) %% 12], 2090 + (i / 180) %% 10,
+               (random() * 1000)::integer,
+               DATE '2090-01-01' + (i %% 3650), TIMESTAMP '2090-01-01' + i * INTERVAL '1 minute'
+        FROM generate_series(0, %(n)s - 1) i;
+    """,
+}
+
+
+def uncached(fn):
+    # versão sem o cache de resultados de data.py (mede sempre a ida ao banco);
+    # tira também @instrumented, que fica por fora de @cached
+    return inspect.unwrap(fn)
+
+
+def requireDsn():
+    if not os.environ.get('PNL_DSN'):
+        sys.exit('Defina PNL_DSN apontando para um banco de benchmark.')
+
+
+def cleanup():
+    with data.dbConnection() as conn:
+        cursor = conn.cursor()
+        for table in TABLES:
+            cursor.execute(f"DELETE FROM {table} WHERE prod = ANY(%s)", (BENCH_PRODS,))
+        # jobs da fila (jobs.py) com produtos de benchmark
+        cursor.execute("DELETE FROM jobTb WHERE COALESCE(params->>'prod', params->'legs'->0->>0) = ANY(%s)",
+                       (BENCH_PRODS,))
+        conn.commit()
+        cursor.close()
+
+
+def seed(n):
+    with data.dbConnection() as conn:
+        cursor = conn.cursor()
+        params = {'prods': BENCH_PRODS, 'cats': CATEGORIES, 'ships': SHIPMENTS, 'n': n}
+        for query in SEED.values():
+            cursor.execute(query, params)
+        conn.commit()
+        cursor.execute("ANALYZE tradeTb; ANALYZE mtmtb; ANALYZE posTb; ANALYZE mtmCurTb; ANALYZE posCurTb;")
+        conn.commit()
+        cursor.close()
+
+
+class RecordingCursor(psycopg2.extensions.cursor):
+    # Guarda o SQL já interpolado de cada execute
+    queries = []
+
+    def execute(self, query, vars=None):
+        result = super().execute(query, vars)
+        RecordingCursor.queries.append(self.query)
+        return result
+
+
+def recordQueries(call):
+    # Chamadas sequenciais sempre recebem a mesma conexão do pool (LIFO), então
+    # basta trocar o cursor_factory dela durante a chamada.
+    RecordingCursor.queries = []
+    with data.dbConnection() as conn:
+        previous, conn.cursor_factory = conn.cursor_factory, RecordingCursor
+    try:
+        result = call()
+    finally:
+        with data.dbConnection() as conn:
+            conn.cursor_factory = previous
+    return result, list(RecordingCursor.queries)
+
+
+def explain(query):
+    with data.dbConnection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(b"EXPLAIN (FORMAT JSON) " + query)
+        plan = cursor.fetchone()[0]
+        cursor.close()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']
+
+
+def resultBytes(query):
+    # Tamanho em texto do resultado de uma consulta (aprox. do tráfego no protocolo texto)
+    query = query.rstrip().rstrip(b';')
+    with data.dbConnection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(b"SELECT COALESCE(SUM(octet_length(q::text)), 0), count(*) FROM (" + query + b") q")
+        size, rows = cursor.fetchone()
+        cursor.close()
+    return int(size), int(rows)
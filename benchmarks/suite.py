@@ -0,0 +1,237 @@
+# Suíte de benchmarks reprodutível: gera o livro sintético (synthetic.py),
+# mede os loaders, o Graphs, os fluxos de Insert Trade / Insert MTM e a
+# paginação do Trade Log, e grava o resultado em JSON para comparar commits.
+#
+#   PNL_DSN="host=localhost dbname=pnl_bench" python -m benchmarks.suite --scale 100k -o base.json
+#   PNL_DSN=... python -m benchmarks.suite --scale 100k --keep --reuse --baseline base.json --threshold 0.2
+#   python -m benchmarks.suite --compare new.json --baseline base.json
+#
+# Leituras são medidas sem o cache de resultados (common.uncached). Os
+# cenários startup.* medem a partida num processo novo (interpretador +
+# imports, primeira consulta, primeiro run do app). Os cenários de escrita
+# rodam por último porque acrescentam linhas ao livro.
+# Com --baseline, sai com código 1 se algum cenário ficar mais de --threshold
+# (fração) e mais de --min-ms mais lento que a mediana de referência.
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from decimal import Decimal
+
+import data
+import jobs
+from benchmarks.common import BENCH_PRODS, CATEGORIES, SHIPMENTS, cleanup, requireDsn, uncached
+from benchmarks.synthetic import counts, generate, parseScale
+from pnl import Book
+
+PROD, YEAR = 'BenchC', 2095
+PAGE_SIZE = 50
+PAGES = 20
+
+
+def _pages():
+    # 20 páginas seguidas do Trade Log (keyset), como o botão Next
+    loadPage = uncached(data.dbLoadTradePage)
+    after = None
+    for _ in range(PAGES):
+        df = loadPage(prod=PROD, after=after, limit=PAGE_SIZE)
+        if df.empty:
+            break
+        after = int(df['id'].min())
+
+
+def _panels():
+    data.dbCacheClear()
+    for _, _, _, error in data.dbLoadPanels(YEAR, BENCH_PRODS):
+        if error is not None:
+            raise error
+
+
+# Partida a frio: cada execução é um processo Python novo, com o ambiente
+# atual (PNL_DSN)
+ROOT = os.path.dirname(os.path.abspath(data.__file__))
+STARTUP = {
+    'import': "import data",
+    'firstQuery': "import data\nwith data.dbConnection() as conn:\n    conn.cursor().execute('SELECT 1')",
+    'app': ("from streamlit.testing.v1 import AppTest\n"
+            f"at = AppTest.from_file({os.path.join(ROOT, 'streamlit_app.py')!r}, default_timeout=120)\n"
+            "at.run()\n"
+            "assert not at.exception, at.exception"),
+}
+
+
+def _startup(kind):
+    subprocess.run([sys.executable, '-c', STARTUP[kind]], cwd=ROOT, check=True,
+                   env=dict(os.environ, PYTHONPATH=ROOT), stdout=subprocess.DEVNULL)
+
+
+def _preview():
+    # Preview (what-if) do Insert MTM: livro em memória, nada gravado
+    book = Book.fromFrame(uncached(data.dbLoadBook)(PROD, YEAR, CATEGORIES, SHIPMENTS))
+    book.revalue(Decimal('5.55'), decimals=False)
+
+
+def _insertTrade():
+    # formulário do Insert Trade com todas as categorias x embarques
+    legs = [(PROD, cat, ship, YEAR, 'Purchase', 10, Decimal('5.00'), Decimal('50.00'))
+            for cat in CATEGORIES for ship in SHIPMENTS]
+    data.dbInsertTrades(legs)
+
+
+def _insertMtm():
+    data.dbRevalueMtm(PROD, YEAR, Decimal('5.55'), CATEGORIES, SHIPMENTS)
+
+
+def _jobMtm():
+    # mesmo Insert MTM pela fila: envio até o job terminar (lotes de JOB_BATCH)
+    job = jobs.jobWait(jobs.jobSubmitRevalue(PROD, YEAR, Decimal('5.55'), CATEGORIES, SHIPMENTS))
+    if job['status'] != 'done':
+        raise RuntimeError(f"job {job['id']}: {job['status']} {job['error']}")
+
+
+# (nome, chamada, escreve?)
+SCENARIOS = [
+    ('startup.import', lambda: _startup('import'), False),
+    ('startup.firstQuery', lambda: _startup('firstQuery'), False),
+    ('startup.app', lambda: _startup('app'), False),
+    ('dbLoadPnl', lambda: uncached(data.dbLoadPnl)(PROD, YEAR), False),
+    ('dbLoadPos', lambda: uncached(data.dbLoadPos)(PROD, YEAR), False),
+    ('dbLoadMtm', lambda: uncached(data.dbLoadMtm)(PROD, YEAR), False),
+    ('dbLoadOverview', lambda: uncached(data.dbLoadOverview)(YEAR, BENCH_PRODS), False),
+    ('dbLoadPanels', _panels, False),
+    ('dbLoadBook', lambda: uncached(data.dbLoadBook)(PROD, YEAR), False),
+    ('dbLoadPnlBuckets.week', lambda: uncached(data.dbLoadPnlBuckets)(PROD, 'week'), False),
+    ('dbLoadGraphPnl', lambda: (data.dbCacheClear(), data.dbLoadGraphPnl(PROD)), False),
+    ('dbLoadTrade', lambda: uncached(data.dbLoadTrade)(), False),
+    ('tradeLog.firstPage', lambda: uncached(data.dbLoadTradePage)(prod=PROD, limit=PAGE_SIZE), False),
+    ('tradeLog.20pages', _pages, False),
+    ('tradeLog.estimate', lambda: uncached(data.dbEstimateTrades)(prod=PROD), False),
+    ('insertMtm.preview', _preview, False),
+    ('insertTrade', _insertTrade, True),
+    ('insertMtm', _insertMtm, True),
+    ('jobs.insertMtm', _jobMtm, True),
+]
+
+
+def measure(call, repeat, warmup=1):
+    for _ in range(warmup):
+        call()
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        call()
+        times.append((time.perf_counter() - t0) * 1000)
+    times.sort()
+    return {'median_ms': round(statistics.median(times), 3), 'min_ms': round(times[0], 3),
+            'max_ms': round(times[-1], 3), 'runs': len(times)}
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    with data.dbConnection() as conn:
+        server = conn.server_version
+    return {'commit': commit, 'python': platform.python_version(), 'postgres': server,
+            'machine': platform.machine(), 'at': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def run(repeat, only=None, skip=(), maxFullRows=1000000, readOnly=False):
+    results = {}
+    rows = counts()
+    for name, call, writes in SCENARIOS:
+        if (only and name not in only) or name in skip or (writes and readOnly):
+            continue
+        if name == 'dbLoadTrade' and rows['trades'] > maxFullRows:
+            # carrega tradeTb inteira: fora da escala, só com --max-full-rows maior
+            continue
+        results[name] = measure(call, repeat)
+        print(f"{name:24} {results[name]['median_ms']:10.1f} ms  (min {results[name]['min_ms']:.1f}, "
+              f"max {results[name]['max_ms']:.1f})", file=sys.stderr)
+    return results
+
+
+def compare(current, baseline, threshold, minMs):
+    # Lista (nome, base, atual, razão) e os nomes que regrediram
+    rows, regressions = [], []
+    for name, result in current['scenarios'].items():
+        base = baseline['scenarios'].get(name)
+        if base is None:
+            continue
+        old, new = base['median_ms'], result['median_ms']
+        ratio = new / old if old else float('inf')
+        rows.append((name, old, new, ratio))
+        if new > old * (1 + threshold) and new - old > minMs:
+            regressions.append(name)
+    return rows, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Suíte de benchmarks do PNL System')
+    parser.add_argument('--scale', default='10k', help='trades gerados: 1k, 10k, 100k, 1m, 10m ou um inteiro')
+    parser.add_argument('--marks', help='linhas de mtmtb (padrão: 3x os trades)')
+    parser.add_argument('--days', type=int, default=250, help='dias úteis cobertos pelas datas')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', nargs='*', help='só estes cenários')
+    parser.add_argument('--skip', nargs='*', default=[], help='pula estes cenários')
+    parser.add_argument('--read-only', action='store_true', help='pula os cenários de escrita')
+    parser.add_argument('--max-full-rows', type=int, default=1000000,
+                        help='acima disso dbLoadTrade (tabela inteira) não roda')
+    parser.add_argument('--reuse', action='store_true', help='reaproveita o livro (de um --keep anterior) se as contagens baterem')
+    parser.add_argument('--keep', action='store_true', help='não apaga o livro sintético no fim')
+    parser.add_argument('-o', '--output', help='arquivo JSON de saída (padrão: stdout)')
+    parser.add_argument('--baseline', help='JSON de referência para checar regressão')
+    parser.add_argument('--threshold', type=float, default=0.2, help='regressão tolerada (0.2 = 20%%)')
+    parser.add_argument('--min-ms', type=float, default=1.0, help='diferença mínima para contar como regressão')
+    parser.add_argument('--compare', help='compara este JSON com --baseline sem rodar nada')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        if not args.baseline:
+            parser.error('--compare requer --baseline')
+        with open(args.compare) as f:
+            report = json.load(f)
+    else:
+        requireDsn()
+        trades = parseScale(args.scale)
+        marks = parseScale(args.marks) if args.marks else 3 * trades
+        loaded = generate(trades, marks, days=args.days, reuse=args.reuse)
+        print(f"livro: {trades} trades, {marks} marcas"
+              + (" (reaproveitado)" if loaded['reused'] else f" gerado em {loaded['seconds']:.1f}s"),
+              file=sys.stderr)
+        try:
+            report = {'meta': dict(environment(), scale=args.scale, trades=trades, marks=marks,
+                                   days=args.days, repeat=args.repeat),
+                      'scenarios': run(args.repeat, args.only, args.skip, args.max_full_rows, args.read_only)}
+        finally:
+            if not args.keep:
+                cleanup()
+        text = json.dumps(report, indent=2)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(text + '\n')
+        else:
+            print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        rows, regressions = compare(report, baseline, args.threshold, args.min_ms)
+        for name, old, new, ratio in rows:
+            flag = '  REGRESSÃO' if name in regressions else ''
+            print(f"{name:24} {old:10.1f} -> {new:10.1f} ms  x{ratio:5.2f}{flag}", file=sys.stderr)
+        if regressions:
+            print(f"{len(regressions)} cenário(s) acima de {args.threshold:.0%}: {', '.join(regressions)}",
+                  file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
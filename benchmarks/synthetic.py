@@ -0,0 +1,140 @@
+# Gerador de livro sintético para os benchmarks: trades, histórico de posição
+# e marcas diárias coerentes entre si, gerados no próprio banco
+# (generate_series) para chegar a 10M de linhas sem passar pelo Python.
+#
+#   trades   i = 0..n-1 espalhados por 5 produtos x 3 categorias x 12 embarques
+#            x 10 anos (2090-2099), datas crescentes em `days` dias
+#   posTb    uma linha por trade: soma acumulada das pernas da chave, como
+#            dbInsertTrades grava
+#   mtmtb    `marks` linhas; a rodada r marca cada trade uma vez, do dia do
+#            trade até o último dia. mtm segue uma curva por (chave, dia) e o
+#            pnl usa a marca anterior do trade (ou lvl), como dbRevalueMtm
+#
+# setseed torna ton/op/lvl iguais entre execuções com os mesmos parâmetros.
+# Os produtos são os de common.BENCH_PRODS (conversão 1), então cleanup()
+# apaga tudo que foi gerado.
+import time
+
+import data
+from benchmarks.common import BENCH_PRODS, CATEGORIES, SHIPMENTS, cleanup
+
+BASE_DATE = '2090-01-01'
+SCALES = {'1k': 1000, '10k': 10000, '100k': 100000, '1m': 1000000, '10m': 10000000}
+
+TRADES = """
+    INSERT INTO tradeTb(prod, cat, ship, year, op, ton, lvl, notion, date, reg)
+    SELECT prod, cat, ship, year, op, ton, lvl, lvl * ton, DATE %(base)s + day,
+           TIMESTAMP %(base)s + day * INTERVAL '1 day' + (i %% 86400) * INTERVAL '1 second'
+    FROM (
+        SELECT i, (%(prods)s)[1 + i %% 5] AS prod, (%(cats)s)[1 + (i / 5) %% 3] AS cat,
+               (%(ships)s)[1 + (i / 15) %% 12] AS ship, 2090 + (i / 180) %% 10 AS year,
+               CASE WHEN random() < 0.5 THEN 'Sale' ELSE 'Purchase' END AS op,
+               1 + (random() * 499)::integer AS ton,
+               round((0.5 + random() * 9)::numeric, 2) AS lvl,
+               (i::bigint * %(days)s / %(n)s)::integer AS day
+        FROM generate_series(0, %(n)s - 1) i
+    ) g
+    ORDER BY i;
+"""
+
+POSITIONS = """
+    INSERT INTO posTb(prod, cat, ship, year, pos, date, reg)
+    SELECT prod, cat, ship, year,
+           SUM(CASE WHEN op = 'Purchase' THEN ton ELSE -ton END)
+               OVER (PARTITION BY prod, cat, ship, year ORDER BY id),
+           date, reg
+    FROM tradeTb
+    WHERE prod = ANY(%(prods)s)
+    ORDER BY id;
+"""
+
+MARKS = """
+    WITH t AS (
+        SELECT id, prod, cat, ship, year, op, ton, lvl, date - DATE %(base)s AS tradeDay,
+               row_number() OVER (ORDER BY id) - 1 AS i
+        FROM tradeTb
+        WHERE prod = ANY(%(prods)s)
+    ),
+    m AS (
+        SELECT j, t.id, t.prod, t.cat, t.ship, t.year, t.op, t.ton, t.lvl, j / %(n)s AS r,
+               t.tradeDay + ((%(days)s - 1 - t.tradeDay) * (j / %(n)s)) / %(rounds)s AS day,
+               (t.i %% 1800)::float8 AS key
+        FROM generate_series(0, %(marks)s - 1) j
+        JOIN t ON t.i = j %% %(n)s
+    ),
+    v AS (
+        SELECT m.*, round((5 + 4 * sin(day / 15.0 + key))::numeric, 2) AS mtm
+        FROM m
+    )
+    INSERT INTO mtmtb(idTrade, prod, cat, ship, year, mtm, pnl, date, reg)
+    SELECT id, prod, cat, ship, year, mtm,
+           CASE WHEN op = 'Sale' THEN prev - mtm ELSE mtm - prev END * ton,
+           DATE %(base)s + day,
+           TIMESTAMP %(base)s + day * INTERVAL '1 day' + r * INTERVAL '1 second'
+                                + (id %% 3600) * INTERVAL '1 millisecond'
+    FROM (
+        SELECT v.*, COALESCE(LAG(mtm) OVER (PARTITION BY id ORDER BY r), lvl) AS prev
+        FROM v
+    ) w
+    ORDER BY day, r, id;
+"""
+
+
+def parseScale(value):
+    # '1k', '250k', '10m' ou inteiro
+    value = str(value).strip().lower()
+    if value in SCALES:
+        return SCALES[value]
+    for suffix, factor in (('k', 1000), ('m', 1000000)):
+        if value.endswith(suffix):
+            return int(float(value[:-1]) * factor)
+    return int(value)
+
+
+def counts():
+    with data.dbConnection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT (SELECT count(*) FROM tradeTb WHERE prod = ANY(%(p)s)),
+                   (SELECT count(*) FROM posTb WHERE prod = ANY(%(p)s)),
+                   (SELECT count(*) FROM mtmtb WHERE prod = ANY(%(p)s));
+        """, {'p': BENCH_PRODS})
+        trades, positions, marks = cursor.fetchone()
+        cursor.close()
+    return {'trades': trades, 'positions': positions, 'marks': marks}
+
+
+def generate(trades, marks=None, days=250, seed=0.42, reuse=False):
+    # Gera o livro sintético (apagando o anterior). Com reuse, mantém o que já
+    # existe se as contagens baterem. Devolve as contagens e o tempo de carga.
+    marks = trades if marks is None else marks
+    expected = {'trades': trades, 'positions': trades, 'marks': marks}
+    if reuse and counts() == expected:
+        return dict(expected, seconds=0.0, reused=True)
+    t0 = time.perf_counter()
+    data.dbCreateTable()
+    cleanup()
+    params = {'prods': BENCH_PRODS, 'cats': CATEGORIES, 'ships': SHIPMENTS, 'base': BASE_DATE,
+              'n': trades, 'marks': marks, 'days': days, 'rounds': max(-(-marks // trades), 1)}
+    with data.dbConnection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT setseed(%s);", (seed,))
+            cursor.execute(TRADES, params)
+            cursor.execute(POSITIONS, params)
+            if marks:
+                cursor.execute(MARKS, params)
+            conn.commit()
+            data._bumpVersion('tradeTb', 'mtmtb', 'posTb')
+        except Exception as e:
+            print(f'Erro generate: {e}')
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+        # ANALYZE fora da transação da carga, para os planos refletirem o volume
+        cursor = conn.cursor()
+        cursor.execute("ANALYZE tradeTb; ANALYZE mtmtb; ANALYZE posTb; ANALYZE mtmCurTb; ANALYZE posCurTb; ANALYZE pnltb;")
+        conn.commit()
+        cursor.close()
+    return dict(expected, seconds=time.perf_counter() - t0, reused=False)
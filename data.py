@@ -1,58 +1,794 @@
+import csv
+import functools
+import io
+import itertools
+import json
+import os
+import selectors
+import threading
+import time
+import weakref
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+from decimal import Decimal
+
 import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
 import pandas as pd
 
+import metrics
+from metrics import instrumented
+
+PRODUCTS = ["SoyBean", "SoyMeal", "YelCorn"]
+
+def prodKey(prod):
+    # Grafia canônica do produto: permite filtrar com prod = %s (usa os índices)
+    # em vez de prod ILIKE %s, que obriga a varrer a tabela.
+    prod = str(prod).strip()
+    for p in PRODUCTS:
+        if p.lower() == prod.lower():
+            return p
+    return prod
+
+def get_conversion_value(prod: str) -> Decimal:
+    if prod == "SoyBean":
+        return Decimal("36.7454")
+    elif prod == "SoyMeal":
+        return Decimal("1.1023")
+    elif prod == "YelCorn":
+        return Decimal("39.3678")
+    else:
+        return Decimal("1")
+
 # Connect and Close
 
-def dbConn():
+# Tamanho do pool e limites; ajustáveis por variável de ambiente
+POOL_SIZE = int(os.environ.get('PNL_POOL_SIZE', 8))
+POOL_TIMEOUT = float(os.environ.get('PNL_POOL_TIMEOUT', 30))          # espera máx. por conexão livre (s)
+POOL_PING_AFTER = float(os.environ.get('PNL_POOL_PING_AFTER', 60))    # ociosa há mais que isso -> SELECT 1 no checkout
+QUERY_TIMEOUT = int(os.environ.get('PNL_QUERY_TIMEOUT', 15000))       # statement_timeout dos loaders concorrentes (ms)
+
+CONNECT_TIMEOUT = int(os.environ.get('PNL_CONNECT_TIMEOUT', 5))      # limite de cada conexão nova (s)
+POOL_WARM = int(os.environ.get('PNL_POOL_WARM', 2))                   # conexões abertas em background na partida
+
+# Réplicas de leitura (ver "Roteamento de leituras" abaixo)
+REPLICA_DSNS = [d.strip() for d in os.environ.get('PNL_REPLICA_DSNS', '').split(';') if d.strip()]
+REPLICA_POOL_SIZE = int(os.environ.get('PNL_REPLICA_POOL_SIZE', POOL_SIZE))
+REPLICA_RETRY = float(os.environ.get('PNL_REPLICA_RETRY', 30))        # réplica que falhou fica fora por isso (s)
+REPLICA_MAX_LAG = float(os.environ.get('PNL_REPLICA_MAX_LAG', 5))     # atraso de replay aceito (s)
+REPLICA_CHECK = float(os.environ.get('PNL_REPLICA_CHECK', 10))        # intervalo entre medições de atraso (s)
+REPLICA_WINDOW = float(os.environ.get('PNL_REPLICA_WINDOW', REPLICA_MAX_LAG))  # após escrita, leitura de réplica não vai ao cache (s)
+
+# Parâmetros de conexão resolvidos uma vez por processo, na ordem:
+# PNL_DSN (benchmarks, ambientes locais), Streamlit Secrets [postgres]
+# (produção/Supabase) e o banco local de desenvolvimento. A escolha é pela
+# configuração presente, não por tentativa: se o banco escolhido não
+# responder, a conexão falha em CONNECT_TIMEOUT em vez de cair em outro banco.
+_dsn = None
+_dsnLock = threading.Lock()
+
+def _secrets():
+    # streamlit só é importado aqui (CLI, importer e benchmarks não precisam dele)
     try:
-        # Tenta usar as credenciais do Streamlit Secrets (produção)
-        conn = psycopg2.connect(
-            host=st.secrets["postgres"]["host"],
-            database=st.secrets["postgres"]["database"],
-            user=st.secrets["postgres"]["user"],
-            password=st.secrets["postgres"]["password"],
-            port=st.secrets["postgres"]["port"],
-            sslmode='require'  # IMPORTANTE para Supabase
-        )
-        return conn
-    except Exception as e:
-        print(f'Erro conexão com Supabase: {e}')
-        # Fallback para desenvolvimento local
+        import streamlit as st
+        return dict(st.secrets["postgres"])
+    except Exception:
+        return None
+
+def dbDsn():
+    global _dsn
+    if _dsn is None:
+        with _dsnLock:
+            if _dsn is None:
+                dsn = os.environ.get('PNL_DSN')
+                secrets = None if dsn else _secrets()
+                if dsn:
+                    _dsn = ('PNL_DSN', {'dsn': dsn})
+                elif secrets:
+                    missing = [k for k in ('host', 'database', 'user', 'password') if not secrets.get(k)]
+                    if missing:
+                        raise ConnectionError(
+                            f"Parâmetros de conexão incompletos: {', '.join(missing)}. "
+                            "Verifique .streamlit/secrets.toml (local) ou Secrets no Streamlit Cloud."
+                        )
+                    _dsn = ('secrets', dict(
+                        host=secrets['host'], database=secrets['database'], user=secrets['user'],
+                        password=secrets['password'], port=secrets.get('port', 5432),
+                        sslmode='require'  # IMPORTANTE para Supabase
+                    ))
+                else:
+                    # Fallback para desenvolvimento local
+                    _dsn = ('local', dict(host='localhost', database='PNL', user='ZenNohDev', password='Zgbr@2025'))
+    return _dsn
+
+# Alvos de conexão: 'primary' (dbDsn) e uma entrada por réplica, de
+# PNL_REPLICA_DSNS ou, com Secrets, de [postgres] replicas = ["host", ...]
+# (mesmas credenciais do primário, só o host muda).
+_targets = None
+
+def dbTargets():
+    global _targets
+    if _targets is None:
+        primary = dbDsn()
+        with _dsnLock:
+            if _targets is None:
+                targets = {'primary': primary}
+                if REPLICA_DSNS:
+                    for i, dsn in enumerate(REPLICA_DSNS, 1):
+                        targets[f'replica{i}'] = ('PNL_REPLICA_DSNS', {'dsn': dsn})
+                elif primary[0] == 'secrets':
+                    for i, host in enumerate((_secrets() or {}).get('replicas', []), 1):
+                        targets[f'replica{i}'] = ('secrets', dict(primary[1], host=host))
+                _targets = targets
+    return _targets
+
+def _dbNewConn(target='primary'):
+    source, params = dbTargets()[target]
+    try:
+        return psycopg2.connect(**params, connect_timeout=CONNECT_TIMEOUT)
+    except psycopg2.Error as e:
+        # exceção clara para o chamador (não retornar None)
+        raise ConnectionError(f"Erro conexão ao banco de dados ({source}/{target}): {e}") from e
+
+
+class DbPool:
+    # Pool de conexões thread-safe: checkout com health check, descarte de
+    # sockets mortos e contadores de pressão (checkouts, waits, connects).
+    def __init__(self, connect, size=8, timeout=30.0, pingAfter=60.0):
+        self._connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.pingAfter = pingAfter
+        self._idle = deque()            # (conn, instante em que voltou ao pool)
+        self._used = set()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self.stats = {'checkouts': 0, 'waits': 0, 'connects': 0, 'reconnects': 0}
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _healthy(self, conn, idleSince):
+        if conn.closed:
+            return False
+        if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        # ociosa com o socket legível: o servidor encerrou a conexão (restart,
+        # failover); detectado sem ida ao banco. selectors e não select.select,
+        # que falha com descritor >= 1024 (servidor longo com muitas conexões)
         try:
-            return psycopg2.connect(
-                host='localhost', 
-                database='PNL',
-                user='ZenNohDev', 
-                password='Zgbr@2025'
-            )
-        except Exception as e2:
-            print(f'Erro conexão local: {e2}')
-            return None
-
-        # validação mínima
-        if not all([host, database, user, password]):
-            raise ConnectionError(
-                "Parâmetros de conexão incompletos: host/database/user/password. "
-                "Verifique .streamlit/secrets.toml (local) ou Secrets no Streamlit Cloud."
-            )
-
-        conn = psycopg2.connect(
-            host=host,
-            database=database,
-            user=user,
-            password=password,
-            port=port,
-            connect_timeout=10
-        )
-        return conn
+            with selectors.DefaultSelector() as selector:
+                selector.register(conn, selectors.EVENT_READ)
+                if selector.select(0):
+                    return False
+        except (ValueError, OSError):
+            return False
+        if time.monotonic() - idleSince < self.pingAfter:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self):
+        t0 = time.perf_counter()
+        self._count('checkouts')
+        if not self._slots.acquire(blocking=False):
+            self._count('waits')
+            if not self._slots.acquire(timeout=self.timeout):
+                raise ConnectionError(f'Pool esgotado: nenhuma conexão livre em {self.timeout}s')
+        try:
+            conn = None
+            while conn is None:
+                with self._lock:
+                    if not self._idle:
+                        break
+                    conn, idleSince = self._idle.pop()
+                if not self._healthy(conn, idleSince):
+                    # socket velho/quebrado: descarta e tenta a próxima
+                    self._count('reconnects')
+                    self._discard(conn)
+                    conn = None
+            if conn is None:
+                conn = self._connect()
+                if conn is None:
+                    raise ConnectionError('Erro conexão ao banco de dados')
+                self._count('connects')
+                # cursores medidos (tempo, linhas, bytes, consultas lentas)
+                conn.cursor_factory = metrics.TimingCursor
+            with self._lock:
+                self._used.add(id(conn))
+            metrics.registry.recordAcquire(time.perf_counter() - t0)
+            return conn
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, close=False):
+        with self._lock:
+            if id(conn) not in self._used:
+                # conexão que não saiu deste pool
+                self._discard(conn)
+                return
+            self._used.discard(id(conn))
+        try:
+            if not close and not conn.closed:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+                return
+            self._discard(conn)
+        except psycopg2.Error:
+            self._discard(conn)
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, size=self.size, idle=len(self._idle), inUse=len(self._used))
+
+
+# O módulo fica em sys.modules entre reruns do Streamlit, então o pool é
+# único por processo e compartilhado por todas as sessões.
+_pool = None
+_poolLock = threading.Lock()
 
+def dbPool():
+    global _pool
+    if _pool is None:
+        with _poolLock:
+            if _pool is None:
+                _pool = DbPool(_dbNewConn, size=POOL_SIZE, timeout=POOL_TIMEOUT, pingAfter=POOL_PING_AFTER)
+    return _pool
+
+def dbPoolStats():
+    stats = dbPool().snapshot()
+    stats['source'] = _dsn[0] if _dsn else None
+    stats['warm'] = dict(_warm)
+    if _targets and len(_targets) > 1:
+        stats['reads'] = dict(_reads)
+        stats['replicas'] = dbReplicaStats()
+    return stats
+
+# Aquecimento: abre POOL_WARM conexões numa thread daemon logo na partida, para
+# o primeiro clique não pagar o handshake (TLS no Supabase). Erros só ficam
+# registrados em _warm: a primeira consulta de verdade refaz a conexão e
+# mostra o erro ao usuário.
+_warm = {'started': None, 'ms': None, 'conns': 0, 'error': None}
+_warmer = None
+_warmerLock = threading.Lock()
+
+def _warmPool(n):
+    t0 = time.perf_counter()
+    pool, conns = dbPool(), []
+    try:
+        for _ in range(min(n, pool.size)):
+            conns.append((pool, pool.getconn()))
+        _startListener()
+        # réplicas: falha aqui só tira a réplica da rotação
+        for target in list(dbTargets())[1:]:
+            replica = _replicaPool(target)
+            try:
+                for _ in range(min(n, replica.size)):
+                    conns.append((replica, replica.getconn()))
+            except Exception as e:
+                _replicaDown(target, e)
+        _warm['conns'] = len(conns)
     except Exception as e:
-        # Lança exceção clara para o chamador (não retornar None)
-        raise ConnectionError(f"Erro conexão ao banco de dados: {e}")
-    
-def dbClose(conn):
+        print(f'Erro aquecimento pool: {e}')
+        _warm['error'] = str(e)
+    finally:
+        for owner, conn in conns:
+            owner.putconn(conn)
+        _warm['ms'] = round((time.perf_counter() - t0) * 1000, 1)
+
+def dbWarmPool(n=None):
+    global _warmer
+    if _warmer is not None:
+        return _warmer
+    with _warmerLock:
+        if _warmer is None:
+            _warm['started'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+            _warmer = threading.Thread(target=_warmPool, args=(POOL_WARM if n is None else n,),
+                                       name='pnl-pool-warmup', daemon=True)
+            _warmer.start()
+    return _warmer
+
+@instrumented
+def dbConn():
+    # statement_timeout da thread (0 fora de queryTimeout) já aplicado: a
+    # conexão do pool pode voltar com o limite de um painel anterior
+    conn = dbPool().getconn()
+    try:
+        _applyTimeout(conn)
+    except Exception:
+        dbClose(conn, discard=True)
+        raise
+    return conn
+
+def dbClose(conn, discard=False):
     if conn:
-        conn.close()
+        dbPool().putconn(conn, close=discard)
+
+# Roteamento de leituras
+# Loaders do dashboard pedem dbConnection(readonly=True) e vão para as réplicas
+# em round-robin, cada uma com seu pool. Escritas, jobs, o listener e as
+# leituras que precisam ver a própria escrita (dbFetch*, dbClosedPeriods)
+# ficam no primário. Réplica que não conecta ou perde a conexão no meio da
+# consulta sai da rotação por REPLICA_RETRY s; a cada REPLICA_CHECK s o atraso
+# de replay é medido na própria conexão do checkout e, acima de
+# REPLICA_MAX_LAG, a réplica sai até a próxima medição. Sem réplica
+# disponível a leitura vai ao primário.
+# Até REPLICA_WINDOW s depois de uma escrita commitada (neste processo, ou em
+# outro via LISTEN) a réplica pode ainda não ter a escrita: o resultado vale
+# para a chamada mas não entra no cache, que já está na versão nova.
+_replicaPools = {}
+_replicas = {}                  # réplica -> estado de saúde e contadores
+_replicaLock = threading.Lock()
+_reads = {'replica': 0, 'primary': 0, 'uncached': 0, 'fallback': 0}
+_rr = itertools.count()
+_lastWrite = float('-inf')
+
+# Atraso = tempo desde a última transação aplicada, mas só se ainda há WAL
+# recebido por aplicar: com o primário ocioso o replay_timestamp envelhece sem
+# haver atraso. Réplica recém-iniciada recebe a partir do início do segmento
+# (recebido < aplicado) e também conta como em dia.
+LAG_QUERY = """
+    SELECT pg_is_in_recovery(),
+           CASE WHEN NOT pg_is_in_recovery()
+                  OR COALESCE(pg_last_wal_receive_lsn(), '0/0') <= pg_last_wal_replay_lsn() THEN 0
+                ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+           END;
+"""
+
+def _replicaPool(target):
+    with _replicaLock:
+        if target not in _replicaPools:
+            _replicaPools[target] = DbPool(functools.partial(_dbNewConn, target), size=REPLICA_POOL_SIZE,
+                                           timeout=POOL_TIMEOUT, pingAfter=POOL_PING_AFTER)
+            _replicas[target] = {'downUntil': 0.0, 'checked': 0.0, 'lag': None, 'recovery': None,
+                                 'reads': 0, 'failures': 0, 'error': None}
+        return _replicaPools[target]
+
+def _replicaDown(target, error, seconds=None):
+    print(f'Erro réplica {target}: {error}')
+    with _replicaLock:
+        state = _replicas[target]
+        state['downUntil'] = time.monotonic() + (REPLICA_RETRY if seconds is None else seconds)
+        state['failures'] += 1
+        state['error'] = str(error)
+    # conexões ociosas da réplica provavelmente morreram junto
+    _replicaPools[target].closeall()
+
+def _checkLag(target, conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(LAG_QUERY)
+        recovery, lag = cursor.fetchone()
+    finally:
+        cursor.close()
+        conn.rollback()
+    with _replicaLock:
+        _replicas[target].update(checked=time.monotonic(), lag=float(lag), recovery=recovery)
+    return float(lag)
+
+def _replicaConn(target):
+    # Conexão da réplica ou None (fora da rotação / sem conexão / atrasada)
+    pool = _replicaPool(target)
+    if _replicas[target]['downUntil'] > time.monotonic():
+        return None
+    try:
+        conn = pool.getconn()
+    except ConnectionError as e:
+        _replicaDown(target, e)
+        return None
+    try:
+        if time.monotonic() - _replicas[target]['checked'] >= REPLICA_CHECK:
+            lag = _checkLag(target, conn)
+            if lag > REPLICA_MAX_LAG:
+                pool.putconn(conn)
+                _replicaDown(target, f'atraso de {lag:.1f}s', REPLICA_CHECK)
+                return None
+    except psycopg2.Error as e:
+        pool.putconn(conn, close=True)
+        _replicaDown(target, e)
+        return None
+    return conn
+
+def _countRead(route, target=None):
+    with _replicaLock:
+        _reads[route] += 1
+        if target is not None:
+            _replicas[target]['reads'] += 1
+
+def _readConn():
+    # (conexão, alvo) para uma leitura: próxima réplica disponível ou o primário
+    names = list(dbTargets())[1:]
+    if names:
+        start = next(_rr)
+        for i in range(len(names)):
+            target = names[(start + i) % len(names)]
+            conn = _replicaConn(target)
+            if conn is not None:
+                _countRead('replica', target)
+                if time.monotonic() - _lastWrite < REPLICA_WINDOW:
+                    _local.uncached = True
+                    _countRead('uncached')
+                return conn, target
+        _countRead('fallback')
+    _countRead('primary')
+    return dbConn(), 'primary'
+
+def dbReplicaSettled():
+    # False até REPLICA_WINDOW s depois de uma escrita, havendo réplicas: o que
+    # for lido agora pode não ter a escrita e não deve ir para caches de fora
+    # deste módulo (sessão do Streamlit), como já não vai para o _cache
+    return len(dbTargets()) == 1 or time.monotonic() - _lastWrite >= REPLICA_WINDOW
+
+def dbReplicaStats():
+    # Estado de cada réplica, sem credenciais
+    out = {}
+    now = time.monotonic()
+    for target, (source, params) in list(dbTargets().items())[1:]:
+        pool = _replicaPool(target)
+        info = psycopg2.extensions.parse_dsn(params['dsn']) if 'dsn' in params else params
+        with _replicaLock:
+            state = dict(_replicas[target])
+        downUntil = state.pop('downUntil')
+        out[target] = dict(state, host=info.get('host'), port=info.get('port'),
+                           up=downUntil <= now, retryIn=round(max(downUntil - now, 0), 1),
+                           pool=pool.snapshot())
+    return out
+
+def dbCheckReplicas():
+    # Mede todos os alvos agora (conexão nova, fora dos pools): tempo de
+    # conexão, se está em recovery e o atraso. Réplicas com falha saem da
+    # rotação; as boas voltam.
+    report = {}
+    for target in dbTargets():
+        t0 = time.perf_counter()
+        row = {'ok': False, 'connectMs': None, 'recovery': None, 'lag': None, 'error': None}
+        try:
+            conn = _dbNewConn(target)
+            try:
+                row['connectMs'] = round((time.perf_counter() - t0) * 1000, 1)
+                cursor = conn.cursor()
+                cursor.execute(LAG_QUERY)
+                row['recovery'], lag = cursor.fetchone()
+                row['lag'] = float(lag)
+                cursor.close()
+            finally:
+                conn.close()
+            row['ok'] = row['lag'] <= REPLICA_MAX_LAG
+            if not row['ok']:
+                row['error'] = f"atraso de {row['lag']:.1f}s"
+        except Exception as e:
+            row['error'] = str(e)
+        if target != 'primary':
+            _replicaPool(target)
+            if row['ok']:
+                with _replicaLock:
+                    _replicas[target].update(downUntil=0.0, checked=time.monotonic(), lag=row['lag'],
+                                             recovery=row['recovery'], error=None)
+            else:
+                _replicaDown(target, row['error'])
+        report[target] = row
+    return report
+
+# statement_timeout por thread: enquanto um queryTimeout estiver ativo, as
+# conexões entregues por dbConn/dbConnection usam esse limite; fora dele, 0. O SET é de sessão e
+# só é enviado quando o valor da conexão muda, para não custar uma ida ao
+# banco a cada consulta.
+_local = threading.local()
+_connTimeouts = weakref.WeakKeyDictionary()     # conexão -> statement_timeout atual (ms)
+
+@contextmanager
+def queryTimeout(ms):
+    previous = getattr(_local, 'timeout', None)
+    _local.timeout = ms
+    try:
+        yield
+    finally:
+        _local.timeout = previous
+
+def _applyTimeout(conn):
+    timeout = int(getattr(_local, 'timeout', None) or 0)
+    if _connTimeouts.get(conn, 0) != timeout:
+        cursor = conn.cursor()
+        cursor.execute("SET statement_timeout = %s;", (timeout,))
+        cursor.close()
+        conn.commit()
+        _connTimeouts[conn] = timeout
+
+@contextmanager
+def dbConnection(readonly=False):
+    # readonly=True: pode ir para uma réplica (ver Roteamento de leituras)
+    if not readonly:
+        conn = dbConn()
+        try:
+            yield conn
+        finally:
+            dbClose(conn)
+        return
+    conn, target = _readConn()
+    try:
+        _applyTimeout(conn)
+        yield conn
+    except psycopg2.Error as e:
+        if target != 'primary' and conn.closed:
+            _replicaDown(target, e)
+        raise
+    finally:
+        if target == 'primary':
+            dbClose(conn)
+        else:
+            _replicaPools[target].putconn(conn)
+
+# Cache de resultados
+# Cada tabela de histórico tem um contador de versão, incrementado quando uma
+# escrita commita (neste processo, ou em outro via LISTEN/NOTIFY). Entradas do
+# cache guardam as versões das tabelas de que dependem e viram miss quando
+# alguma muda. O TTL limita a defasagem quando o LISTEN está desligado.
+CACHE_SIZE = int(os.environ.get('PNL_CACHE_SIZE', 256))
+CACHE_TTL = float(os.environ.get('PNL_CACHE_TTL', 60))
+CACHE_LISTEN = os.environ.get('PNL_CACHE_LISTEN', '') not in ('', '0')
+CACHE_CHANNEL = 'pnl_cache'
+
+_tableVersions = {'tradetb': 0, 'mtmtb': 0, 'postb': 0}
+_versionLock = threading.Lock()
+
+def _bumpVersion(*tables):
+    global _lastWrite
+    _lastWrite = time.monotonic()
+    with _versionLock:
+        for table in tables:
+            table = table.lower()
+            _tableVersions[table] = _tableVersions.get(table, 0) + 1
+
+def _versions(tables):
+    with _versionLock:
+        return tuple(_tableVersions.get(t, 0) for t in tables)
+
+
+class ResultCache:
+    # LRU limitado; valor válido enquanto as versões batem e o TTL não venceu
+    def __init__(self, maxsize=256, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()      # key -> (versões, expira em, valor)
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'stale': 0, 'evictions': 0}
+
+    def get(self, key, versions):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.stats['misses'] += 1
+                return False, None
+            if item[0] != versions or item[1] <= time.monotonic():
+                del self._data[key]
+                self.stats['stale'] += 1
+                self.stats['misses'] += 1
+                return False, None
+            self._data.move_to_end(key)
+            self.stats['hits'] += 1
+            return True, item[2]
+
+    def put(self, key, versions, value):
+        with self._lock:
+            self._data[key] = (versions, time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, size=len(self._data), maxsize=self.maxsize, ttl=self.ttl)
+
+
+_cache = ResultCache(CACHE_SIZE, CACHE_TTL)
+
+def _freeze(value):
+    # argumentos viram chave hashable (listas de categorias, produtos etc.)
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    return value
+
+def cached(*tables):
+    # Decorator: cacheia o resultado por função + argumentos, dependente das
+    # tabelas indicadas. DataFrames saem como cópia rasa para o chamador não
+    # alterar o objeto guardado.
+    tables = tuple(t.lower() for t in tables)
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            _startListener()
+            key = (fn.__name__, _freeze(args), _freeze(kwargs))
+            versions = _versions(tables)    # lidas antes da consulta: escrita concorrente invalida
+            hit, value = _cache.get(key, versions)
+            if not hit:
+                _local.uncached = False
+                value = fn(*args, **kwargs)
+                if not _local.uncached:     # réplica logo após escrita: não guarda
+                    _cache.put(key, versions, value)
+            if isinstance(value, pd.DataFrame):
+                return value.copy(deep=False)
+            return value
+        return wrapper
+    return decorator
+
+def dbCacheStats():
+    return dict(_cache.snapshot(), versions=dict(_tableVersions), listening=_listener is not None)
+
+def dbCacheClear():
+    _cache.clear()
+
+def dbDataVersion(*tables):
+    # Versões atuais das tabelas; muda a cada escrita commitada (neste
+    # processo ou, com LISTEN, em outro). Serve para invalidar dados guardados
+    # fora deste cache, como o estado de sessão do Streamlit.
+    return _versions(tuple(t.lower() for t in tables))
+
+
+# Invalidação entre processos: triggers fazem pg_notify('pnl_cache', <tabela>)
+# a cada escrita (entregue só no commit); esta thread escuta o canal numa
+# conexão própria, fora do pool, e incrementa a versão da tabela.
+_listener = None
+_listenerLock = threading.Lock()
+
+def _listen():
+    reconnect = False
+    while True:
+        conn = None
+        try:
+            conn = _dbNewConn()
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            cursor = conn.cursor()
+            cursor.execute(f"LISTEN {CACHE_CHANNEL};")
+            if reconnect:
+                # escritas perdidas enquanto estava desconectado
+                _bumpVersion(*_tableVersions)
+            reconnect = True
+            # selectors: select.select falha com descritor >= 1024
+            with selectors.DefaultSelector() as selector:
+                selector.register(conn, selectors.EVENT_READ)
+                while True:
+                    if not selector.select(30):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        _bumpVersion(conn.notifies.pop(0).payload)
+        except Exception as e:
+            print(f'Erro listener cache: {e}')
+            time.sleep(5)
+        finally:
+            if conn is not None:
+                conn.close()
+
+def _startListener():
+    global _listener
+    if not CACHE_LISTEN or _listener is not None:
+        return
+    with _listenerLock:
+        if _listener is None:
+            _listener = threading.Thread(target=_listen, name='pnl-cache-listener', daemon=True)
+            _listener.start()
+
+# Particionamento do histórico
+# mtmtb e posTb crescem a cada MTM/trade. Com PNL_PARTITION=year (padrão) são
+# criadas particionadas por ano (RANGE), com uma partição DEFAULT para anos
+# ainda sem partição; year,prod subdivide cada ano por produto; none mantém
+# a tabela simples. A chave primária inclui as colunas de partição, como o
+# PostgreSQL exige. Bancos já existentes só mudam com `python data.py partition`.
+PARTITION = os.environ.get('PNL_PARTITION', 'year')
+PARTITION_YEARS = int(os.environ.get('PNL_PARTITION_YEARS', 2))    # anos à frente criados no setup
+HISTORY_COLUMNS = {
+    'mtmtb': """
+            idPnl   SERIAL,
+            idTrade INTEGER NOT NULL,
+            prod    VARCHAR(7) NOT NULL,
+            cat     VARCHAR(10) NOT NULL,
+            ship    VARCHAR(3) NOT NULL,
+            year    INTEGER NOT NULL,
+            mtm  NUMERIC(4,2) NOT NULL,
+            pnl  NUMERIC(11,2) NOT NULL,
+            date    DATE DEFAULT CURRENT_DATE,
+            reg     TIMESTAMP DEFAULT CURRENT_TIMESTAMP,""",
+    'posTb': """
+            id      SERIAL,
+            prod    VARCHAR(7) NOT NULL,
+            cat     VARCHAR(10) NOT NULL,
+            ship    VARCHAR(3) NOT NULL,
+            year    INTEGER NOT NULL,
+            pos     INTEGER NOT NULL,
+            date    DATE DEFAULT CURRENT_DATE,
+            reg     TIMESTAMP DEFAULT CURRENT_TIMESTAMP,""",
+}
+HISTORY_IDS = {'mtmtb': 'idPnl', 'posTb': 'id'}
+
+def _partitionKeys():
+    if PARTITION in ('', 'none'):
+        return []
+    keys = [k.strip() for k in PARTITION.split(',')]
+    if keys not in (['year'], ['year', 'prod']):
+        raise ValueError(f"PNL_PARTITION inválido: {PARTITION} (use none, year ou year,prod)")
+    return keys
+
+def _historyDdl(table):
+    keys = _partitionKeys()
+    return f"""
+        CREATE TABLE IF NOT EXISTS {table}({HISTORY_COLUMNS[table]}
+            PRIMARY KEY ({', '.join([HISTORY_IDS[table]] + keys)})
+        ){' PARTITION BY RANGE (year)' if keys else ''};
+    """
+
+def _isPartitioned(cursor, table):
+    cursor.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s);", (table,))
+    row = cursor.fetchone()
+    return bool(row and row[0])
+
+def _ensurePartition(cursor, table, year):
+    # Cria a partição do ano (e as de produto, se for o caso), movendo para ela
+    # as linhas do ano que estavam na DEFAULT. Devolve se criou.
+    name = f"{table.lower()}_y{int(year)}"
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL;", (name,))
+    if cursor.fetchone()[0]:
+        return False
+    byProd = 'prod' in _partitionKeys()
+    cursor.execute(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+                   f"{' PARTITION BY LIST (prod)' if byProd else ''};")
+    if byProd:
+        for prod in PRODUCTS:
+            cursor.execute(f"CREATE TABLE {name}_{prod.lower()} PARTITION OF {name} FOR VALUES IN (%s);", (prod,))
+        cursor.execute(f"CREATE TABLE {name}_default PARTITION OF {name} DEFAULT;")
+    cursor.execute(f"""
+        WITH moved AS (DELETE FROM {table.lower()}_default WHERE year = %s RETURNING *)
+        INSERT INTO {name} SELECT * FROM moved;
+    """, (int(year),))
+    cursor.execute(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s);",
+                   (int(year), int(year) + 1))
+    return True
+
+def _ensurePartitions(cursor, years=()):
+    # DEFAULT + anos pedidos, anos correntes e anos que já caíram na DEFAULT
+    created = []
+    current = time.localtime().tm_year
+    for table in HISTORY_COLUMNS:
+        if not _isPartitioned(cursor, table):
+            continue
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {table.lower()}_default PARTITION OF {table} DEFAULT;")
+        cursor.execute(f"SELECT DISTINCT year FROM {table.lower()}_default;")
+        wanted = set(years) | {y for (y,) in cursor.fetchall()}
+        wanted |= set(range(current - 1, current + PARTITION_YEARS + 1))
+        created += [f"{table.lower()}_y{y}" for y in sorted(wanted) if _ensurePartition(cursor, table, y)]
+    return created
 
 # Create Tables
 def dbCreateTable():
@@ -73,57 +809,549 @@ def dbCreateTable():
             reg     TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         );
     """
-    mtmtb = """
-        CREATE TABLE IF NOT EXISTS mtmtb(
-            idPnl   SERIAL PRIMARY KEY,
-            idTrade INTEGER NOT NULL,
+    mtmtb = _historyDdl('mtmtb')
+    posTb = _historyDdl('posTb')
+    # Rollup diário do pnl de mtmtb por (prod, cat, ship, year, date), mantido
+    # por trigger na mesma transação de cada escrita em mtmtb. A soma cabe
+    # em mais dígitos que o pnl de uma marca.
+    pnltb = """
+        CREATE TABLE IF NOT EXISTS pnltb(
             prod    VARCHAR(7) NOT NULL,
             cat     VARCHAR(10) NOT NULL,
             ship    VARCHAR(3) NOT NULL,
             year    INTEGER NOT NULL,
-            mtm  NUMERIC(4,2) NOT NULL,
-            pnl  NUMERIC(11,2) NOT NULL,
-            date    DATE DEFAULT CURRENT_DATE,
-            reg     TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            date    DATE NOT NULL,
+            pnl     NUMERIC(15,2) NOT NULL,
+            reg     TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (prod, year, cat, ship, date)
+            );"""
+    # Períodos (meses) fechados e o snapshot do pnl do mês por chave no
+    # fechamento. O trigger do rollup recusa escritas que mudem o pnl de um
+    # dia de período fechado.
+    periodTb = """
+        CREATE TABLE IF NOT EXISTS periodTb(
+            period   DATE PRIMARY KEY,
+            closedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         );
     """
-    posTb = """
-        CREATE TABLE IF NOT EXISTS posTb(
-            id      SERIAL PRIMARY KEY,
+    pnlCloseTb = """
+        CREATE TABLE IF NOT EXISTS pnlCloseTb(
+            period  DATE NOT NULL REFERENCES periodTb(period) ON DELETE CASCADE,
+            prod    VARCHAR(7) NOT NULL,
+            cat     VARCHAR(10) NOT NULL,
+            ship    VARCHAR(3) NOT NULL,
+            year    INTEGER NOT NULL,
+            pnl     NUMERIC(15,2) NOT NULL,
+            PRIMARY KEY (period, prod, year, cat, ship)
+        );
+    """
+    # Estado corrente (última posição por chave, última marca por trade),
+    # mantido por triggers na mesma transação de cada INSERT no histórico.
+    posCurTb = """
+        CREATE TABLE IF NOT EXISTS posCurTb(
             prod    VARCHAR(7) NOT NULL,
             cat     VARCHAR(10) NOT NULL,
             ship    VARCHAR(3) NOT NULL,
             year    INTEGER NOT NULL,
             pos     INTEGER NOT NULL,
-            date    DATE DEFAULT CURRENT_DATE,
-            reg     TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            idPos   INTEGER NOT NULL,
+            reg     TIMESTAMP NOT NULL,
+            PRIMARY KEY (prod, year, cat, ship)
         );
     """
-    pnltb = """
-        CREATE TABLE IF NOT EXISTS pnltb(
-            id      SERIAL PRIMARY KEY,
+    mtmCurTb = """
+        CREATE TABLE IF NOT EXISTS mtmCurTb(
+            idTrade INTEGER PRIMARY KEY,
             prod    VARCHAR(7) NOT NULL,
             cat     VARCHAR(10) NOT NULL,
             ship    VARCHAR(3) NOT NULL,
             year    INTEGER NOT NULL,
+            mtm     NUMERIC(4,2) NOT NULL,
             pnl     NUMERIC(11,2) NOT NULL,
-            date    DATE DEFAULT CURRENT_DATE,
-            reg     TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );"""
-    
+            idPnl   INTEGER NOT NULL,
+            reg     TIMESTAMP NOT NULL
+        );
+    """
+    # Checkpoint das importações em lote (importer.py): linhas já gravadas por
+    # arquivo, atualizado na mesma transação de cada bloco
+    importTb = """
+        CREATE TABLE IF NOT EXISTS importTb(
+            source   TEXT PRIMARY KEY,
+            kind     VARCHAR(5) NOT NULL,
+            size     BIGINT NOT NULL,
+            rowsDone BIGINT NOT NULL,
+            reg      TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """
+    # Fila de escritas em background (jobs.py): idempotency key única por
+    # envio; resumeAt (último idTrade reavaliado ou pernas gravadas) e done
+    # avançam na mesma transação de cada lote; beat é o heartbeat do worker
+    jobTb = """
+        CREATE TABLE IF NOT EXISTS jobTb(
+            id       SERIAL PRIMARY KEY,
+            key      VARCHAR(64) NOT NULL UNIQUE,
+            kind     VARCHAR(8) NOT NULL,
+            params   JSONB NOT NULL,
+            status   VARCHAR(9) NOT NULL DEFAULT 'queued',
+            total    INTEGER,
+            done     INTEGER NOT NULL DEFAULT 0,
+            resumeAt BIGINT NOT NULL DEFAULT 0,
+            worker   VARCHAR(64),
+            error    TEXT,
+            reg      TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started  TIMESTAMP,
+            beat     TIMESTAMP,
+            finished TIMESTAMP
+        );
+    """
+    # Triggers por statement com transition table: um upsert por INSERT, não
+    # por linha. O WHERE do ON CONFLICT impede que carga de histórico antigo
+    # sobrescreva um estado mais novo.
+    posCurSync = """
+        CREATE OR REPLACE FUNCTION posCurSync() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            INSERT INTO posCurTb(prod, cat, ship, year, pos, idPos, reg)
+            SELECT DISTINCT ON (prod, year, cat, ship) prod, cat, ship, year, pos, id, reg
+            FROM newRows
+            ORDER BY prod, year, cat, ship, reg DESC, id DESC
+            ON CONFLICT (prod, year, cat, ship) DO UPDATE
+                SET pos = EXCLUDED.pos, idPos = EXCLUDED.idPos, reg = EXCLUDED.reg
+                WHERE (posCurTb.reg, posCurTb.idPos) <= (EXCLUDED.reg, EXCLUDED.idPos);
+            RETURN NULL;
+        END $$;
+        DROP TRIGGER IF EXISTS postb_cur_sync ON posTb;
+        CREATE TRIGGER postb_cur_sync AFTER INSERT ON posTb
+            REFERENCING NEW TABLE AS newRows
+            FOR EACH STATEMENT EXECUTE FUNCTION posCurSync();
+    """
+    mtmCurSync = """
+        CREATE OR REPLACE FUNCTION mtmCurSync() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            INSERT INTO mtmCurTb(idTrade, prod, cat, ship, year, mtm, pnl, idPnl, reg)
+            SELECT DISTINCT ON (idTrade) idTrade, prod, cat, ship, year, mtm, pnl, idPnl, reg
+            FROM newRows
+            ORDER BY idTrade, reg DESC, idPnl DESC
+            ON CONFLICT (idTrade) DO UPDATE
+                SET prod = EXCLUDED.prod, cat = EXCLUDED.cat, ship = EXCLUDED.ship,
+                    year = EXCLUDED.year, mtm = EXCLUDED.mtm, pnl = EXCLUDED.pnl,
+                    idPnl = EXCLUDED.idPnl, reg = EXCLUDED.reg
+                WHERE (mtmCurTb.reg, mtmCurTb.idPnl) <= (EXCLUDED.reg, EXCLUDED.idPnl);
+            RETURN NULL;
+        END $$;
+        DROP TRIGGER IF EXISTS mtmtb_cur_sync ON mtmtb;
+        CREATE TRIGGER mtmtb_cur_sync AFTER INSERT ON mtmtb
+            REFERENCING NEW TABLE AS newRows
+            FOR EACH STATEMENT EXECUTE FUNCTION mtmCurSync();
+    """
+    # Rollup: transition tables exigem um trigger por evento, todos com a
+    # mesma função. Soma o delta (novas - antigas) por chave e dia; linhas
+    # sem date ficam fora, como nos loaders.
+    rollupBranch = """
+            INSERT INTO pnltb(prod, cat, ship, year, date, pnl)
+            SELECT prod, cat, ship, year, date, SUM(pnl)
+            FROM ({rows}) d
+            WHERE date IS NOT NULL
+            GROUP BY prod, year, cat, ship, date
+            ORDER BY prod, year, cat, ship, date
+            ON CONFLICT (prod, year, cat, ship, date) DO UPDATE
+                SET pnl = pnltb.pnl + EXCLUDED.pnl, reg = CURRENT_TIMESTAMP;"""
+    newRows = "SELECT prod, cat, ship, year, date, pnl FROM newRows"
+    oldRows = "SELECT prod, cat, ship, year, date, -pnl AS pnl FROM oldRows"
+    pnlRollup = f"""
+        CREATE OR REPLACE FUNCTION pnlRollup() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN{rollupBranch.format(rows=newRows)}
+            ELSIF TG_OP = 'DELETE' THEN{rollupBranch.format(rows=oldRows)}
+            ELSIF TG_OP = 'UPDATE' THEN{rollupBranch.format(rows=newRows + ' UNION ALL ' + oldRows)}
+            ELSE
+                DELETE FROM pnltb;
+            END IF;
+            RETURN NULL;
+        END $$;
+        DROP TRIGGER IF EXISTS mtmtb_rollup_ins ON mtmtb;
+        CREATE TRIGGER mtmtb_rollup_ins AFTER INSERT ON mtmtb
+            REFERENCING NEW TABLE AS newRows
+            FOR EACH STATEMENT EXECUTE FUNCTION pnlRollup();
+        DROP TRIGGER IF EXISTS mtmtb_rollup_upd ON mtmtb;
+        CREATE TRIGGER mtmtb_rollup_upd AFTER UPDATE ON mtmtb
+            REFERENCING OLD TABLE AS oldRows NEW TABLE AS newRows
+            FOR EACH STATEMENT EXECUTE FUNCTION pnlRollup();
+        DROP TRIGGER IF EXISTS mtmtb_rollup_del ON mtmtb;
+        CREATE TRIGGER mtmtb_rollup_del AFTER DELETE ON mtmtb
+            REFERENCING OLD TABLE AS oldRows
+            FOR EACH STATEMENT EXECUTE FUNCTION pnlRollup();
+        DROP TRIGGER IF EXISTS mtmtb_rollup_trunc ON mtmtb;
+        CREATE TRIGGER mtmtb_rollup_trunc AFTER TRUNCATE ON mtmtb
+            FOR EACH STATEMENT EXECUTE FUNCTION pnlRollup();
+    """
+    # Período fechado: no commit, o pnl do mês de cada chave alterada no
+    # rollup tem que bater com o snapshot. Reescritas que preservam as somas
+    # (compactação) passam; marcas novas no período são recusadas.
+    closedGuard = """
+        CREATE OR REPLACE FUNCTION pnlClosedGuard() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        DECLARE
+            month DATE := date_trunc('month', NEW.date)::date;
+        BEGIN
+            IF EXISTS (SELECT 1 FROM periodTb WHERE period = month) AND
+               (SELECT COALESCE(SUM(pnl), 0) FROM pnltb
+                WHERE prod = NEW.prod AND year = NEW.year AND cat = NEW.cat AND ship = NEW.ship
+                  AND date >= month AND date < month + INTERVAL '1 month')
+               <> (SELECT COALESCE(SUM(pnl), 0) FROM pnlCloseTb
+                   WHERE period = month AND prod = NEW.prod AND year = NEW.year
+                     AND cat = NEW.cat AND ship = NEW.ship) THEN
+                RAISE EXCEPTION 'Periodo % fechado: pnl de % % % % nao pode mudar',
+                    to_char(month, 'YYYY-MM'), NEW.prod, NEW.year, NEW.cat, NEW.ship;
+            END IF;
+            RETURN NULL;
+        END $$;
+        DROP TRIGGER IF EXISTS pnltb_closed_guard ON pnltb;
+        CREATE CONSTRAINT TRIGGER pnltb_closed_guard AFTER INSERT OR UPDATE ON pnltb
+            DEFERRABLE INITIALLY DEFERRED
+            FOR EACH ROW EXECUTE FUNCTION pnlClosedGuard();
+    """
+    # Avisa outros processos (cache) de escritas; NOTIFY só sai no commit.
+    # O argumento do trigger é a versão a invalidar (padrão: a própria tabela):
+    # fechar/reabrir período (periodTb) muda o monthly PnL, que é versão mtmtb.
+    cacheNotify = """
+        CREATE OR REPLACE FUNCTION pnlCacheNotify() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            PERFORM pg_notify('pnl_cache', COALESCE(TG_ARGV[0], lower(TG_TABLE_NAME)));
+            RETURN NULL;
+        END $$;
+    """ + "".join(f"""
+        DROP TRIGGER IF EXISTS {table}_cache_notify ON {table};
+        CREATE TRIGGER {table}_cache_notify AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+            FOR EACH STATEMENT EXECUTE FUNCTION pnlCacheNotify({arg});
+    """ for table, arg in (('tradeTb', ''), ('mtmtb', ''), ('posTb', ''), ('periodTb', "'mtmtb'")))
+    # Índices das buscas "última linha por chave" (ORDER BY reg DESC LIMIT 1)
+    # e dos loaders (prod = %s AND year = %s). (prod, year) vem primeiro para
+    # que o mesmo índice sirva tanto aos fetchers quanto aos loaders.
+    indexes = [
+        "CREATE INDEX IF NOT EXISTS tradetb_key_idx ON tradeTb (prod, year, cat, ship);",
+        "CREATE INDEX IF NOT EXISTS tradetb_log_idx ON tradeTb (prod, year, id DESC);",
+        "CREATE INDEX IF NOT EXISTS mtmtb_trade_reg_idx ON mtmtb (idTrade, reg DESC, idPnl DESC);",
+        "CREATE INDEX IF NOT EXISTS mtmtb_key_reg_idx ON mtmtb (prod, year, cat, ship, reg DESC, idPnl DESC);",
+        "CREATE INDEX IF NOT EXISTS mtmtb_prod_reg_idx ON mtmtb (prod, reg);",
+        "CREATE INDEX IF NOT EXISTS postb_key_reg_idx ON posTb (prod, year, cat, ship, reg DESC, id DESC);",
+        "CREATE INDEX IF NOT EXISTS mtmcurtb_key_reg_idx ON mtmCurTb (prod, year, cat, ship, reg DESC, idPnl DESC);",
+        # a PK de pnlCloseTb começa por period; o monthly PnL busca por (prod, year)
+        "CREATE INDEX IF NOT EXISTS pnlclosetb_key_idx ON pnlCloseTb (prod, year, cat, ship);",
+        "CREATE INDEX IF NOT EXISTS jobtb_open_idx ON jobTb (id) WHERE status IN ('queued', 'running');",
+    ]
+
     try:
         cursor.execute(tradeTb)
         cursor.execute(mtmtb)
         cursor.execute(posTb)
+        cursor.execute(posCurTb)
+        cursor.execute(mtmCurTb)
+        cursor.execute(importTb)
+        cursor.execute(jobTb)
+        cursor.execute(pnltb)
+        cursor.execute(periodTb)
+        cursor.execute(pnlCloseTb)
+        _ensurePartitions(cursor)
+        for index in indexes:
+            cursor.execute(index)
+        cursor.execute(posCurSync)
+        cursor.execute(mtmCurSync)
+        cursor.execute(pnlRollup)
+        cursor.execute(closedGuard)
+        cursor.execute(cacheNotify)
+        # banco já existente: popula o estado a partir do histórico na 1a vez
+        cursor.execute("SELECT NOT EXISTS (SELECT 1 FROM posCurTb) AND NOT EXISTS (SELECT 1 FROM mtmCurTb);")
+        if cursor.fetchone()[0]:
+            _rebuildState(cursor)
+        cursor.execute("SELECT NOT EXISTS (SELECT 1 FROM pnltb) AND EXISTS (SELECT 1 FROM mtmtb);")
+        if cursor.fetchone()[0]:
+            _rebuildRollup(cursor)
         conn.commit()
     except Exception as e:
         print(f'Erro criar tabelas: {e}')
         conn.rollback()
+        raise
     finally:
         cursor.close()
         dbClose(conn)
 
+def _rebuildState(cursor):
+    cursor.execute("LOCK TABLE posTb, mtmtb IN SHARE ROW EXCLUSIVE MODE;")
+    cursor.execute("TRUNCATE posCurTb, mtmCurTb;")
+    cursor.execute("""
+        INSERT INTO posCurTb(prod, cat, ship, year, pos, idPos, reg)
+        SELECT DISTINCT ON (prod, year, cat, ship) prod, cat, ship, year, pos, id, reg
+        FROM posTb
+        ORDER BY prod, year, cat, ship, reg DESC, id DESC;
+    """)
+    cursor.execute("""
+        INSERT INTO mtmCurTb(idTrade, prod, cat, ship, year, mtm, pnl, idPnl, reg)
+        SELECT DISTINCT ON (idTrade) idTrade, prod, cat, ship, year, mtm, pnl, idPnl, reg
+        FROM mtmtb
+        ORDER BY idTrade, reg DESC, idPnl DESC;
+    """)
+
+def _rebuildRollup(cursor):
+    cursor.execute("DELETE FROM pnltb;")
+    cursor.execute("""
+        INSERT INTO pnltb(prod, cat, ship, year, date, pnl)
+        SELECT prod, cat, ship, year, date, SUM(pnl)
+        FROM mtmtb
+        WHERE date IS NOT NULL
+        GROUP BY prod, year, cat, ship, date;
+    """)
+
+def dbRebuildState():
+    # Recuperação: reconstrói posCurTb/mtmCurTb/pnltb inteiros a partir do histórico
+    with dbConnection() as conn:
+        cursor = conn.cursor()
+        try:
+            _rebuildState(cursor)
+            _rebuildRollup(cursor)
+            cursor.execute("""
+                SELECT (SELECT count(*) FROM posCurTb), (SELECT count(*) FROM mtmCurTb), (SELECT count(*) FROM pnltb);
+            """)
+            counts = cursor.fetchone()
+            conn.commit()
+            _bumpVersion('mtmtb', 'posTb')
+        except Exception as e:
+            print(f'Erro rebuildState: {e}')
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+    return {'posCurTb': counts[0], 'mtmCurTb': counts[1], 'pnltb': counts[2]}
+
+def dbPartitionTables(years=()):
+    # Converte mtmtb/posTb simples em particionadas (cópia numa transação, com
+    # as tabelas travadas) e garante as partições dos anos. Ids e sequência
+    # são mantidos; índices e triggers são recriados por dbCreateTable.
+    if not _partitionKeys():
+        raise ValueError("PNL_PARTITION=none: nada a particionar")
+    migrated, partitions = [], []
+    with dbConnection() as conn:
+        cursor = conn.cursor()
+        try:
+            for table, idCol in HISTORY_IDS.items():
+                cursor.execute("SELECT to_regclass(%s) IS NULL;", (table,))
+                if cursor.fetchone()[0] or _isPartitioned(cursor, table):
+                    continue
+                legacy = f"{table.lower()}_legacy"
+                cursor.execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE;")
+                cursor.execute("SELECT pg_get_serial_sequence(%s, %s);", (table, idCol.lower()))
+                sequence = cursor.fetchone()[0]
+                cursor.execute(f"ALTER TABLE {table} RENAME TO {legacy};")
+                cursor.execute(f"ALTER TABLE {legacy} RENAME CONSTRAINT {table.lower()}_pkey TO {legacy}_pkey;")
+                # índices do legado liberam os nomes para a nova tabela
+                cursor.execute("""
+                    SELECT indexrelid::regclass::text FROM pg_index
+                    WHERE indrelid = %s::regclass AND NOT indisprimary;
+                """, (legacy,))
+                for (index,) in cursor.fetchall():
+                    cursor.execute(f"DROP INDEX {index};")
+                cursor.execute(_historyDdl(table))
+                cursor.execute(f"SELECT DISTINCT year FROM {legacy};")
+                partitions += _ensurePartitions(cursor, list(years) + [y for (y,) in cursor.fetchall()])
+                cursor.execute(f"INSERT INTO {table} SELECT * FROM {legacy};")
+                # a nova coluna passa a usar a sequência original
+                cursor.execute("SELECT pg_get_serial_sequence(%s, %s);", (table, idCol.lower()))
+                created = cursor.fetchone()[0]
+                cursor.execute(f"ALTER TABLE {table} ALTER COLUMN {idCol} SET DEFAULT nextval('{sequence}');")
+                cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY {table}.{idCol};")
+                cursor.execute(f"DROP SEQUENCE {created};")
+                cursor.execute(f"DROP TABLE {legacy};")
+                migrated.append(table)
+            partitions += _ensurePartitions(cursor, years)
+            conn.commit()
+        except Exception as e:
+            print(f'Erro partitionTables: {e}')
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+    dbCreateTable()
+    _bumpVersion(*HISTORY_IDS)
+    return {'migrated': migrated, 'partitions': partitions}
+
+
+# Compactação do histórico
+# Marcas e posições gravadas várias vezes no mesmo dia viram uma linha por
+# chave e dia (trade em mtmtb, prod/cat/ship/year em posTb), mantendo a
+# última. Em mtmtb o pnl do dia é somado na linha mantida: pnl é incremental
+# (marca anterior -> nova), então as somas por trade/dia/mês/ano não mudam.
+# As linhas mantidas são as mais recentes, logo mtmCurTb/posCurTb continuam
+# apontando para linhas existentes. Só dias anteriores a `before` (padrão:
+# hoje) são compactados, um ano por transação.
+COMPACT = {
+    'mtmtb': """
+        WITH ranked AS (
+            SELECT idPnl, year,
+                   row_number() OVER (PARTITION BY idTrade, date ORDER BY reg DESC, idPnl DESC) AS rn,
+                   count(*) OVER (PARTITION BY idTrade, date) AS n,
+                   SUM(pnl) OVER (PARTITION BY idTrade, date) AS dayPnl
+            FROM mtmtb
+            WHERE year = %(year)s AND date < %(before)s {filter}
+        ),
+        kept AS (
+            UPDATE mtmtb m SET pnl = r.dayPnl
+            FROM ranked r
+            WHERE r.rn = 1 AND r.n > 1 AND m.idPnl = r.idPnl AND m.year = r.year
+            RETURNING m.idPnl, m.pnl
+        ),
+        cur AS (
+            UPDATE mtmCurTb c SET pnl = k.pnl FROM kept k WHERE c.idPnl = k.idPnl
+        ),
+        gone AS (
+            DELETE FROM mtmtb m USING ranked r
+            WHERE r.rn > 1 AND m.idPnl = r.idPnl AND m.year = r.year
+            RETURNING 1
+        )
+        SELECT (SELECT count(*) FROM kept), (SELECT count(*) FROM gone);
+    """,
+    'posTb': """
+        WITH ranked AS (
+            SELECT id, year,
+                   row_number() OVER (PARTITION BY prod, cat, ship, year, date ORDER BY reg DESC, id DESC) AS rn
+            FROM posTb
+            WHERE year = %(year)s AND date < %(before)s {filter}
+        ),
+        gone AS (
+            DELETE FROM posTb p USING ranked r
+            WHERE r.rn > 1 AND p.id = r.id AND p.year = r.year
+            RETURNING 1
+        )
+        SELECT 0, (SELECT count(*) FROM gone);
+    """,
+}
+
+def _tableStats(cursor, table):
+    # linhas e bytes (tabela + índices + TOAST, somando as partições)
+    cursor.execute(f"SELECT count(*) FROM {table};")
+    rows = cursor.fetchone()[0]
+    cursor.execute("""
+        SELECT COALESCE((SELECT SUM(pg_total_relation_size(relid)) FROM pg_partition_tree(%s::regclass)),
+                        pg_total_relation_size(%s::regclass));
+    """, (table, table))
+    return {'rows': rows, 'bytes': int(cursor.fetchone()[0])}
+
+def dbCompactHistory(before=None, years=None, products=None, tables=('mtmtb', 'posTb'), full=False):
+    # Devolve, por tabela, linhas/bytes antes e depois e quantas linhas foram
+    # apagadas/atualizadas. O espaço só volta ao sistema com full (VACUUM FULL,
+    # trava a tabela); sem ele o VACUUM deixa o espaço livre para reuso.
+    report = {}
+    params = {'before': before or time.strftime('%Y-%m-%d')}
+    filter = ""
+    if products:
+        filter = "AND prod = ANY(%(prods)s)"
+        params['prods'] = [prodKey(p) for p in products]
+    with dbConnection() as conn:
+        cursor = conn.cursor()
+        try:
+            for table in tables:
+                if table not in COMPACT:
+                    raise ValueError(f"Tabela inválida para compactação: {table}")
+                item = report[table] = {'before': _tableStats(cursor, table), 'updated': 0, 'deleted': 0}
+                if years is None:
+                    cursor.execute(f"SELECT DISTINCT year FROM {table} WHERE date < %(before)s ORDER BY year;", params)
+                    todo = [y for (y,) in cursor.fetchall()]
+                else:
+                    todo = list(years)
+                conn.commit()
+                for year in todo:
+                    # escritas na tabela esperam enquanto o ano é compactado
+                    cursor.execute(f"LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE;")
+                    cursor.execute(COMPACT[table].format(filter=filter), dict(params, year=int(year)))
+                    updated, deleted = cursor.fetchone()
+                    conn.commit()
+                    item['updated'] += updated
+                    item['deleted'] += deleted
+                _bumpVersion(table)
+        except Exception as e:
+            print(f'Erro compactHistory: {e}')
+            conn.rollback()
+            cursor.close()
+            raise
+        # VACUUM não roda dentro de transação
+        conn.autocommit = True
+        try:
+            for table in report:
+                cursor.execute(f"VACUUM ({'FULL, ' if full else ''}ANALYZE) {table};")
+                report[table]['after'] = _tableStats(cursor, table)
+        finally:
+            conn.autocommit = False
+            cursor.close()
+    return report
+
+# Fechamento de períodos
+# Fechar um mês grava o snapshot do pnl do mês por chave (pnlCloseTb) a
+# partir do rollup; depois disso o guard de pnltb recusa qualquer escrita que
+# mude esse pnl. O monthly PnL lê meses fechados direto do snapshot.
+def _periodStart(period):
+    # 'YYYY-MM', 'YYYY-MM-DD' ou date -> primeiro dia do mês
+    text = str(period)[:7]
+    year, month = text.split('-')
+    return f"{int(year):04d}-{int(month):02d}-01"
+
+def dbClosePeriod(period):
+    start = _periodStart(period)
+    with dbConnection() as conn:
+        cursor = conn.cursor()
+        try:
+            # espera escritas em andamento no rollup; as seguintes veem o fechamento
+            cursor.execute("LOCK TABLE pnltb IN SHARE MODE;")
+            cursor.execute("INSERT INTO periodTb(period) VALUES (%s) ON CONFLICT DO NOTHING RETURNING period;",
+                           (start,))
+            if cursor.fetchone() is None:
+                raise ValueError(f"Período {start[:7]} já está fechado")
+            cursor.execute("""
+                INSERT INTO pnlCloseTb(period, prod, cat, ship, year, pnl)
+                SELECT %(start)s, prod, cat, ship, year, SUM(pnl)
+                FROM pnltb
+                WHERE date >= %(start)s AND date < %(start)s::date + INTERVAL '1 month'
+                GROUP BY prod, year, cat, ship;
+            """, {'start': start})
+            keys = cursor.rowcount
+            conn.commit()
+            _bumpVersion('mtmtb')
+        except Exception as e:
+            print(f'Erro closePeriod: {e}')
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+    return {'period': start[:7], 'keys': keys}
+
+def dbReopenPeriod(period):
+    # Remove o fechamento (e o snapshot, em cascata) para permitir correções
+    start = _periodStart(period)
+    with dbConnection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("DELETE FROM periodTb WHERE period = %s;", (start,))
+            reopened = cursor.rowcount > 0
+            conn.commit()
+            _bumpVersion('mtmtb')
+        except Exception as e:
+            print(f'Erro reopenPeriod: {e}')
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+    return reopened
+
+@instrumented
+@cached('mtmtb')
+def dbClosedPeriods():
+    with dbConnection() as conn:
+        df = _readFrame(conn, "SELECT period, closedAt FROM periodTb ORDER BY period;")
+    return df
+
 # Inserts
+@instrumented
 def dbInsertTrade(product, category, shipment, year, operation, ton, lvl, notion):
     conn = dbConn(); cursor = conn.cursor()
     query = """
@@ -133,12 +1361,14 @@ def dbInsertTrade(product, category, shipment, year, operation, ton, lvl, notion
     try:
         cursor.execute(query, (product, category, shipment, year, operation, ton, lvl, notion))
         conn.commit()
+        _bumpVersion('tradeTb')
     except Exception as e:
         print(f'Erro insertTrade: {e}')
         conn.rollback()
     finally:
         cursor.close(); dbClose(conn)
 
+@instrumented
 def dbInsertPnl(id, product, category, shipment, year, mtm, pnl):
     conn = dbConn(); cursor = conn.cursor()
     query = """
@@ -148,12 +1378,14 @@ def dbInsertPnl(id, product, category, shipment, year, mtm, pnl):
     try:
         cursor.execute(query, (id, product, category, shipment, year, mtm, pnl))
         conn.commit()
+        _bumpVersion('mtmtb')
     except Exception as e:
         print(f'Erro insertPnl: {e}')
         conn.rollback()
     finally:
         cursor.close(); dbClose(conn)
 
+@instrumented
 def dbInsertPos (product, category, shipment, year, posisiton):
     conn = dbConn(); cursor = conn.cursor()
     query = """
@@ -163,138 +1395,327 @@ def dbInsertPos (product, category, shipment, year, posisiton):
     try:
         cursor.execute(query, (product, category, shipment, year, posisiton))
         conn.commit()
+        _bumpVersion('posTb')
     except Exception as e:
         print(f'Erro insertPnl: {e}')
         conn.rollback()
     finally:
         cursor.close(); dbClose(conn)
 
+INSERT_TRADES = """
+    LOCK TABLE posTb IN SHARE ROW EXCLUSIVE MODE;
+    WITH legs(ord, prod, cat, ship, year, op, ton, lvl, notion) AS (
+        VALUES %s
+    ),
+    ins AS (
+        INSERT INTO tradeTb(prod, cat, ship, year, op, ton, lvl, notion)
+        SELECT prod, cat, ship, year, op, ton, lvl, notion
+        FROM legs ORDER BY ord
+    )
+    INSERT INTO posTb(prod, cat, ship, year, pos)
+    SELECT l.prod, l.cat, l.ship, l.year,
+           COALESCE(prev.pos, 0)
+           + SUM(CASE WHEN l.op = 'Purchase' THEN l.ton ELSE -l.ton END)
+             OVER (PARTITION BY l.prod, l.cat, l.ship, l.year ORDER BY l.ord)
+    FROM legs l
+    LEFT JOIN posCurTb prev USING (prod, cat, ship, year)
+    ORDER BY l.ord;
+"""
+
+def _insertTrades(cursor, trades, pageSize=1000):
+    # Grava as pernas no cursor dado, sem commit (dbInsertTrades e os lotes de jobs.py)
+    template = "(%s, %s, %s, %s, %s::integer, %s, %s::integer, %s::numeric, %s::numeric)"
+    rows = [(i,) + tuple(trade) for i, trade in enumerate(trades)]
+    psycopg2.extras.execute_values(cursor, INSERT_TRADES, rows, template=template, page_size=pageSize)
+    return len(rows)
+
+@instrumented
+def dbInsertTrades(trades, pageSize=1000):
+    # Grava vários trades (tuplas na ordem de dbInsertTrade: prod, cat, ship,
+    # year, op, ton, lvl, notion) e a posição resultante de cada perna numa
+    # única transação. A posição é calculada no banco: posição corrente da chave
+    # (posCurTb) + soma acumulada das pernas (Purchase soma, Sale subtrai), na ordem da lista.
+    # O LOCK serializa entradas concorrentes para não perder atualização de posição.
+    trades = list(trades)
+    if not trades:
+        return 0
+    with dbConnection() as conn:
+        cursor = conn.cursor()
+        try:
+            _insertTrades(cursor, trades, pageSize)
+            conn.commit()
+            _bumpVersion('tradeTb', 'posTb')
+        except Exception as e:
+            print(f'Erro insertTrades: {e}')
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+    return len(trades)
+
+
+# Revaluation
+# Última marca do trade (ou lvl, se nunca marcado), diff conforme op, x
+# conversão x ton, para os trades com after < id <= upTo em ordem de id. limit
+# NULL = todos; com limit, devolve o último id gravado para o próximo lote.
+# O PnL é incremental sobre a marca anterior: o LOCK serializa reavaliações
+# concorrentes (workers de jobs.py, importer), senão duas leriam a mesma
+# marca anterior e o PnL seria contado em dobro.
+REVALUE = """
+    LOCK TABLE mtmtb IN SHARE ROW EXCLUSIVE MODE;
+    WITH ins AS (
+        INSERT INTO mtmtb(idTrade, prod, cat, ship, year, mtm, pnl)
+        SELECT t.id, t.prod, t.cat, t.ship, t.year, %(mtm)s,
+               CASE WHEN t.op = 'Sale' THEN COALESCE(m.mtm, t.lvl) - %(mtm)s
+                    ELSE %(mtm)s - COALESCE(m.mtm, t.lvl)
+               END * %(conV)s * t.ton
+        FROM tradeTb t
+        LEFT JOIN mtmCurTb m ON m.idTrade = t.id
+        WHERE t.prod = %(prod)s AND t.year = %(year)s
+          AND t.cat = ANY(%(cats)s) AND t.ship = ANY(%(ships)s)
+          AND t.id > %(after)s AND t.id <= %(upTo)s
+        ORDER BY t.id
+        LIMIT %(limit)s
+        RETURNING idTrade
+    )
+    SELECT count(*), max(idTrade) FROM ins;
+"""
+MAX_ID = 2 ** 31 - 1
+
+def _revalueParams(prod, year, mtm, categories, shipments):
+    return {
+        'prod': prod, 'year': year, 'mtm': mtm,
+        'conV': get_conversion_value(prod),
+        'cats': list(categories), 'ships': list(shipments),
+    }
+
+def _revalue(cursor, params, after=0, upTo=MAX_ID, limit=None):
+    # Reavalia no cursor dado, sem commit; devolve (marcas gravadas, último idTrade)
+    cursor.execute(REVALUE, dict(params, after=after, upTo=upTo, limit=limit))
+    return cursor.fetchone()
+
+@instrumented
+def dbRevalueMtm(prod, year, mtm, categories, shipments):
+    # Reavalia todos os trades de (prod, year, categories x shipments) num único
+    # INSERT ... SELECT. Uma ida ao banco, um commit.
+    if not categories or not shipments:
+        return 0
+    params = _revalueParams(prod, year, mtm, categories, shipments)
+    with dbConnection() as conn:
+        cursor = conn.cursor()
+        try:
+            updated, _ = _revalue(cursor, params)
+            conn.commit()
+            _bumpVersion('mtmtb')
+        except Exception as e:
+            print(f'Erro revalueMtm: {e}')
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+    return updated
+
 
 # Fetch
+@instrumented
+@cached('mtmtb')
 def dbFetchMtM(id):
-    conn = dbConn(); cursor = conn.cursor()
     query = """
-        SELECT mtm, reg FROM mtmtb
-        WHERE idTrade=%s
-        ORDER BY reg DESC LIMIT 1;
+        SELECT mtm FROM mtmCurTb
+        WHERE idTrade=%s;
     """
-    cursor.execute(query, (id,))
-    row = cursor.fetchone()
-    cursor.close(); dbClose(conn)
+    with dbConnection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, (id,))
+        row = cursor.fetchone()
+        cursor.close()
     if row is None:
         return None
     else:
         return row[0]
 
+@instrumented
+@cached('mtmtb')
 def dbFetchPnl(prod, cat, ship, year):
-    conn = dbConn(); cursor = conn.cursor()
     query = """
-        SELECT mtm 
-        FROM mtmtb
+        SELECT mtm
+        FROM mtmCurTb
         WHERE prod=%s AND cat=%s AND ship=%s AND year=%s
-        ORDER BY reg DESC LIMIT 1;
+        ORDER BY reg DESC, idPnl DESC LIMIT 1;
     """
-    cursor.execute(query, (prod, cat, ship, year))
-    row = cursor.fetchone()
-    cursor.close(); dbClose(conn)
+    with dbConnection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, (prod, cat, ship, year))
+        row = cursor.fetchone()
+        cursor.close()
     return row[0]
     
+@instrumented
+@cached('posTb')
 def dbFetchPos(prod, cat, ship, year):
-    conn = dbConn(); cursor = conn.cursor()
     query = """
-        SELECT pos FROM posTb
-        WHERE prod=%s AND cat=%s AND ship=%s AND year=%s
-        ORDER BY reg DESC LIMIT 1;
+        SELECT pos FROM posCurTb
+        WHERE prod=%s AND cat=%s AND ship=%s AND year=%s;
     """
-    cursor.execute(query, (prod, cat, ship, year))
-    row = cursor.fetchone()
-    cursor.close(); dbClose(conn)
+    with dbConnection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, (prod, cat, ship, year))
+        row = cursor.fetchone()
+        cursor.close()
     return row[0] if row else 0
 
+@instrumented
+@cached('tradeTb')
 def dbFetchTrade(prod, cat, ship, year):
-    conn = dbConn(); cursor = conn.cursor()
     query = """
         SELECT id, op, ton, lvl
         FROM tradetb
         WHERE prod=%s AND cat=%s AND ship=%s AND year=%s
     """
-
-    cursor.execute(query, (prod, cat, ship, year))
-    rows = cursor.fetchall()
-    cursor.close(); dbClose(conn)
+    with dbConnection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, (prod, cat, ship, year))
+        rows = cursor.fetchall()
+        cursor.close()
     return rows
 
-# DataFrame loaders
-def dbLoadPnl(prod, year):
-    conn = dbConn()
-    query = """
-        SELECT *
-        FROM mtmtb
-        WHERE prod ILIKE %s AND year = %s
-        ORDER BY reg DESC;
-    """
-    df = pd.read_sql(query, conn, params=(prod, year))
-    dbClose(conn)
+# Frames tipados
+# Os loaders leem com COPY (query) TO STDOUT em CSV e o parser C do pandas
+# converte direto para colunas tipadas, sem tupla/Decimal/str por linha:
+#   prod, cat, ship, op, kind      category (códigos inteiros + poucas strings)
+#   year int16; ton, pos, ids int32; *cents int64
+#   lvl, mtm, notion, pnl, val     float64
+#   date, reg, period, closedAt    datetime64
+# Exatidão: os NUMERIC(p,2) do esquema têm p <= 15 e float64 guarda 15 dígitos
+# significativos, então round(x, 2) ou rint(x * 100) devolvem exatamente o
+# valor gravado. As somas ficam no banco (NUMERIC, exatas) sempre que possível;
+# uma soma de n valores no cliente (timeseries) erra menos de n x |soma| x 1e-16
+# e continua exata ao centavo após round(2) enquanto n x |soma| < 4e13 (ex.: 1M
+# de parcelas com |soma| < 4e7). Quem precisa de centavos inteiros pede no SQL
+# ((col * 100)::bigint), como dbLoadBook.
+# Os painéis do Overview (dbLoadPnl/Pos/Mtm/Overview) continuam no read_sql:
+# trazem poucas células já agregadas, e o custo fixo do read_csv (~2 ms)
+# passaria do ganho.
+FRAME_TYPES = {
+    'prod': 'category', 'cat': 'category', 'ship': 'category', 'op': 'category', 'kind': 'category',
+    'year': 'int16', 'ton': 'int32', 'pos': 'int32',
+    'id': 'int32', 'idpnl': 'int32', 'idtrade': 'int32', 'idpos': 'int32',
+    'lvlcents': 'int64', 'mtmcents': 'int64',
+    'lvl': 'float64', 'mtm': 'float64', 'notion': 'float64', 'pnl': 'float64', 'val': 'float64',
+}
+FRAME_DATES = ('date', 'reg', 'period', 'closedat')
+FRAME_STREAM_BYTES = int(os.environ.get('PNL_FRAME_STREAM_BYTES', 4 << 20))   # CSV acima disso vai por pipe
 
-    orderCol = ['Jan','Feb','Mar','Apr','May','Jun',
-                'Jul','Aug','Sep','Oct','Nov','Dec']
-    orderRow = ['FOB Vessel','FOB Paper','C&F Vessel']
+def _parseFrame(source, dtypes, categories):
+    columns = next(csv.reader([source.readline().decode()]))
+    types, dates = {}, []
+    for col in columns:
+        kind = (dtypes or {}).get(col, FRAME_TYPES.get(col))
+        if col in FRAME_DATES and kind is None:
+            dates.append(col)
+        elif kind and (categories or kind != 'category'):
+            types[col] = kind
+    df = pd.read_csv(source, header=None, names=columns, dtype=types, parse_dates=dates,
+                     date_format='ISO8601', keep_default_na=False, na_values=[''])
+    # sem linhas (ou só NULL) o read_csv não infere datas
+    for col in dates:
+        if df[col].dtype == object:
+            df[col] = df[col].astype('datetime64[us]')
+    return df
 
-    df['date'] = pd.to_datetime(df['date'])
-    # 1) Extrair mês da coluna 'reg' e agrupar por mês
-    df['month'] = df['date'].dt.month_name().str[:3]  # Converte para nome do mês (3 primeiras letras)
-    
-    grouped = (
-        df.groupby(['cat', 'month'])
-        ['pnl'].sum()
-        .reset_index()
-    )
+class _CopySink:
+    # Destino do COPY: acumula em memória até FRAME_STREAM_BYTES; passando
+    # disso, abre um pipe e o read_csv passa a consumir numa thread auxiliar,
+    # então nem o CSV inteiro nem as linhas como objetos ficam em memória.
+    # Resultados pequenos (a maioria) não pagam thread nem pipe. bytes e
+    # blocked (tempo esperando o read_csv no pipe) vão para as métricas do
+    # COPY (metrics.TimingCursor.copy_expert).
+    def __init__(self, parse):
+        self.parse = parse
+        self.buffer = io.BytesIO()
+        self.pipe = self.reader = None
+        self.result, self.failure = [], []
+        self.bytes, self.blocked = 0, 0.0
 
-    # 3) Pivot + fillna
-    table = (
-        grouped
-        .pivot(index='cat', columns='month', values='pnl')
-        .reindex(columns=orderCol, fill_value=0)
-        .reindex(orderRow, fill_value=0)
-        .fillna(0)
-    )
+    def _consume(self, readFd):
+        try:
+            with os.fdopen(readFd, 'rb') as pipe:
+                self.result.append(self.parse(pipe))
+        except Exception as e:
+            self.failure.append(e)
 
-    # 4) Year e totais
-    table['Year'] = table.sum(axis=1)
-    total_row = table.sum(axis=0).to_frame().T
-    total_row.index = ['Total']
+    def _send(self, data):
+        t0 = time.perf_counter()
+        try:
+            self.pipe.write(data)
+        finally:
+            self.blocked += time.perf_counter() - t0
 
-    return pd.concat([table, total_row])
+    def write(self, data):
+        self.bytes += len(data)
+        if self.pipe is not None:
+            self._send(data)
+            return len(data)
+        self.buffer.write(data)
+        if self.buffer.tell() > FRAME_STREAM_BYTES:
+            readFd, writeFd = os.pipe()
+            self.reader = threading.Thread(target=self._consume, args=(readFd,), name='pnl-frame-read', daemon=True)
+            self.reader.start()
+            self.pipe = os.fdopen(writeFd, 'wb')
+            self._send(self.buffer.getbuffer())
+            self.buffer = None
+        return len(data)
 
+    def close(self):
+        if self.pipe is not None:
+            self.pipe.close()
+            self.reader.join()
 
-def dbLoadPos(prod, year):
-    conn = dbConn()
-    query = """
-        SELECT pos, cat, ship, year, reg
-        FROM posTb
-        WHERE prod ILIKE %s AND year = %s
-        ORDER BY reg DESC;
-    """
-    df = pd.read_sql(query, conn, params=(prod, year))
-    dbClose(conn)
+def _readFrame(conn, query, params=None, dtypes=None, categories=True):
+    # Executa query (com parâmetros, via mogrify) e devolve o DataFrame tipado.
+    # O COPY roda nesta thread (métricas por função). dtypes sobrepõe
+    # FRAME_TYPES (ex.: inteiro que pode ser NULL -> float64); categories=False
+    # mantém as chaves como texto (resultados pequenos: a conversão para
+    # category custa mais do que economiza).
+    cursor = conn.cursor()
+    select = cursor.mogrify(query, params).decode().strip().rstrip(';')
+    sink = _CopySink(lambda source: _parseFrame(source, dtypes, categories))
+    try:
+        cursor.copy_expert(f"COPY ({select}) TO STDOUT WITH (FORMAT csv, HEADER)", sink)
+    except OSError:
+        # pipe fechado: o leitor parou (erro de conversão) e o erro dele é o que interessa
+        sink.close()
+        if not sink.failure:
+            raise
+    finally:
+        sink.close()
+        cursor.close()
+    if sink.failure:
+        raise sink.failure[0]
+    if sink.pipe is None:
+        sink.buffer.seek(0)
+        return _parseFrame(sink.buffer, dtypes, categories)
+    return sink.result[0]
 
-    orderCol = ['Jan','Feb','Mar','Apr','May','Jun',
-                'Jul','Aug','Sep','Oct','Nov','Dec']
-    orderRow = ['FOB Vessel','FOB Paper','C&F Vessel']
 
-    df_unique = (
-        df.sort_values('reg', ascending=False)
-          .drop_duplicates(subset=['cat','ship'], keep='first')
-    )
+# DataFrame loaders
+MONTHS = ['Jan','Feb','Mar','Apr','May','Jun',
+          'Jul','Aug','Sep','Oct','Nov','Dec']
+CATEGORIES = ['FOB Vessel','FOB Paper','C&F Vessel']
 
+def _pivotCells(df, columns, values, totals=True):
+    # Células (cat, coluna, valor) já agregadas no banco -> matriz categorias x meses.
+    # Com totals, zera buracos e acrescenta a coluna Year e a linha Total.
     table = (
-        df_unique
-        .pivot(index='cat', columns='ship', values='pos')
-        .reindex(columns=orderCol, fill_value=0)
-        .reindex(orderRow, fill_value=0)
-        .fillna(0)
+        df
+        .pivot(index='cat', columns=columns, values=values)
+        .reindex(columns=MONTHS, fill_value=0)
+        .reindex(CATEGORIES, fill_value=0)
     )
+    if not totals:
+        return table
 
+    table = table.fillna(0)
     table['Year'] = table.sum(axis=1)
     total_row = table.sum(axis=0).to_frame().T
     total_row.index = ['Total']
@@ -302,97 +1723,492 @@ def dbLoadPos(prod, year):
     return pd.concat([table, total_row])
 
 
-def dbLoadMtm(prod, year):
-    conn = dbConn()
-    query = """
-        SELECT mtm, cat, ship, year
-        FROM mtmtb
-        WHERE prod ILIKE %s AND year = %s
-        ORDER BY reg DESC;
-    """
-    df = pd.read_sql(query, conn, params=(prod, year))
-    dbClose(conn)
+# PnL por (prod, cat, mês) sobre o rollup diário (chaves x dias, não trades x
+# marcas); meses fechados vêm do snapshot do fechamento. dbLoadPnl e
+# dbLoadOverview usam a mesma consulta, então os números batem.
+PNL_MONTHS = """
+    SELECT prod, cat, to_char(month, 'Mon') AS month, SUM(pnl) AS pnl
+    FROM (
+        SELECT prod, cat, period AS month, pnl
+        FROM pnlCloseTb
+        WHERE prod = ANY(%(prods)s) AND year = %(year)s
+        UNION ALL
+        SELECT r.prod, r.cat, date_trunc('month', r.date)::date, r.pnl
+        FROM pnltb r
+        WHERE r.prod = ANY(%(prods)s) AND r.year = %(year)s
+          AND NOT EXISTS (SELECT 1 FROM periodTb p WHERE p.period = date_trunc('month', r.date)::date)
+    ) s
+    GROUP BY prod, cat, to_char(month, 'Mon')
+"""
 
-    orderCol = ['Jan','Feb','Mar','Apr','May','Jun',
-                'Jul','Aug','Sep','Oct','Nov','Dec']
-    orderRow = ['FOB Vessel','FOB Paper','C&F Vessel']
-
-    df_unique = (
-        df.sort_values('reg', ascending=False)
-          .drop_duplicates(subset=['cat','ship'], keep='first')
-    )
-
-    table = (
-        df_unique
-        .pivot(index='cat', columns='ship', values='mtm')
-        .reindex(columns=orderCol, fill_value=0)
-        .reindex(orderRow, fill_value=0)
-        .fillna(0)
-    )
+@instrumented
+@cached('mtmtb')
+def dbLoadPnl(prod, year):
+    with dbConnection(readonly=True) as conn:
+        df = pd.read_sql(PNL_MONTHS, conn, params={'prods': [prodKey(prod)], 'year': year})
+    return _pivotCells(df, 'month', 'pnl')
 
-    table['Year'] = table.sum(axis=1)
-    total_row = table.sum(axis=0).to_frame().T
-    total_row.index = ['Total']
 
-    return pd.concat([table, total_row])
+@instrumented
+@cached('posTb')
+def dbLoadPos(prod, year):
+    # posCurTb já tem uma linha por (cat, ship): custo O(chaves), não O(histórico)
+    query = """
+        SELECT cat, ship, pos
+        FROM posCurTb
+        WHERE prod = %s AND year = %s;
+    """
+    with dbConnection(readonly=True) as conn:
+        df = pd.read_sql(query, conn, params=(prodKey(prod), year))
+    return _pivotCells(df, 'ship', 'pos')
 
 
+@instrumented
+@cached('mtmtb')
 def dbLoadMtm(prod, year):
-    conn = dbConn()
+    # última marca por (cat, ship) entre as marcas correntes de cada trade
     query = """
-        SELECT mtm, cat, ship, year, reg
-        FROM mtmtb
-        WHERE prod ILIKE %s AND year = %s
-        ORDER BY reg DESC;
+        SELECT DISTINCT ON (cat, ship) cat, ship, mtm
+        FROM mtmCurTb
+        WHERE prod = %s AND year = %s
+        ORDER BY cat, ship, reg DESC, idPnl DESC;
     """
-    df = pd.read_sql(query, conn, params=(prod, year))
-    dbClose(conn)
+    with dbConnection(readonly=True) as conn:
+        df = pd.read_sql(query, conn, params=(prodKey(prod), year))
+    return _pivotCells(df, 'ship', 'mtm', totals=False)
 
-    orderCol = ['Jan','Feb','Mar','Apr','May','Jun',
-                'Jul','Aug','Sep','Oct','Nov','Dec']
-    orderRow = ['FOB Vessel','FOB Paper','C&F Vessel']
 
-    df_unique = df.sort_values('reg', ascending=False) \
-                  .drop_duplicates(subset=['cat','ship'], keep='first')
+@instrumented
+@cached('mtmtb', 'posTb')
+def dbLoadOverview(year, products=None):
+    # MTM, PnL e posição de todos os produtos numa única consulta
+    products = tuple(prodKey(p) for p in (products or PRODUCTS))
+    query = f"""
+        SELECT 'pnl' AS kind, prod, cat, month AS col, pnl AS val
+        FROM ({PNL_MONTHS}) p
+        UNION ALL
+        SELECT 'pos', prod, cat, ship, pos::numeric
+        FROM posCurTb
+        WHERE prod = ANY(%(prods)s) AND year = %(year)s
+        UNION ALL
+        SELECT 'mtm', prod, cat, ship, mtm
+        FROM (
+            SELECT DISTINCT ON (prod, cat, ship) prod, cat, ship, mtm
+            FROM mtmCurTb
+            WHERE prod = ANY(%(prods)s) AND year = %(year)s
+            ORDER BY prod, cat, ship, reg DESC, idPnl DESC
+        ) m;
+    """
+    with dbConnection(readonly=True) as conn:
+        df = pd.read_sql(query, conn, params={'prods': list(products), 'year': year})
+
+    result = {}
+    for prod in products:
+        cells = df[df['prod'] == prod]
+        pos = cells[cells['kind'] == 'pos'].astype({'val': 'int64'})
+        result[prod] = {
+            'mtm': _pivotCells(cells[cells['kind'] == 'mtm'], 'col', 'val', totals=False),
+            'pnl': _pivotCells(cells[cells['kind'] == 'pnl'], 'col', 'val'),
+            'pos': _pivotCells(pos, 'col', 'val'),
+        }
+    return result
 
-    table = (
-        df_unique
-        .pivot(index='cat', columns='ship', values='mtm')
-        .reindex(columns=orderCol, fill_value=0)
-        .reindex(orderRow, fill_value=0)
-    )
-    return table
 
+# Painéis do Overview em paralelo: uma tarefa por (produto, painel) num pool
+# de threads limitado ao tamanho do pool de conexões. Os resultados saem na
+# ordem em que ficam prontos; erro/timeout de um painel não derruba os outros.
+LOAD_WORKERS = int(os.environ.get('PNL_LOAD_WORKERS', POOL_SIZE))
+PANELS = {'mtm': dbLoadMtm, 'pnl': dbLoadPnl, 'pos': dbLoadPos}
+_executor = None
+_executorLock = threading.Lock()
 
+def _loadExecutor():
+    global _executor
+    with _executorLock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=LOAD_WORKERS, thread_name_prefix='pnl-load')
+        return _executor
 
+def _loadPanel(loader, prod, year, timeout):
+    with queryTimeout(timeout):
+        return loader(prod, year)
+
+@instrumented
+def dbLoadPanels(year, products=None, panels=('mtm', 'pnl', 'pos'), timeout=None):
+    # Gera (prod, painel, DataFrame, erro) conforme cada consulta termina
+    timeout = timeout or QUERY_TIMEOUT
+    products = [prodKey(p) for p in (products or PRODUCTS)]
+    executor = _loadExecutor()
+    futures = {executor.submit(_loadPanel, PANELS[panel], prod, year, timeout): (prod, panel)
+               for prod in products for panel in panels}
+    pending = set(futures)
+    try:
+        # folga para a espera por conexão livre além do statement_timeout
+        for future in as_completed(futures, timeout=timeout / 1000 + POOL_TIMEOUT):
+            pending.discard(future)
+            prod, panel = futures[future]
+            try:
+                yield prod, panel, future.result(), None
+            except Exception as e:
+                print(f'Erro painel {prod}/{panel}: {e}')
+                yield prod, panel, None, e
+    except FutureTimeout:
+        for future in pending:
+            future.cancel()
+            prod, panel = futures[future]
+            yield prod, panel, None, TimeoutError(f'{prod}/{panel} sem resposta')
+
+
+@instrumented
+@cached('tradeTb')
 def dbLoadTrade():
-    conn = dbConn()
     query = """SELECT * FROM tradeTb"""
-    df = pd.read_sql_query(query, conn)
-    conn.close()
+    with dbConnection(readonly=True) as conn:
+        df = _readFrame(conn, query)
     return df
 
 
+# Trade log paginado
+TRADE_LOG_COLUMNS = ['id', 'prod', 'cat', 'ship', 'year', 'op', 'ton', 'lvl', 'notion', 'date', 'reg']
+
+def _tradeFilters(prod=None, year=None, cat=None, op=None, dateFrom=None, dateTo=None):
+    clauses, params = [], {}
+    if prod:
+        clauses.append("prod = %(prod)s"); params['prod'] = prodKey(prod)
+    if year:
+        clauses.append("year = %(year)s"); params['year'] = int(year)
+    if cat:
+        clauses.append("cat = %(cat)s"); params['cat'] = cat
+    if op:
+        clauses.append("op = %(op)s"); params['op'] = op
+    if dateFrom:
+        clauses.append("date >= %(dateFrom)s"); params['dateFrom'] = dateFrom
+    if dateTo:
+        clauses.append("date <= %(dateTo)s"); params['dateTo'] = dateTo
+    return clauses, params
+
+@instrumented
+@cached('tradeTb')
+def dbLoadTradePage(prod=None, year=None, cat=None, op=None, dateFrom=None, dateTo=None,
+                    after=None, limit=50):
+    # Paginação por keyset (id DESC): after = menor id da página anterior.
+    # Custo proporcional ao tamanho da página, não à posição no histórico.
+    clauses, params = _tradeFilters(prod, year, cat, op, dateFrom, dateTo)
+    if after is not None:
+        clauses.append("id < %(after)s"); params['after'] = int(after)
+    params['limit'] = int(limit)
+    where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+    query = f"""
+        SELECT {', '.join(TRADE_LOG_COLUMNS)}
+        FROM tradeTb
+        {where}
+        ORDER BY id DESC
+        LIMIT %(limit)s;
+    """
+    with dbConnection(readonly=True) as conn:
+        df = _readFrame(conn, query, params, categories=False)
+    return df
+
+@instrumented
+@cached('tradeTb')
+def dbEstimateTrades(prod=None, year=None, cat=None, op=None, dateFrom=None, dateTo=None):
+    # Contagem estimada pelo planner (EXPLAIN), sem varrer a tabela
+    clauses, params = _tradeFilters(prod, year, cat, op, dateFrom, dateTo)
+    where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+    with dbConnection(readonly=True) as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"EXPLAIN (FORMAT JSON) SELECT 1 FROM tradeTb {where};", params)
+        plan = cursor.fetchone()[0]
+        cursor.close()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+@instrumented
+def dbIterTrades(prod=None, year=None, cat=None, op=None, dateFrom=None, dateTo=None, chunkSize=10000):
+    # Exportação em streaming: cursor nomeado (server-side), um DataFrame por lote.
+    # A conexão fica presa ao gerador até ele terminar ou ser fechado.
+    clauses, params = _tradeFilters(prod, year, cat, op, dateFrom, dateTo)
+    where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+    query = f"SELECT {', '.join(TRADE_LOG_COLUMNS)} FROM tradeTb {where} ORDER BY id;"
+    with dbConnection(readonly=True) as conn:
+        cursor = conn.cursor(name='pnl_trade_iter')
+        cursor.itersize = chunkSize
+        try:
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(chunkSize)
+                if not rows:
+                    break
+                yield pd.DataFrame(rows, columns=TRADE_LOG_COLUMNS)
+        finally:
+            cursor.close()
+
+
+@instrumented
+@cached('tradeTb', 'mtmtb')
+def dbLoadBook(prod, year, categories=None, shipments=None):
+    # Trades com a última marca (NULL = nunca marcado) para o motor pnl.py.
+    # lvl e mtm vêm em centavos inteiros: sem Decimal/float no caminho.
+    clauses, params = ["t.prod = %(prod)s", "t.year = %(year)s"], {'prod': prodKey(prod), 'year': int(year)}
+    if categories is not None:
+        clauses.append("t.cat = ANY(%(cats)s)"); params['cats'] = list(categories)
+    if shipments is not None:
+        clauses.append("t.ship = ANY(%(ships)s)"); params['ships'] = list(shipments)
+    query = f"""
+        SELECT t.id, t.prod, t.cat, t.ship, t.year, t.op, t.ton,
+               (t.lvl * 100)::bigint AS lvlCents, (m.mtm * 100)::bigint AS mtmCents
+        FROM tradeTb t
+        LEFT JOIN mtmCurTb m ON m.idTrade = t.id
+        WHERE {' AND '.join(clauses)}
+        ORDER BY t.id;
+    """
+    with dbConnection(readonly=True) as conn:
+        # mtmCents é NULL para trade nunca marcado
+        df = _readFrame(conn, query, params, dtypes={'mtmcents': 'float64'})
+    return df
+
 # Graph loader
-def dbLoadGraphPnl(prod, table='mtmtb'):
-    conn = dbConn()
+# Séries de PnL: soma do pnl por categoria e período (dia/semana/mês),
+# agregada no banco. Só tabelas conhecidas entram no SQL.
+RESOLUTIONS = ('day', 'week', 'month')
+GRAPH_TABLES = ('pnltb', 'mtmtb')     # pnltb: rollup diário; mtmtb: marcas brutas
+
+# Transações longas gravam reg = início da transação e podem ficar visíveis
+# depois de linhas mais novas: a atualização relê essa janela e descarta os
+# idPnl já vistos.
+GRAPH_OVERLAP = '10 minutes'
 
+@instrumented
+@cached('mtmtb')
+def dbLoadPnlBuckets(prod, resolution='day', table='pnltb'):
+    # Devolve o DataFrame (date, cat, pnl) e, em attrs, o último reg visto e
+    # os idPnl da janela de sobreposição, tudo do mesmo snapshot
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"Resolução inválida: {resolution} (use {', '.join(RESOLUTIONS)})")
+    if table not in GRAPH_TABLES:
+        raise ValueError(f"Tabela inválida: {table}")
     query = f"""
-        WITH latest AS (
-          SELECT DISTINCT ON (cat, date)
-            pnl, cat, date
-          FROM {table}
-          WHERE prod ILIKE %s
-          ORDER BY cat, date, reg DESC
-        )
-        SELECT pnl, cat, date
-        FROM latest
+        SELECT date_trunc(%(res)s, date)::date AS date, cat, SUM(pnl) AS pnl
+        FROM {table}
+        WHERE prod = %(prod)s
+        GROUP BY 1, 2
+        ORDER BY 1, 2;
+    """
+    params = {'res': resolution, 'prod': prodKey(prod), 'overlap': GRAPH_OVERLAP}
+    with dbConnection(readonly=True) as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY;")
+            cursor.execute("SELECT max(reg) FROM mtmtb WHERE prod = %(prod)s;", params)
+            params['lastReg'] = cursor.fetchone()[0]
+            cursor.execute("""
+                SELECT idPnl, reg FROM mtmtb
+                WHERE prod = %(prod)s AND reg > %(lastReg)s::timestamp - %(overlap)s::interval;""", params)
+            recent = dict(cursor.fetchall())
+            df = _readFrame(conn, query, params)
+        finally:
+            conn.rollback()
+            cursor.close()
+    df.attrs['lastReg'] = params['lastReg']
+    df.attrs['recent'] = recent
+    return df
+
+@instrumented
+def dbFetchPnlSince(prod, since):
+    # Linhas de mtmtb com reg na janela [since - GRAPH_OVERLAP, ...), para
+    # atualizar séries já carregadas sem reagregar o histórico
+    query = """
+        SELECT idPnl, cat, date, pnl, reg
+        FROM mtmtb
+        WHERE prod = %s AND reg > %s::timestamp - %s::interval
+        ORDER BY reg, idPnl;
+    """
+    with dbConnection(readonly=True) as conn:
+        df = _readFrame(conn, query, (prodKey(prod), since, GRAPH_OVERLAP))
+    return df
+
+@instrumented
+def dbLoadGraphPnl(prod, table='pnltb'):
+    return dbLoadPnlBuckets(prod, 'day', table)[['pnl', 'cat', 'date']]
+
+# Risk loaders (risk.py)
+# Dias úteis = dias com marca. pnltb tem uma linha por chave e dia marcado,
+# bem menos linhas que mtmtb, e continua populada depois do fechamento.
+@instrumented
+@cached('mtmtb')
+def dbRiskDates(asOf, count, products=None):
+    # Últimos count dias úteis até asOf, em ordem crescente
+    query = """
+        SELECT date FROM (
+            SELECT DISTINCT date FROM pnltb
+            WHERE prod = ANY(%(prods)s) AND date <= %(asOf)s
+            ORDER BY date DESC
+            LIMIT %(count)s
+        ) d
         ORDER BY date;
     """
+    params = {'prods': [prodKey(p) for p in (products or PRODUCTS)], 'asOf': asOf, 'count': int(count)}
+    with dbConnection(readonly=True) as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        dates = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+    return dates
+
+@instrumented
+def dbLoadMarkHistory(prod, dateFrom, dateTo):
+    # Marca de fechamento por chave e dia: a última por (reg, idPnl), como
+    # mtmCurTb. O max do array escolhe essa linha num HashAggregate, sem
+    # ordenar o histórico todo (DISTINCT ON ordenava por texto: ~4x mais lento).
+    # Sem @cached: roda também nos processos do risk.py, que não recebem as
+    # versões das tabelas; o cache fica no relatório.
+    query = """
+        SELECT cat, ship, year, date,
+               (max(ARRAY[extract(epoch FROM reg), idPnl, mtm]))[3] AS mtm
+        FROM mtmtb
+        WHERE prod = %s AND date >= %s AND date <= %s
+        GROUP BY cat, ship, year, date;
+    """
+    with dbConnection(readonly=True) as conn:
+        df = _readFrame(conn, query, (prodKey(prod), dateFrom, dateTo), categories=False)
+    return df
 
-    df = pd.read_sql(query, conn, params=[prod])
-    dbClose(conn)
+@instrumented
+@cached('posTb')
+def dbLoadRiskPositions(asOf=None, products=None):
+    # Posição por chave: corrente (posCurTb) ou, com asOf, a última gravada
+    # em posTb até aquele dia
+    params = {'prods': [prodKey(p) for p in (products or PRODUCTS)], 'asOf': asOf}
+    if asOf is None:
+        query = """
+            SELECT prod, cat, ship, year, pos FROM posCurTb
+            WHERE prod = ANY(%(prods)s) AND pos <> 0;
+        """
+    else:
+        query = """
+            SELECT prod, cat, ship, year, pos FROM (
+                SELECT DISTINCT ON (prod, year, cat, ship) prod, cat, ship, year, pos
+                FROM posTb
+                WHERE prod = ANY(%(prods)s) AND date <= %(asOf)s
+                ORDER BY prod, year, cat, ship, reg DESC, id DESC
+            ) p
+            WHERE pos <> 0;
+        """
+    with dbConnection(readonly=True) as conn:
+        df = _readFrame(conn, query, params, categories=False)
     return df
 
+# Métricas
+# Registro em memória (metrics.registry) com os contadores de cada função
+# acima; o pool e o cache entram como gauges. Com PNL_METRICS_PORT, o texto
+# Prometheus fica em http://<host>:<porta>/metrics.
+METRICS_PORT = os.environ.get('PNL_METRICS_PORT')
+
+for _name, _help, _fn in (
+        ('pnl_pool_in_use', 'Pooled connections checked out', lambda: dbPoolStats()['inUse']),
+        ('pnl_pool_idle', 'Idle pooled connections', lambda: dbPoolStats()['idle']),
+        ('pnl_pool_waits', 'Checkouts that had to wait', lambda: dbPoolStats()['waits']),
+        ('pnl_cache_entries', 'Result cache entries', lambda: dbCacheStats()['size']),
+        ('pnl_cache_hits', 'Result cache hits', lambda: dbCacheStats()['hits']),
+        ('pnl_cache_misses', 'Result cache misses', lambda: dbCacheStats()['misses']),
+        ('pnl_reads_replica', 'Reads served by a replica', lambda: _reads['replica']),
+        ('pnl_reads_fallback', 'Reads sent to the primary with no replica available', lambda: _reads['fallback']),
+        ('pnl_replicas_up', 'Replicas in rotation',
+         lambda: sum(r['up'] for r in dbReplicaStats().values()) if _targets else 0)):
+    metrics.registry.gauge(_name, _help, _fn)
+metrics.explainWith(dbConnection)
+
+def dbMetrics():
+    return metrics.registry.snapshot()
+
+def dbSlowQueries():
+    return metrics.registry.slowQueries()
+
+def dbMetricsText():
+    return metrics.registry.prometheusText()
+
+if METRICS_PORT:
+    try:
+        metrics.serve(METRICS_PORT)
+    except OSError as e:
+        print(f'Erro endpoint de métricas: {e}')
+
 if __name__ == '__main__':
-    dbCreateTable()
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description='PNL System - manutenção do banco')
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('setup', help='cria tabelas/índices/triggers (padrão)')
+    commands.add_parser('rebuild-state', help='reconstrói o estado corrente')
+    commands.add_parser('replicas', help='testa primário e réplicas (conexão, recovery, atraso)')
+    exp = commands.add_parser('export', help='exporta tradeTb/mtmtb/posTb em CSV ou Parquet via COPY')
+    exp.add_argument('table', choices=['trade', 'mtm', 'pos'])
+    exp.add_argument('--format', dest='fmt', choices=['csv', 'parquet'], default='csv')
+    exp.add_argument('-o', '--output', default='-', help="arquivo de saída ('-' = stdout)")
+    exp.add_argument('--prod')
+    exp.add_argument('--year', type=int)
+    exp.add_argument('--from', dest='dateFrom', help='data inicial (YYYY-MM-DD)')
+    exp.add_argument('--to', dest='dateTo', help='data final (YYYY-MM-DD)')
+    imp = commands.add_parser('import', help='importa trades/marcas/posições de CSV ou Parquet via COPY')
+    imp.add_argument('kind', choices=['trade', 'mtm', 'pos'])
+    imp.add_argument('path')
+    imp.add_argument('--chunk-size', type=int, default=100000, help='linhas por transação/checkpoint')
+    imp.add_argument('--restart', action='store_true', help='ignora o checkpoint e importa do início')
+    imp.add_argument('--dry-run', action='store_true', help='só valida o arquivo, sem gravar')
+    part = commands.add_parser('partition', help='converte mtmtb/posTb em particionadas por ano (PNL_PARTITION)')
+    part.add_argument('--year', type=int, nargs='*', default=[], help='anos extras a criar')
+    close = commands.add_parser('close-period', help='fecha um mês (snapshot do pnl; escritas no mês passam a falhar)')
+    close.add_argument('period', help='YYYY-MM')
+    reopen = commands.add_parser('reopen-period', help='reabre um mês fechado')
+    reopen.add_argument('period', help='YYYY-MM')
+    comp = commands.add_parser('compact', help='uma marca/posição por chave e dia (mantém a última)')
+    comp.add_argument('--before', help='compacta só dias anteriores (YYYY-MM-DD, padrão: hoje)')
+    comp.add_argument('--year', type=int, nargs='*', help='só estes anos')
+    comp.add_argument('--prod', nargs='*', help='só estes produtos')
+    comp.add_argument('--table', nargs='*', choices=['mtmtb', 'posTb'], default=['mtmtb', 'posTb'])
+    comp.add_argument('--full', action='store_true', help='VACUUM FULL (devolve o espaço; trava a tabela)')
+    args = parser.parse_args()
+
+    if args.command in (None, 'setup'):
+        dbCreateTable()
+    elif args.command == 'rebuild-state':
+        print(dbRebuildState())
+    elif args.command == 'replicas':
+        report = dbCheckReplicas()
+        for target, row in report.items():
+            lag = '-' if row['lag'] is None else f"{row['lag']:.1f}s"
+            print(f"{target:9} {'ok' if row['ok'] else 'FALHA':5} conexão {row['connectMs'] or '-':>7} ms  "
+                  f"recovery {row['recovery']!s:5}  atraso {lag:>6}  {row['error'] or ''}")
+        sys.exit(0 if all(row['ok'] for row in report.values()) else 1)
+    elif args.command == 'partition':
+        print(dbPartitionTables(args.year))
+    elif args.command == 'close-period':
+        print(dbClosePeriod(args.period))
+    elif args.command == 'reopen-period':
+        print('reaberto' if dbReopenPeriod(args.period) else 'período não estava fechado')
+    elif args.command == 'compact':
+        report = dbCompactHistory(args.before, args.year, args.prod, args.table, args.full)
+        for table, item in report.items():
+            before, after = item['before'], item['after']
+            print(f"{table:6} linhas {before['rows']:>10,} -> {after['rows']:>10,}  "
+                  f"tamanho {before['bytes'] / 2**20:8.1f} -> {after['bytes'] / 2**20:8.1f} MB  "
+                  f"({item['deleted']:,} apagadas, {item['updated']:,} somadas)")
+    elif args.command == 'export':
+        import export
+
+        filters = dict(prod=args.prod, year=args.year, dateFrom=args.dateFrom, dateTo=args.dateTo)
+        if args.output == '-':
+            stats = export.export(args.table, args.fmt, sys.stdout.buffer, **filters)
+        else:
+            with open(args.output, 'wb') as out:
+                stats = export.export(args.table, args.fmt, out, **filters)
+        print(f"{stats['rows']} linhas em {stats['seconds']:.2f}s", file=sys.stderr)
+    elif args.command == 'import':
+        import importer
+
+        stats = importer.dbImport(args.path, args.kind, chunkSize=args.chunk_size,
+                                  restart=args.restart, dryRun=args.dry_run)
+        print(f"{stats['rows']} linhas importadas ({stats['skipped']} já no checkpoint) em "
+              f"{stats['seconds']:.2f}s — {stats['rowsPerSec']:,.0f} linhas/s")
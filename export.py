@@ -0,0 +1,163 @@
+# Exportação em streaming de tradeTb, mtmtb e posTb.
+#
+# O banco gera o CSV com COPY ... TO STDOUT e os bytes vão direto para o
+# destino, sem montar DataFrame. Para Parquet, o CSV do COPY passa por um pipe e
+# é convertido em lotes pelo leitor incremental do pyarrow. Nos dois casos o uso
+# de memória não depende do número de linhas.
+#
+# O download pelo app passa pela memória do servidor do Streamlit, então lá o
+# tamanho é limitado a APP_MAX_BYTES; acima disso, use a linha de comando:
+#
+#   python export.py mtm --format parquet --prod SoyBean --year 2026 -o mtm.parquet
+import os
+import shlex
+import threading
+import time
+
+from data import dbConnection, prodKey
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    import pyarrow.parquet as pq
+    HAS_PARQUET = True
+except ImportError:
+    HAS_PARQUET = False
+
+EXPORT_TABLES = {
+    'trade': ('tradeTb', ['id', 'prod', 'cat', 'ship', 'year', 'op', 'ton', 'lvl', 'notion', 'date', 'reg']),
+    'mtm': ('mtmtb', ['idPnl', 'idTrade', 'prod', 'cat', 'ship', 'year', 'mtm', 'pnl', 'date', 'reg']),
+    'pos': ('posTb', ['id', 'prod', 'cat', 'ship', 'year', 'pos', 'date', 'reg']),
+}
+FORMATS = ('csv', 'parquet')
+APP_MAX_BYTES = int(os.environ.get('PNL_EXPORT_APP_MB', 50)) << 20    # download pelo app
+
+
+def _arrowTypes():
+    # tipos fixos por coluna: o Parquet sai com o mesmo tipo em todos os lotes
+    return {
+        'id': pa.int32(), 'idpnl': pa.int32(), 'idtrade': pa.int32(),
+        'prod': pa.string(), 'cat': pa.string(), 'ship': pa.string(), 'op': pa.string(),
+        'year': pa.int32(), 'ton': pa.int32(), 'pos': pa.int32(),
+        'lvl': pa.decimal128(4, 2), 'mtm': pa.decimal128(4, 2),
+        'notion': pa.decimal128(11, 2), 'pnl': pa.decimal128(11, 2),
+        'date': pa.date32(), 'reg': pa.timestamp('us'),
+    }
+
+
+def exportQuery(cursor, table, prod=None, year=None, dateFrom=None, dateTo=None):
+    # COPY não aceita parâmetros: o SELECT é montado com mogrify (valores escapados)
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Tabela de exportação inválida: {table} (use {', '.join(EXPORT_TABLES)})")
+    name, columns = EXPORT_TABLES[table]
+    clauses, params = [], []
+    if prod:
+        clauses.append("prod = %s"); params.append(prodKey(prod))
+    if year:
+        clauses.append("year = %s"); params.append(int(year))
+    if dateFrom:
+        clauses.append("date >= %s"); params.append(dateFrom)
+    if dateTo:
+        clauses.append("date <= %s"); params.append(dateTo)
+    where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+    order = columns[0]
+    select = f"SELECT {', '.join(columns)} FROM {name} {where} ORDER BY {order}"
+    return cursor.mogrify(select, params).decode()
+
+
+def exportCsv(table, out, **filters):
+    # out: arquivo binário aberto (ou sys.stdout.buffer)
+    t0 = time.perf_counter()
+    with dbConnection(readonly=True) as conn:
+        cursor = conn.cursor()
+        try:
+            select = exportQuery(cursor, table, **filters)
+            cursor.copy_expert(f"COPY ({select}) TO STDOUT WITH (FORMAT csv, HEADER)", out)
+            rows = cursor.rowcount
+        finally:
+            cursor.close()
+    return {'rows': rows, 'seconds': time.perf_counter() - t0}
+
+
+def exportParquet(table, out, blockSize=1 << 20, **filters):
+    if not HAS_PARQUET:
+        raise RuntimeError("Exportação Parquet requer pyarrow (pip install pyarrow)")
+    t0 = time.perf_counter()
+    name, columns = EXPORT_TABLES[table]
+    types = _arrowTypes()
+    readFd, writeFd = os.pipe()
+    failure = []
+
+    with dbConnection(readonly=True) as conn:
+        cursor = conn.cursor()
+        select = exportQuery(cursor, table, **filters)
+
+        def produce():
+            # COPY escreve no pipe numa thread; o pyarrow consome do outro lado
+            try:
+                with os.fdopen(writeFd, 'wb') as pipe:
+                    cursor.copy_expert(f"COPY ({select}) TO STDOUT WITH (FORMAT csv, HEADER)", pipe)
+            except Exception as e:
+                failure.append(e)
+
+        producer = threading.Thread(target=produce, name='pnl-export-copy', daemon=True)
+        producer.start()
+        rows = 0
+        try:
+            with os.fdopen(readFd, 'rb') as pipe:
+                reader = pacsv.open_csv(
+                    pipe,
+                    read_options=pacsv.ReadOptions(block_size=blockSize),
+                    convert_options=pacsv.ConvertOptions(
+                        column_types={c.lower(): types[c.lower()] for c in columns}),
+                )
+                with pq.ParquetWriter(out, reader.schema) as writer:
+                    for batch in reader:
+                        writer.write_batch(batch)
+                        rows += batch.num_rows
+        finally:
+            producer.join()
+            cursor.close()
+    if failure:
+        raise failure[0]
+    return {'rows': rows, 'seconds': time.perf_counter() - t0}
+
+
+def export(table, fmt, out, **filters):
+    if fmt == 'csv':
+        return exportCsv(table, out, **filters)
+    if fmt == 'parquet':
+        return exportParquet(table, out, **filters)
+    raise ValueError(f"Formato inválido: {fmt} (use {', '.join(FORMATS)})")
+
+
+def cliCommand(table, fmt, prod=None, year=None, dateFrom=None, dateTo=None):
+    # mesma exportação pela linha de comando (sugerida pelo app acima de APP_MAX_BYTES)
+    args = ['python', 'export.py', table, '--format', fmt]
+    for flag, value in (('--prod', prod), ('--year', year), ('--from', dateFrom), ('--to', dateTo)):
+        if value:
+            args += [flag, str(value)]
+    return shlex.join(args + ['-o', f'{table}.{fmt}'])
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description='Exportação em streaming de tradeTb, mtmtb e posTb')
+    parser.add_argument('table', choices=list(EXPORT_TABLES))
+    parser.add_argument('--format', dest='fmt', choices=FORMATS, default='csv')
+    parser.add_argument('--prod')
+    parser.add_argument('--year', type=int)
+    parser.add_argument('--from', dest='dateFrom', help='data inicial (YYYY-MM-DD)')
+    parser.add_argument('--to', dest='dateTo', help='data final (YYYY-MM-DD)')
+    parser.add_argument('-o', '--output', help='arquivo de saída (padrão: stdout)')
+    args = parser.parse_args()
+
+    filters = {'prod': args.prod, 'year': args.year, 'dateFrom': args.dateFrom, 'dateTo': args.dateTo}
+    if args.output:
+        with open(args.output, 'wb') as out:
+            stats = export(args.table, args.fmt, out, **filters)
+    else:
+        stats = export(args.table, args.fmt, sys.stdout.buffer, **filters)
+    print(f"{args.table}: {stats['rows']:,} linhas em {stats['seconds']:.1f}s", file=sys.stderr)
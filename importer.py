@@ -0,0 +1,244 @@
+# Importação em lote de trades, marcas e posições a partir de CSV/Parquet.
+#
+# Cada bloco do arquivo é validado contra as restrições das colunas, copiado
+# com COPY FROM STDIN para uma tabela temporária e mesclado no histórico com
+# SQL set-wise (posição por soma acumulada, PnL por LAG da marca anterior). O
+# checkpoint em importTb é gravado na mesma transação do bloco: se a carga cair,
+# rodar de novo continua do primeiro bloco não gravado, e um arquivo já
+# importado por inteiro não é gravado duas vezes.
+import io
+import os
+import time
+
+import pandas as pd
+
+from data import dbConnection, prodKey, get_conversion_value, _bumpVersion, PRODUCTS
+from metrics import instrumented
+
+try:
+    import pyarrow.parquet as pq
+    HAS_PARQUET = True
+except ImportError:
+    HAS_PARQUET = False
+
+# Colunas de cada tipo de arquivo: (nome, tipo, tamanho/precisão, escala).
+# Espelham as colunas de tradeTb/mtmtb/posTb; date é opcional (padrão: hoje).
+IMPORT_COLUMNS = {
+    'trade': [('prod', 'str', 7), ('cat', 'str', 10), ('ship', 'str', 3), ('year', 'int'),
+              ('op', 'str', 8), ('ton', 'int'), ('lvl', 'num', 4, 2), ('notion', 'num', 11, 2)],
+    'mtm': [('idTrade', 'int'), ('mtm', 'num', 4, 2)],
+    'pos': [('prod', 'str', 7), ('cat', 'str', 10), ('ship', 'str', 3), ('year', 'int'), ('pos', 'int')],
+}
+OPERATIONS = ('Purchase', 'Sale')
+MAX_ERRORS = 10
+INT32 = 2 ** 31 - 1
+
+_SQL_TYPES = {'str': lambda c: f"VARCHAR({c[2]})", 'int': lambda c: "INTEGER",
+              'num': lambda c: f"NUMERIC({c[2]},{c[3]})"}
+
+# Mesma regra de dbInsertTrades: posição corrente da chave + soma acumulada
+# das pernas na ordem do arquivo, com o LOCK serializando escritas de posição.
+MERGE = {
+    'trade': """
+        LOCK TABLE posTb IN SHARE ROW EXCLUSIVE MODE;
+        WITH ins AS (
+            INSERT INTO tradeTb(prod, cat, ship, year, op, ton, lvl, notion, date)
+            SELECT prod, cat, ship, year, op, ton, lvl, notion, COALESCE(date, CURRENT_DATE)
+            FROM importStage ORDER BY ord
+        )
+        INSERT INTO posTb(prod, cat, ship, year, pos, date)
+        SELECT s.prod, s.cat, s.ship, s.year,
+               COALESCE(prev.pos, 0)
+               + SUM(CASE WHEN s.op = 'Purchase' THEN s.ton ELSE -s.ton END)
+                 OVER (PARTITION BY s.prod, s.cat, s.ship, s.year ORDER BY s.ord),
+               COALESCE(s.date, CURRENT_DATE)
+        FROM importStage s
+        LEFT JOIN posCurTb prev USING (prod, cat, ship, year)
+        ORDER BY s.ord;
+    """,
+    # marca anterior: linha anterior do mesmo trade no arquivo, senão a última
+    # gravada (mtmCurTb), senão o lvl do trade; como em dbRevalueMtm, com o
+    # LOCK serializando marcas concorrentes sobre a mesma marca anterior
+    'mtm': """
+        LOCK TABLE mtmtb IN SHARE ROW EXCLUSIVE MODE;
+        WITH conv(prod, conV) AS (SELECT * FROM unnest(%(prods)s::text[], %(convs)s::numeric[]))
+        INSERT INTO mtmtb(idTrade, prod, cat, ship, year, mtm, pnl, date)
+        SELECT s.idTrade, t.prod, t.cat, t.ship, t.year, s.mtm,
+               CASE WHEN t.op = 'Sale' THEN COALESCE(s.lagMtm, m.mtm, t.lvl) - s.mtm
+                    ELSE s.mtm - COALESCE(s.lagMtm, m.mtm, t.lvl)
+               END * COALESCE(c.conV, 1) * t.ton,
+               COALESCE(s.date, CURRENT_DATE)
+        FROM (SELECT *, LAG(mtm) OVER (PARTITION BY idTrade ORDER BY ord) AS lagMtm
+              FROM importStage) s
+        JOIN tradeTb t ON t.id = s.idTrade
+        LEFT JOIN mtmCurTb m ON m.idTrade = s.idTrade
+        LEFT JOIN conv c ON c.prod = t.prod
+        ORDER BY s.ord;
+    """,
+    'pos': """
+        INSERT INTO posTb(prod, cat, ship, year, pos, date)
+        SELECT prod, cat, ship, year, pos, COALESCE(date, CURRENT_DATE)
+        FROM importStage ORDER BY ord;
+    """,
+}
+TABLES = {'trade': ('tradeTb', 'posTb'), 'mtm': ('mtmtb',), 'pos': ('posTb',)}
+
+
+def readChunks(path, chunkSize, skip=0):
+    # Lê o arquivo em blocos de texto (str), pulando as linhas já importadas.
+    # Devolve (offset da primeira linha do bloco, DataFrame).
+    if path.lower().endswith('.parquet'):
+        if not HAS_PARQUET:
+            raise RuntimeError("Importação Parquet requer pyarrow (pip install pyarrow)")
+        offset = 0
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunkSize):
+            if offset + batch.num_rows > skip:
+                df = batch.to_pandas().iloc[max(skip - offset, 0):]
+                yield offset + max(skip - offset, 0), df.astype(object).where(df.notna(), '').astype(str)
+            offset += batch.num_rows
+    else:
+        offset = skip
+        reader = pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=chunkSize,
+                             skiprows=range(1, skip + 1))
+        for df in reader:
+            yield offset, df
+            offset += len(df)
+
+
+def validate(df, kind, offset=0):
+    # Confere um bloco contra as restrições das colunas de destino e devolve as
+    # colunas na ordem da tabela temporária. Erros citam a linha do arquivo.
+    columns = IMPORT_COLUMNS[kind]
+    names = {c.lower(): c for c in df.columns}
+    missing = [c[0] for c in columns if c[0].lower() not in names]
+    if missing:
+        raise ValueError(f"Colunas ausentes para {kind}: {', '.join(missing)}")
+    out = pd.DataFrame({'ord': range(offset, offset + len(df))}, index=df.index)
+    errors = []
+
+    def fail(mask, message, values):
+        for pos in mask.to_numpy().nonzero()[0][:MAX_ERRORS]:
+            errors.append(f"linha {offset + pos + 2}: {message} ({values.iloc[pos]!r})")
+
+    for spec in columns:
+        col, typ = spec[0], spec[1]
+        values = df[names[col.lower()]].astype(str).str.strip()
+        if typ == 'str':
+            if col == 'prod':
+                values = values.map(prodKey)
+            fail(values.eq(''), f"{col} vazio", values)
+            fail(values.str.len().gt(spec[2]), f"{col} maior que {spec[2]} caracteres", values)
+            if col == 'op':
+                fail(~values.isin(OPERATIONS) & values.ne(''), f"op deve ser {' ou '.join(OPERATIONS)}", values)
+        elif typ == 'int':
+            ok = values.str.fullmatch(r'-?\d{1,10}')
+            fail(~ok, f"{col} não é inteiro", values)
+            fail(ok & pd.to_numeric(values.where(ok), errors='coerce').abs().gt(INT32),
+                 f"{col} fora do intervalo INTEGER", values)
+        else:
+            # NUMERIC(p,s): até p-s dígitos inteiros e s decimais, sem arredondar
+            digits, scale = spec[2] - spec[3], spec[3]
+            ok = values.str.fullmatch(rf'-?\d{{1,{digits}}}(\.\d{{1,{scale}}})?|-?\.\d{{1,{scale}}}')
+            fail(~ok, f"{col} não cabe em NUMERIC({spec[2]},{scale})", values)
+        out[col] = values
+    if 'date' in names:
+        values = df[names['date']].astype(str).str.strip()
+        dates = pd.to_datetime(values, format='%Y-%m-%d', errors='coerce')
+        fail(dates.isna() & values.ne(''), "date inválida (use YYYY-MM-DD)", values)
+        out['date'] = values
+    else:
+        out['date'] = ''
+    if errors:
+        raise ValueError(f"{len(errors)} erro(s) de validação em {kind}:\n" + "\n".join(errors[:MAX_ERRORS]))
+    return out
+
+
+def _stage(cursor, kind, df):
+    columns = ", ".join(f"{c[0]} {_SQL_TYPES[c[1]](c)}" for c in IMPORT_COLUMNS[kind])
+    cursor.execute(f"CREATE TEMP TABLE importStage(ord BIGINT, {columns}, date DATE) ON COMMIT DROP;")
+    buf = io.StringIO()
+    df.to_csv(buf, index=False, header=False)
+    buf.seek(0)
+    # campo vazio sem aspas = NULL (date opcional)
+    cursor.copy_expert("COPY importStage FROM STDIN WITH (FORMAT csv)", buf)
+
+
+def _checkpoint(cursor, source):
+    cursor.execute("SELECT kind, size, rowsDone FROM importTb WHERE source = %s;", (source,))
+    return cursor.fetchone()
+
+
+def validateFile(path, kind, chunkSize=100000, skip=0):
+    # Passada só de validação (sem banco); devolve o número de linhas
+    rows = 0
+    for offset, df in readChunks(path, chunkSize, skip):
+        validate(df, kind, offset)
+        rows += len(df)
+    return rows
+
+
+@instrumented
+def dbImport(path, kind, chunkSize=100000, restart=False, dryRun=False):
+    # Importa o arquivo em blocos de chunkSize linhas; cada bloco é uma
+    # transação (stage + merge + checkpoint). O arquivo inteiro é validado
+    # antes do primeiro bloco, para que um erro de conteúdo não deixe a carga
+    # pela metade. Devolve contadores e linhas/s.
+    if kind not in IMPORT_COLUMNS:
+        raise ValueError(f"Tipo de importação inválido: {kind} (use {', '.join(IMPORT_COLUMNS)})")
+    source, size = os.path.abspath(path), os.path.getsize(path)
+    t0 = time.perf_counter()
+    done = skipped = 0
+
+    if dryRun:
+        done = validateFile(path, kind, chunkSize)
+        seconds = time.perf_counter() - t0
+        return {'rows': done, 'skipped': 0, 'seconds': seconds, 'rowsPerSec': done / seconds if seconds else 0}
+
+    with dbConnection() as conn:
+        cursor = conn.cursor()
+        try:
+            if restart:
+                cursor.execute("DELETE FROM importTb WHERE source = %s;", (source,))
+                conn.commit()
+            previous = _checkpoint(cursor, source)
+            conn.commit()
+            if previous:
+                if previous[0] != kind or previous[1] != size:
+                    raise ValueError(f"Checkpoint de {source} é de outro arquivo ({previous[0]}, {previous[1]} bytes); "
+                                     "use restart=True para importar do início")
+                skipped = previous[2]
+            validateFile(path, kind, chunkSize, skipped)
+            for offset, df in readChunks(path, chunkSize, skip=skipped):
+                if df.empty:
+                    continue
+                rows = validate(df, kind, offset)
+                _stage(cursor, kind, rows)
+                if kind == 'mtm':
+                    cursor.execute("""
+                        SELECT s.ord + 2 FROM importStage s
+                        WHERE NOT EXISTS (SELECT 1 FROM tradeTb t WHERE t.id = s.idTrade)
+                        ORDER BY s.ord LIMIT %s;""", (MAX_ERRORS,))
+                    unknown = [r[0] for r in cursor.fetchall()]
+                    if unknown:
+                        raise ValueError(f"idTrade inexistente nas linhas {', '.join(map(str, unknown))}")
+                    cursor.execute(MERGE[kind], {'prods': PRODUCTS,
+                                                 'convs': [get_conversion_value(p) for p in PRODUCTS]})
+                else:
+                    cursor.execute(MERGE[kind])
+                cursor.execute("""
+                    INSERT INTO importTb(source, kind, size, rowsDone) VALUES (%s, %s, %s, %s)
+                    ON CONFLICT (source) DO UPDATE SET rowsDone = EXCLUDED.rowsDone, reg = CURRENT_TIMESTAMP;""",
+                               (source, kind, size, offset + len(rows)))
+                conn.commit()
+                _bumpVersion(*TABLES[kind])
+                done += len(rows)
+                elapsed = time.perf_counter() - t0
+                print(f"{kind}: {offset + len(rows)} linhas gravadas ({done / elapsed:,.0f} linhas/s)")
+        except Exception as e:
+            print(f'Erro import: {e}')
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+    seconds = time.perf_counter() - t0
+    return {'rows': done, 'skipped': skipped, 'seconds': seconds, 'rowsPerSec': done / seconds if seconds else 0}
@@ -0,0 +1,368 @@
+# Fila de escritas em background para o Insert Trade e o Insert MTM.
+#
+# jobSubmit grava o pedido em jobTb e volta na hora com o id do job. Workers
+# (threads deste processo ou `python jobs.py worker`) pegam o próximo job com
+# FOR UPDATE SKIP LOCKED e o executam em lotes de JOB_BATCH linhas, uma
+# transação por lote. O progresso (resumeAt, done) é gravado na mesma
+# transação do lote, como o checkpoint do importer: se o worker cair, outro
+# retoma o job do primeiro lote não gravado, sem marcas ou trades em dobro.
+# A idempotency key é única: reenviar o mesmo formulário devolve o job já
+# existente em vez de gravar de novo.
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+import pandas as pd
+import psycopg2.extras
+
+import metrics
+from data import (dbConnection, _bumpVersion, _insertTrades, _revalue, _revalueParams, MAX_ID)
+from metrics import instrumented
+
+JOB_BATCH = int(os.environ.get('PNL_JOB_BATCH', 5000))           # linhas por transação
+JOB_WORKERS = int(os.environ.get('PNL_JOB_WORKERS', 1))          # threads neste processo (0 = nenhuma)
+JOB_POLL = float(os.environ.get('PNL_JOB_POLL', 2))              # espera entre buscas com a fila vazia (s)
+JOB_STALE = os.environ.get('PNL_JOB_STALE', '2 minutes')         # running sem heartbeat volta para a fila
+STATUSES = ('queued', 'running', 'done', 'failed', 'cancelled')
+TABLES = {'revalue': ('mtmtb',), 'trades': ('tradeTb', 'posTb')}
+
+# Contadores dos workers deste processo (throughput no Admin e em /metrics)
+_stats = {'jobs': 0, 'failed': 0, 'batches': 0, 'rows': 0, 'seconds': 0.0}
+_statsLock = threading.Lock()
+_workers = []
+_workersLock = threading.Lock()
+_wake = threading.Event()
+
+
+def _count(**values):
+    with _statsLock:
+        for key, value in values.items():
+            _stats[key] += value
+
+
+# Submit
+def _legs(trades):
+    # tuplas de dbInsertTrades -> JSON (Decimal como texto, sem perder casas)
+    return [[str(v) if isinstance(v, Decimal) else v for v in trade] for trade in trades]
+
+
+@instrumented
+def jobSubmit(kind, params, key=None):
+    # Enfileira e devolve o id. Com a mesma key, devolve o job já existente.
+    # revalue: params = {prod, year, mtm, categories, shipments}; o job só
+    # reavalia os trades que já existiam no envio (upTo = maior id da seleção).
+    # trades: params = {legs: [(prod, cat, ship, year, op, ton, lvl, notion), ...]}.
+    if kind not in TABLES:
+        raise ValueError(f"Tipo de job inválido: {kind} (use {', '.join(TABLES)})")
+    key = key or uuid.uuid4().hex
+    params = dict(params)
+    with dbConnection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT id FROM jobTb WHERE key = %s;", (key,))
+            row = cursor.fetchone()
+            if row is None:
+                if kind == 'revalue':
+                    params['mtm'] = str(params['mtm'])
+                    params['categories'], params['shipments'] = list(params['categories']), list(params['shipments'])
+                    cursor.execute("""
+                        SELECT count(*), COALESCE(max(id), 0) FROM tradeTb
+                        WHERE prod = %s AND year = %s AND cat = ANY(%s) AND ship = ANY(%s);""",
+                        (params['prod'], params['year'], params['categories'], params['shipments']))
+                    total, params['upTo'] = cursor.fetchone()
+                else:
+                    params['legs'] = _legs(params['legs'])
+                    total = len(params['legs'])
+                # ON CONFLICT: dois envios simultâneos com a mesma key
+                cursor.execute("""
+                    INSERT INTO jobTb(key, kind, params, total) VALUES (%s, %s, %s, %s)
+                    ON CONFLICT (key) DO NOTHING RETURNING id;""",
+                    (key, kind, psycopg2.extras.Json(params), total))
+                row = cursor.fetchone()
+                if row is None:
+                    cursor.execute("SELECT id FROM jobTb WHERE key = %s;", (key,))
+                    row = cursor.fetchone()
+            conn.commit()
+        except Exception as e:
+            print(f'Erro jobSubmit: {e}')
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+    startWorkers()
+    _wake.set()
+    return row[0]
+
+
+def jobSubmitRevalue(prod, year, mtm, categories, shipments, key=None):
+    return jobSubmit('revalue', {'prod': prod, 'year': year, 'mtm': mtm,
+                                 'categories': categories, 'shipments': shipments}, key)
+
+
+def jobSubmitTrades(trades, key=None):
+    return jobSubmit('trades', {'legs': list(trades)}, key)
+
+
+# Status
+JOB_COLUMNS = ['id', 'kind', 'status', 'total', 'done', 'error', 'reg', 'started', 'finished', 'worker']
+
+@instrumented
+def jobStatus(id):
+    with dbConnection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobTb WHERE id = %s;", (id,))
+        row = cursor.fetchone()
+        conn.rollback()
+        cursor.close()
+    if row is None:
+        return None
+    job = dict(zip(JOB_COLUMNS, row))
+    job['progress'] = 1.0 if job['status'] == 'done' else (
+        min(job['done'] / job['total'], 1.0) if job['total'] else 0.0)
+    return job
+
+
+@instrumented
+def jobList(limit=50, status=None):
+    query = f"""
+        SELECT {', '.join(JOB_COLUMNS)} FROM jobTb
+        WHERE %(status)s::text IS NULL OR status = %(status)s
+        ORDER BY id DESC
+        LIMIT %(limit)s;
+    """
+    with dbConnection() as conn:
+        df = pd.read_sql(query, conn, params={'status': status, 'limit': limit})
+    return df
+
+
+@instrumented
+def jobStats():
+    # Profundidade da fila e vazão (linhas/s) dos jobs terminados na última hora
+    with dbConnection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT count(*) FILTER (WHERE status = 'queued'),
+                   count(*) FILTER (WHERE status = 'running'),
+                   COALESCE(sum(total - done) FILTER (WHERE status IN ('queued', 'running')), 0)
+            FROM jobTb WHERE status IN ('queued', 'running');""")
+        queued, running, backlog = cursor.fetchone()
+        cursor.execute("""
+            SELECT count(*) FILTER (WHERE status = 'done'), count(*) FILTER (WHERE status = 'failed'),
+                   COALESCE(sum(done), 0),
+                   COALESCE(extract(epoch FROM sum(finished - started)), 0)
+            FROM jobTb WHERE finished > now() - INTERVAL '1 hour';""")
+        done, failed, rows, seconds = cursor.fetchone()
+        conn.rollback()
+        cursor.close()
+    with _statsLock:
+        local = dict(_stats)
+    return {'queued': queued, 'running': running, 'backlogRows': int(backlog),
+            'doneLastHour': done, 'failedLastHour': failed,
+            'rowsPerSec': round(float(rows) / float(seconds), 1) if seconds else None,
+            'workers': sum(t.is_alive() for t in _workers), 'process': local}
+
+
+def jobWait(id, timeout=None, interval=0.05):
+    # Espera o job terminar (CLI e scripts); devolve o status final
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        job = jobStatus(id)
+        if job is None or job['status'] not in ('queued', 'running'):
+            return job
+        if deadline is not None and time.monotonic() > deadline:
+            return job
+        time.sleep(interval)
+
+
+def _setStatus(id, status, allowed):
+    with dbConnection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                UPDATE jobTb SET status = %s, worker = NULL, error = NULL,
+                       finished = CASE WHEN %s = 'cancelled' THEN now() END
+                WHERE id = %s AND status = ANY(%s);""", (status, status, id, list(allowed)))
+            changed = cursor.rowcount
+            conn.commit()
+        except Exception as e:
+            print(f'Erro status job: {e}')
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+    return changed > 0
+
+
+def jobRetry(id):
+    # Job que falhou volta para a fila e continua do último lote gravado
+    changed = _setStatus(id, 'queued', ('failed',))
+    if changed:
+        startWorkers()
+        _wake.set()
+    return changed
+
+
+def jobCancel(id):
+    # Lotes já gravados ficam; o worker para antes do próximo lote
+    return _setStatus(id, 'cancelled', ('queued', 'running'))
+
+
+# Worker
+def _claim(cursor, worker):
+    cursor.execute("""
+        UPDATE jobTb SET status = 'running', worker = %s, error = NULL,
+               started = COALESCE(started, now()), beat = now()
+        WHERE id = (
+            SELECT id FROM jobTb
+            WHERE status = 'queued' OR (status = 'running' AND beat < now() - %s::interval)
+            ORDER BY id
+            FOR UPDATE SKIP LOCKED
+            LIMIT 1)
+        RETURNING id, kind, params, resumeAt;""", (worker, JOB_STALE))
+    return cursor.fetchone()
+
+
+def _batch(cursor, kind, params, resumeAt):
+    # Um lote no cursor dado; devolve (linhas, novo resumeAt, terminou?)
+    if kind == 'revalue':
+        args = _revalueParams(params['prod'], params['year'], Decimal(params['mtm']),
+                              params['categories'], params['shipments'])
+        rows, last = _revalue(cursor, args, after=resumeAt, upTo=params.get('upTo', MAX_ID), limit=JOB_BATCH)
+        return rows, last if last is not None else resumeAt, rows < JOB_BATCH
+    legs = params['legs'][resumeAt:resumeAt + JOB_BATCH]
+    trades = [tuple(leg[:6]) + (Decimal(leg[6]), Decimal(leg[7])) for leg in legs]
+    if trades:
+        _insertTrades(cursor, trades)
+    resumeAt += len(trades)
+    return len(trades), resumeAt, resumeAt >= len(params['legs'])
+
+
+def _runJob(conn, worker, id, kind, params):
+    finished = False
+    while not finished:
+        t0 = time.perf_counter()
+        cursor = conn.cursor()
+        try:
+            # trava a linha do job e confere que ainda é deste worker (não foi
+            # cancelado nem retomado por outro após um heartbeat perdido)
+            cursor.execute("""
+                SELECT resumeAt FROM jobTb
+                WHERE id = %s AND worker = %s AND status = 'running' FOR UPDATE;""", (id, worker))
+            row = cursor.fetchone()
+            if row is None:
+                conn.rollback()
+                return
+            rows, resumeAt, finished = _batch(cursor, kind, params, row[0])
+            cursor.execute("""
+                UPDATE jobTb SET done = done + %s, resumeAt = %s, beat = now(),
+                       status = CASE WHEN %s THEN 'done' ELSE status END,
+                       finished = CASE WHEN %s THEN now() END
+                WHERE id = %s;""", (rows, resumeAt, finished, finished, id))
+            conn.commit()
+        except Exception as e:
+            print(f'Erro job {id}: {e}')
+            conn.rollback()
+            cursor.execute("""
+                UPDATE jobTb SET status = 'failed', error = %s, finished = now()
+                WHERE id = %s AND worker = %s;""", (str(e), id, worker))
+            conn.commit()
+            _count(failed=1)
+            return
+        finally:
+            cursor.close()
+        if rows:
+            _bumpVersion(*TABLES[kind])
+        _count(batches=1, rows=rows, seconds=time.perf_counter() - t0)
+    _count(jobs=1)
+
+
+def workOnce(worker=None):
+    # Pega e executa um job; devolve o id (ou None com a fila vazia)
+    worker = worker or f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+    with dbConnection() as conn:
+        cursor = conn.cursor()
+        try:
+            job = _claim(cursor, worker)
+            conn.commit()
+        except Exception as e:
+            print(f'Erro claim job: {e}')
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+        if job is None:
+            return None
+        id, kind, params, _ = job
+        _runJob(conn, worker, id, kind, params)
+    return id
+
+
+def _work():
+    worker = f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+    while True:
+        try:
+            if workOnce(worker) is not None:
+                continue
+        except Exception as e:
+            print(f'Erro worker: {e}')
+        _wake.wait(JOB_POLL)
+        _wake.clear()
+
+
+def startWorkers(n=None):
+    n = JOB_WORKERS if n is None else n
+    with _workersLock:
+        while sum(t.is_alive() for t in _workers) < n:
+            thread = threading.Thread(target=_work, name=f'pnl-job-worker-{len(_workers)}', daemon=True)
+            thread.start()
+            _workers.append(thread)
+    return len(_workers)
+
+
+for _name, _help, _key in (
+        ('pnl_jobs_done', 'Jobs finished by this process', 'jobs'),
+        ('pnl_jobs_failed', 'Jobs failed in this process', 'failed'),
+        ('pnl_job_batches', 'Job batches committed by this process', 'batches'),
+        ('pnl_job_rows', 'Rows written by job batches in this process', 'rows')):
+    metrics.registry.gauge(_name, _help, lambda key=_key: _stats[key])
+metrics.registry.gauge('pnl_job_workers', 'Job worker threads alive', lambda: sum(t.is_alive() for t in _workers))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='PNL System - fila de escritas')
+    commands = parser.add_subparsers(dest='command', required=True)
+    work = commands.add_parser('worker', help='roda workers até ser interrompido')
+    work.add_argument('-n', '--threads', type=int, default=max(JOB_WORKERS, 1))
+    commands.add_parser('stats', help='profundidade da fila e vazão')
+    lst = commands.add_parser('list', help='últimos jobs')
+    lst.add_argument('--status', choices=STATUSES)
+    lst.add_argument('--limit', type=int, default=20)
+    for name, text in (('status', 'status de um job'), ('retry', 'recoloca um job que falhou na fila'),
+                       ('cancel', 'cancela um job')):
+        commands.add_parser(name, help=text).add_argument('id', type=int)
+    args = parser.parse_args()
+
+    if args.command == 'worker':
+        startWorkers(args.threads)
+        try:
+            while True:
+                time.sleep(60)
+                print(json.dumps(jobStats(), default=str))
+        except KeyboardInterrupt:
+            pass
+    elif args.command == 'stats':
+        print(json.dumps(jobStats(), indent=2, default=str))
+    elif args.command == 'list':
+        print(jobList(args.limit, args.status).to_string(index=False))
+    elif args.command == 'status':
+        print(json.dumps(jobStatus(args.id), indent=2, default=str))
+    elif args.command == 'retry':
+        print('na fila' if jobRetry(args.id) else 'job não está em failed')
+    elif args.command == 'cancel':
+        print('cancelado' if jobCancel(args.id) else 'job já terminou')
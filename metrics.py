@@ -0,0 +1,425 @@
+# Instrumentação da camada de dados.
+#
+# Cada chamada instrumentada (@instrumented em data.py) abre um contexto por
+# thread; o TimingCursor, que é o cursor_factory das conexões do pool, soma
+# nele o tempo de banco, linhas e bytes de cada execute/fetch, e o pool soma o
+# tempo de espera por conexão. No fim da chamada tudo vai para o registro em
+# memória, exposto em texto Prometheus (prometheusText / serve) e na view Admin
+# do app. Execuções bem-sucedidas acima de SLOW_QUERY_MS entram no log de
+# consultas lentas, com SQL, parâmetros e EXPLAIN ANALYZE (rodado numa
+# transação desfeita, com statement_timeout de SLOW_EXPLAIN_MS, no máximo
+# SLOW_EXPLAIN_MAX ao mesmo tempo e um por SQL).
+import ctypes
+import ctypes.util
+import functools
+import glob
+import inspect
+import os
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import psycopg2
+import psycopg2.extensions
+
+SLOW_QUERY_MS = float(os.environ.get('PNL_SLOW_QUERY_MS', 500))
+SLOW_LOG_SIZE = int(os.environ.get('PNL_SLOW_LOG_SIZE', 100))
+SLOW_SQL_CHARS = 5000     # inserts em lote geram SQL enorme; o log guarda só o começo
+# select: só EXPLAIN ANALYZE de leituras; all: também escritas (desfeitas); off
+SLOW_EXPLAIN = os.environ.get('PNL_SLOW_EXPLAIN', 'select')
+SLOW_EXPLAIN_MS = int(os.environ.get('PNL_SLOW_EXPLAIN_MS', 10000))   # limite do EXPLAIN ANALYZE
+SLOW_EXPLAIN_MAX = int(os.environ.get('PNL_SLOW_EXPLAIN_MAX', 2))      # EXPLAINs simultâneos
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_WRITE = re.compile(rb'\b(INSERT|UPDATE|DELETE|TRUNCATE|LOCK|CREATE|DROP|ALTER|COPY)\b', re.I)
+_PLANNABLE = re.compile(rb'^\s*(SELECT|WITH|VALUES|TABLE|INSERT|UPDATE|DELETE)\b', re.I)
+_COPY_QUERY = re.compile(rb'^\s*COPY\s*\((.*)\)\s*TO\s+STDOUT\b', re.I | re.S)
+
+
+def _loadLibpq():
+    # libpq carregada pelo psycopg2 (wheel binário traz a sua); sem ela os
+    # bytes ficam em 0
+    base = os.path.dirname(psycopg2.__file__)
+    paths = glob.glob(os.path.join(base, '..', 'psycopg2_binary.libs', 'libpq*'))
+    paths += [p for p in [ctypes.util.find_library('pq')] if p]
+    for path in paths:
+        try:
+            lib = ctypes.CDLL(path)
+            lib.PQresultMemorySize.restype = ctypes.c_size_t
+            lib.PQresultMemorySize.argtypes = [ctypes.c_void_p]
+            return lib
+        except (OSError, AttributeError):
+            continue
+    return None
+
+_libpq = _loadLibpq()
+
+
+def _resultBytes(cursor):
+    if _libpq is None:
+        return 0
+    try:
+        ptr = cursor.pgresult_ptr
+    except Exception:
+        return 0
+    return int(_libpq.PQresultMemorySize(ptr)) if ptr else 0
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class Registry:
+    # Métricas por função da camada de dados + consultas e checkouts globais
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = {}     # nome -> dict de contadores + histograma de duração
+        self.queries = Histogram()
+        self.acquire = Histogram()
+        self.slowLog = deque(maxlen=SLOW_LOG_SIZE)
+        self.slowTotal = 0
+        self.gauges = {}    # nome -> (help, função sem argumentos)
+
+    def recordCall(self, name, wall, ctx, error):
+        with self._lock:
+            item = self.calls.get(name)
+            if item is None:
+                item = self.calls[name] = {'count': 0, 'errors': 0, 'wall': Histogram(), 'db': 0.0,
+                                           'acquire': 0.0, 'rows': 0, 'bytes': 0, 'queries': 0}
+            item['count'] += 1
+            item['errors'] += bool(error)
+            item['wall'].observe(wall)
+            for key in ('db', 'acquire', 'rows', 'bytes', 'queries'):
+                item[key] += ctx[key]
+
+    def recordQuery(self, seconds):
+        with self._lock:
+            self.queries.observe(seconds)
+
+    def recordAcquire(self, seconds):
+        with self._lock:
+            self.acquire.observe(seconds)
+        for ctx in _stack():
+            ctx['acquire'] += seconds
+
+    def addSlow(self, entry):
+        with self._lock:
+            self.slowTotal += 1
+            self.slowLog.appendleft(entry)
+
+    def gauge(self, name, help, fn):
+        self.gauges[name] = (help, fn)
+
+    def snapshot(self):
+        # Uma linha por função (para tabela no app)
+        with self._lock:
+            rows = []
+            for name, item in sorted(self.calls.items()):
+                wall = item['wall']
+                rows.append({'fn': name, 'calls': item['count'], 'errors': item['errors'],
+                             'wall_ms_avg': 1000 * wall.sum / wall.count if wall.count else 0.0,
+                             'db_ms_avg': 1000 * item['db'] / item['count'],
+                             'acquire_ms_avg': 1000 * item['acquire'] / item['count'],
+                             'queries': item['queries'], 'rows': item['rows'], 'bytes': item['bytes']})
+            return rows
+
+    def slowQueries(self):
+        with self._lock:
+            return list(self.slowLog)
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self.queries, self.acquire = Histogram(), Histogram()
+            self.slowLog.clear()
+            self.slowTotal = 0
+
+    def prometheusText(self):
+        out = []
+
+        def histogram(name, hist, labels=''):
+            # observe() já conta cada valor em todos os buckets >= valor
+            for bound, count in zip(BUCKETS, hist.counts):
+                out.append(f'{name}_bucket{{{labels}{"," if labels else ""}le="{bound}"}} {count}')
+            out.append(f'{name}_bucket{{{labels}{"," if labels else ""}le="+Inf"}} {hist.count}')
+            suffix = f'{{{labels}}}' if labels else ''
+            out.append(f'{name}_sum{suffix} {hist.sum:.6f}')
+            out.append(f'{name}_count{suffix} {hist.count}')
+
+        with self._lock:
+            calls = {name: dict(item) for name, item in self.calls.items()}
+            queries, acquire, slowTotal = self.queries, self.acquire, self.slowTotal
+            out.append('# HELP pnl_call_duration_seconds Wall time of data-layer calls')
+            out.append('# TYPE pnl_call_duration_seconds histogram')
+            for name, item in sorted(calls.items()):
+                histogram('pnl_call_duration_seconds', item['wall'], f'fn="{name}"')
+            for metric, key, help in (('pnl_call_db_seconds_total', 'db', 'Time spent executing/fetching in the DB'),
+                                      ('pnl_call_acquire_seconds_total', 'acquire', 'Time waiting for a pooled connection'),
+                                      ('pnl_call_rows_total', 'rows', 'Rows returned'),
+                                      ('pnl_call_bytes_total', 'bytes', 'Result bytes fetched'),
+                                      ('pnl_call_queries_total', 'queries', 'Statements executed'),
+                                      ('pnl_call_errors_total', 'errors', 'Calls that raised')):
+                out.append(f'# HELP {metric} {help}')
+                out.append(f'# TYPE {metric} counter')
+                for name, item in sorted(calls.items()):
+                    value = item[key]
+                    out.append(f'{metric}{{fn="{name}"}} {value:.6f}' if isinstance(value, float)
+                               else f'{metric}{{fn="{name}"}} {value}')
+            out.append('# HELP pnl_query_duration_seconds Duration of single statements')
+            out.append('# TYPE pnl_query_duration_seconds histogram')
+            histogram('pnl_query_duration_seconds', queries)
+            out.append('# HELP pnl_conn_acquire_seconds Pool checkout wait')
+            out.append('# TYPE pnl_conn_acquire_seconds histogram')
+            histogram('pnl_conn_acquire_seconds', acquire)
+            out.append('# HELP pnl_slow_queries_total Statements above the slow-query threshold')
+            out.append('# TYPE pnl_slow_queries_total counter')
+            out.append(f'pnl_slow_queries_total {slowTotal}')
+        for name, (help, fn) in sorted(self.gauges.items()):
+            try:
+                value = fn()
+            except Exception:
+                continue
+            out.append(f'# HELP {name} {help}')
+            out.append(f'# TYPE {name} gauge')
+            out.append(f'{name} {value}')
+        return '\n'.join(out) + '\n'
+
+
+registry = Registry()
+
+# Pilha de contextos de chamada por thread (chamadas aninhadas somam em todas)
+_local = threading.local()
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def instrumented(fn):
+    # Decorator das funções db*: duração, tempo de banco, linhas, bytes e
+    # espera por conexão, por nome de função. O cursor e o pool somam em todos
+    # os contextos ativos, então chamadas aninhadas não precisam repassar nada.
+    name = fn.__name__
+    if inspect.isgeneratorfunction(fn):
+        @functools.wraps(fn)
+        def genWrapper(*args, **kwargs):
+            # geradores: cada passo (até o próximo yield) conta no mesmo contexto
+            ctx = {'db': 0.0, 'acquire': 0.0, 'rows': 0, 'bytes': 0, 'queries': 0}
+            wall, error = 0.0, None
+            gen = fn(*args, **kwargs)
+            try:
+                while True:
+                    _stack().append(ctx)
+                    t0 = time.perf_counter()
+                    try:
+                        item = next(gen)
+                    except StopIteration:
+                        return
+                    finally:
+                        wall += time.perf_counter() - t0
+                        _stack().pop()
+                    yield item
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                gen.close()
+                registry.recordCall(name, wall, ctx, error)
+        return genWrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        ctx = {'db': 0.0, 'acquire': 0.0, 'rows': 0, 'bytes': 0, 'queries': 0}
+        _stack().append(ctx)
+        t0 = time.perf_counter()
+        error = None
+        try:
+            return fn(*args, **kwargs)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            wall = time.perf_counter() - t0
+            _stack().pop()
+            registry.recordCall(name, wall, ctx, error)
+    return wrapper
+
+
+# Conexão usada para o EXPLAIN ANALYZE das consultas lentas (data.py registra)
+_explainConnection = None
+_explainSlots = threading.BoundedSemaphore(SLOW_EXPLAIN_MAX)
+_explainRunning = set()     # SQL com EXPLAIN em andamento
+_explainLock = threading.Lock()
+
+def explainWith(connection):
+    global _explainConnection
+    _explainConnection = connection
+
+
+def _explain(entry, query):
+    try:
+        with _explainConnection() as conn:
+            cursor = conn.cursor(cursor_factory=psycopg2.extensions.cursor)
+            try:
+                _local.explaining = True
+                # a consulta já foi lenta uma vez: o ANALYZE dela não roda sem limite
+                cursor.execute("SET LOCAL statement_timeout = %s", (SLOW_EXPLAIN_MS,))
+                cursor.execute(b"EXPLAIN (ANALYZE, BUFFERS) " + query)
+                entry['explain'] = '\n'.join(row[0] for row in cursor.fetchall())
+            finally:
+                _local.explaining = False
+                conn.rollback()
+                cursor.close()
+    except Exception as e:
+        entry['explain'] = f'EXPLAIN falhou: {e}'
+    finally:
+        with _explainLock:
+            _explainRunning.discard(query)
+        _explainSlots.release()
+
+
+def _startExplain(entry, query):
+    # Uma rajada de lentas não vira uma rajada de ANALYZE no primário: pula se
+    # o mesmo SQL já está em EXPLAIN ou se SLOW_EXPLAIN_MAX já estão rodando
+    with _explainLock:
+        if query in _explainRunning:
+            entry['explain'] = 'EXPLAIN pulado: mesmo SQL já em andamento'
+            return
+        if not _explainSlots.acquire(blocking=False):
+            entry['explain'] = f'EXPLAIN pulado: {SLOW_EXPLAIN_MAX} em andamento'
+            return
+        _explainRunning.add(query)
+    # fora da thread do chamador para não somar mais latência a ela
+    threading.Thread(target=_explain, args=(entry, query), name='pnl-explain', daemon=True).start()
+
+
+def _slow(query, params, seconds):
+    if getattr(_local, 'explaining', False):
+        return
+    sql = query if isinstance(query, bytes) else str(query).encode()
+    entry = {'at': time.strftime('%Y-%m-%d %H:%M:%S'), 'ms': round(seconds * 1000, 1),
+             'sql': sql[:SLOW_SQL_CHARS].decode(errors='replace'),
+             'params': repr(params), 'explain': None}
+    registry.addSlow(entry)
+    print(f"Consulta lenta ({entry['ms']} ms): {entry['sql'][:200]!r}")
+    isWrite = bool(_WRITE.search(sql))
+    if _explainConnection and SLOW_EXPLAIN != 'off' and _PLANNABLE.match(sql) \
+            and (SLOW_EXPLAIN == 'all' or not isWrite) \
+            and sql.count(b';') <= 1:
+        _startExplain(entry, sql.rstrip().rstrip(b';'))
+
+
+class TimingCursor(psycopg2.extensions.cursor):
+    # Mede cada execute/fetch e soma no contexto das chamadas ativas da thread
+    def _account(self, seconds, rows, size):
+        registry.recordQuery(seconds)
+        for ctx in _stack():
+            ctx['db'] += seconds
+            ctx['rows'] += rows
+            ctx['bytes'] += size
+
+    # O log de lentas só recebe execuções que terminaram: uma consulta que
+    # falhou (ou foi cancelada pelo statement_timeout) não vai para o EXPLAIN
+    def execute(self, query, vars=None):
+        t0 = time.perf_counter()
+        try:
+            result = super().execute(query, vars)
+        finally:
+            seconds = time.perf_counter() - t0
+            named = self.name is not None
+            rows = 0 if named or self.description is None else max(self.rowcount, 0)
+            self._account(seconds, rows, 0 if named else _resultBytes(self))
+            for ctx in _stack():
+                ctx['queries'] += 1
+        if seconds * 1000 >= SLOW_QUERY_MS and self.query:
+            _slow(self.query, vars, seconds)
+        return result
+
+    def executemany(self, query, vars_list):
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            seconds = time.perf_counter() - t0
+            self._account(seconds, 0, 0)
+            for ctx in _stack():
+                ctx['queries'] += 1
+
+    # Destinos que contam o que recebem (data._CopySink) informam bytes e o
+    # tempo bloqueado esperando o consumidor (read_csv lendo do pipe em
+    # paralelo); esse tempo sai do db, fica no tempo de Python da chamada.
+    # COPY (SELECT ...) TO STDOUT entra no log de lentas com o SELECT interno,
+    # para o EXPLAIN funcionar.
+    def copy_expert(self, sql, file, size=8192):
+        t0 = time.perf_counter()
+        try:
+            result = super().copy_expert(sql, file, size)
+        finally:
+            seconds = time.perf_counter() - t0 - getattr(file, 'blocked', 0.0)
+            self._account(seconds, max(self.rowcount, 0), getattr(file, 'bytes', 0))
+            for ctx in _stack():
+                ctx['queries'] += 1
+        if seconds * 1000 >= SLOW_QUERY_MS:
+            query = sql if isinstance(sql, bytes) else str(sql).encode()
+            inner = _COPY_QUERY.match(query)
+            _slow(inner.group(1) if inner else query, None, seconds)
+        return result
+
+    # cursores nomeados (server-side) buscam do banco a cada fetch
+    def fetchmany(self, size=None):
+        if self.name is None:
+            return super().fetchmany(size) if size is not None else super().fetchmany()
+        t0 = time.perf_counter()
+        rows = super().fetchmany(size) if size is not None else super().fetchmany()
+        self._account(time.perf_counter() - t0, len(rows), _resultBytes(self))
+        return rows
+
+    def fetchall(self):
+        if self.name is None:
+            return super().fetchall()
+        t0 = time.perf_counter()
+        rows = super().fetchall()
+        self._account(time.perf_counter() - t0, len(rows), _resultBytes(self))
+        return rows
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = registry.prometheusText().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_serverLock = threading.Lock()
+
+def serve(port, host='0.0.0.0'):
+    # Endpoint /metrics numa thread (uma vez por processo)
+    global _server
+    with _serverLock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, int(port)), _Handler)
+            threading.Thread(target=_server.serve_forever, name='pnl-metrics', daemon=True).start()
+        return _server
@@ -0,0 +1,168 @@
+# Motor de PnL em memória, independente do banco.
+#
+# Guarda os trades abertos em arrays NumPy (colunas) e reavalia o livro
+# inteiro para um vetor de marcas numa chamada. A regra é a mesma de
+# dbRevalueMtm: Sale = marca anterior - mtm, Purchase = mtm - marca anterior
+# (marca anterior = última marca ou lvl), x get_conversion_value(prod) x ton.
+#
+# Toda a conta é em ponto fixo com inteiros (marcas em 10^-k, conversão em
+# 10^-c), então o resultado é exato; o arredondamento final para NUMERIC(11,2)
+# é "metade para longe do zero", o mesmo do PostgreSQL ao gravar o pnl.
+from decimal import Decimal, ROUND_HALF_UP
+
+import numpy as np
+import pandas as pd
+
+from data import get_conversion_value, prodKey
+
+PNL_LIMIT = 10 ** 11    # NUMERIC(11,2): |pnl| < 10^9, em centavos
+INT64_SAFE = 2 ** 62
+
+
+def _digits(value):
+    # casas decimais de um Decimal/str/número (mínimo 0)
+    exponent = Decimal(str(value)).normalize().as_tuple().exponent
+    return max(-exponent, 0) if isinstance(exponent, int) else 0
+
+
+def _scaled(values, digits):
+    # Converte valores decimais para inteiros em 10^-digits, sem passar por
+    # float quando vierem como Decimal/str. Floats são arredondados (valores
+    # de NUMERIC(4,2) ida e volta por float são exatos nessa escala).
+    values = pd.Series(values)
+    if values.dtype.kind == 'f':
+        return np.rint(values.to_numpy() * 10 ** digits).astype(np.int64)
+    if values.dtype.kind in 'iu':
+        return values.to_numpy(np.int64) * 10 ** digits
+    return np.array([int(Decimal(str(v)).scaleb(digits).to_integral_value(ROUND_HALF_UP)) for v in values],
+                    dtype=np.int64)
+
+
+def roundHalfAway(values, divisor):
+    # Divisão inteira com arredondamento metade para longe do zero
+    sign = np.sign(values)
+    return sign * ((np.abs(values) + divisor // 2) // divisor)
+
+
+class Book:
+    # Livro de trades em colunas. lvl e última marca em centavos; mark é
+    # NaN-free: trades nunca marcados usam lvl como marca anterior.
+    def __init__(self, ids, prods, cats, ships, years, ops, tons, lvlCents, markCents=None):
+        # chaves como Categorical: códigos inteiros, sem objeto Python por linha
+        prods = pd.Series(prods)
+        self.prods = pd.Categorical(prods.map({p: prodKey(p) for p in prods.unique()}))
+        self.cats = pd.Categorical(cats)
+        self.ships = pd.Categorical(ships)
+        self.years = np.asarray(years, dtype=np.int32)
+        ops = pd.Categorical(ops)
+        if not set(ops.categories) <= {'Purchase', 'Sale'}:
+            raise ValueError("op deve ser 'Purchase' ou 'Sale'")
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.signs = np.where(ops == 'Sale', -1, 1).astype(np.int64)
+        self.tons = np.asarray(tons, dtype=np.int64)
+        self.lvlCents = np.asarray(lvlCents, dtype=np.int64)
+        marks = self.lvlCents.copy() if markCents is None else np.asarray(markCents, dtype=np.float64)
+        if markCents is not None:
+            marks = np.where(np.isnan(marks), self.lvlCents, marks).astype(np.int64)
+        self.markCents = marks
+        # conversão por produto, como inteiro em 10^-convDigits
+        conv = [get_conversion_value(p) for p in self.prods.categories]
+        self.convDigits = max([_digits(v) for v in conv], default=0)
+        table = np.array([int(v.scaleb(self.convDigits)) for v in conv], dtype=np.int64)
+        self.conv = table[self.prods.codes]
+
+    @classmethod
+    def fromFrame(cls, df):
+        # Aceita o DataFrame de dbLoadBook (lvlcents/mtmcents) ou um com
+        # lvl/mtm decimais (Decimal, str ou float). Nomes de coluna sem caixa.
+        df = df.rename(columns=str.lower)
+        lvl = df['lvlcents'] if 'lvlcents' in df else _scaled(df['lvl'], 2)
+        if 'mtmcents' in df:
+            mark = df['mtmcents'].astype('float64')
+        elif 'mtm' in df:
+            present = df['mtm'].notna()
+            mark = pd.Series(np.nan, index=df.index)
+            mark[present] = _scaled(df.loc[present, 'mtm'], 2)
+        else:
+            mark = None
+        ids = df['id'] if 'id' in df else df['idtrade']
+        return cls(ids, df['prod'], df['cat'], df['ship'], df['year'], df['op'], df['ton'], lvl, mark)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def select(self, mask):
+        # Sub-livro (ex.: só algumas categorias/embarques)
+        book = object.__new__(Book)
+        for name, value in vars(self).items():
+            setattr(book, name, value[mask] if isinstance(value, (np.ndarray, pd.Categorical)) else value)
+        return book
+
+    def frame(self):
+        return pd.DataFrame({'idTrade': self.ids, 'prod': self.prods, 'cat': self.cats, 'ship': self.ships,
+                             'year': self.years, 'ton': self.tons,
+                             'op': pd.Categorical.from_codes((self.signs < 0).astype(np.int8), ['Purchase', 'Sale'])})
+
+    def marksFor(self, marks):
+        # Alinha as marcas aos trades. marks pode ser um escalar (livro todo),
+        # um array já alinhado, um dict/Series por produto ou por chave
+        # (prod, cat, ship, year). Devolve (inteiros, casas decimais).
+        if isinstance(marks, (pd.Series, dict)):
+            marks = dict(marks)
+            keys = next(iter(marks), None)
+            if isinstance(keys, tuple):
+                index = zip(self.prods, self.cats, self.ships, self.years.tolist())
+            else:
+                marks = {prodKey(k): v for k, v in marks.items()}
+                index = self.prods
+            values = [marks.get(k) for k in index]
+            if any(v is None for v in values):
+                raise ValueError("Há trades sem marca correspondente")
+        elif np.ndim(marks) == 0:
+            digits = max(2, _digits(marks))
+            return np.full(len(self), _scaled([marks], digits)[0], dtype=np.int64), digits
+        else:
+            values = list(marks)
+            if len(values) != len(self):
+                raise ValueError(f"Esperadas {len(self)} marcas, recebidas {len(values)}")
+        digits = max([2] + [_digits(v) for v in set(values)])
+        return _scaled(values, digits), digits
+
+    def revalue(self, marks, decimals=True):
+        # Reavalia o livro (what-if: não altera o livro nem o banco). Devolve
+        # um DataFrame por trade com pnlCents inteiro (para somar) e, se
+        # decimals, mtm e pnl em Decimal, prontos para gravar ou comparar.
+        mtm, digits = self.marksFor(marks)
+        previous = self.markCents * 10 ** (digits - 2)
+        diff = self.signs * (mtm - previous)
+        scale = digits + self.convDigits
+        bound = (int(np.abs(diff).max(initial=0)) * int(self.conv.max(initial=0))
+                 * int(np.abs(self.tons).max(initial=0)))
+        if bound < INT64_SAFE:
+            raw = diff * self.conv * self.tons
+        else:
+            # fora da faixa do int64: mesma conta com inteiros do Python
+            raw = diff.astype(object) * self.conv.astype(object) * self.tons.astype(object)
+        cents = roundHalfAway(raw, 10 ** (scale - 2))
+        if len(cents) and np.abs(cents).max() >= PNL_LIMIT:
+            raise ValueError("PnL fora da faixa de NUMERIC(11,2)")
+        out = self.frame()
+        out['mtmCents'] = roundHalfAway(mtm, 10 ** (digits - 2))
+        out['pnlCents'] = cents.astype(np.int64)
+        if decimals:
+            out['mtm'] = [Decimal(int(v)).scaleb(-digits) for v in mtm]
+            out['pnl'] = [Decimal(int(v)).scaleb(-2) for v in cents]
+        return out
+
+    def apply(self, result):
+        # Registra as marcas de uma reavaliação como últimas marcas, já
+        # arredondadas para NUMERIC(4,2) como o banco faria ao gravar.
+        if len(result) != len(self):
+            raise ValueError("Resultado não corresponde ao livro")
+        self.markCents = result['mtmCents'].to_numpy(np.int64)
+
+
+def summarize(result, by=('cat', 'ship')):
+    # Soma exata do pnl por grupo (centavos -> Decimal)
+    grouped = result.groupby(list(by), sort=True)['pnlCents'].sum()
+    return grouped.map(lambda v: Decimal(int(v)).scaleb(-2))
@@ -0,0 +1,170 @@
+# Risco por simulação histórica (PnL-at-risk) sobre o histórico de marcas.
+#
+# A marca de cada chave (prod, cat, ship, year) num dia útil é a última
+# gravada em mtmtb naquele dia (dbLoadMarkHistory), repetida nos dias sem
+# marca. A variação da marca em `horizon` dias úteis, x posição da chave
+# (posTb) x get_conversion_value(prod), é o PnL de um cenário; com uma janela
+# de N dias saem N cenários por produto e, somando os produtos no mesmo
+# cenário, o total (com a diversificação entre produtos). VaR e ES são lidos
+# da cauda dessas distribuições.
+#
+# A conta é uma multiplicação (cenários x chaves) @ (chaves); o que pesa é
+# ler e pivotar o histórico. Em janelas longas cada produto é carregado num
+# processo do pool (com suas próprias conexões). Fatiar também por data não
+# compensa: mtmtb não tem índice por date e cada fatia varreria o produto
+# inteiro. O relatório fica em cache por data-base e parâmetros até uma
+# escrita em mtmtb/posTb ou RISK_CACHE_TTL.
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from data import (dbRiskDates, dbLoadMarkHistory, dbLoadRiskPositions, dbDataVersion,
+                  get_conversion_value, prodKey, ResultCache, PRODUCTS)
+from metrics import instrumented
+
+RISK_DAYS = int(os.environ.get('PNL_RISK_DAYS', 500))                       # cenários por padrão
+RISK_CONFIDENCE = (0.95, 0.99)
+RISK_WORKERS = int(os.environ.get('PNL_RISK_WORKERS', min(4, os.cpu_count() or 1)))
+RISK_PARALLEL_DAYS = int(os.environ.get('PNL_RISK_PARALLEL_DAYS', 750))     # janelas menores rodam no processo
+RISK_CACHE_TTL = float(os.environ.get('PNL_RISK_CACHE_TTL', 900))
+
+KEY = ['cat', 'ship', 'year']
+
+_cache = ResultCache(32, RISK_CACHE_TTL)
+_executor = None
+_executorSize = 0
+_executorLock = threading.Lock()
+
+
+def _processPool(workers):
+    # spawn: o processo novo abre as próprias conexões (conexões do psycopg2
+    # não podem atravessar um fork)
+    global _executor, _executorSize
+    with _executorLock:
+        if _executor is not None and _executorSize != workers:
+            _executor.shutdown(wait=False)
+            _executor = None
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            _executorSize = workers
+        return _executor
+
+
+def _productMarks(prod, dates):
+    # Tarefa do pool: marcas de um produto nos dias úteis dados, dia x chave,
+    # com os dias sem marca preenchidos pela marca anterior
+    df = dbLoadMarkHistory(prod, dates[0], dates[-1])
+    return df.pivot(index='date', columns=KEY, values='mtm').reindex(pd.DatetimeIndex(dates)).ffill()
+
+
+def loadMarks(products, dates, workers=None):
+    # {prod: DataFrame dia x chave}; devolve também se usou o pool
+    workers = RISK_WORKERS if workers is None else workers
+    parallel = workers > 1 and len(products) > 1 and len(dates) > RISK_PARALLEL_DAYS
+    if parallel:
+        parts = _processPool(workers).map(_productMarks, products, [dates] * len(products))
+    else:
+        parts = (_productMarks(prod, dates) for prod in products)
+    return dict(zip(products, parts)), parallel
+
+
+def scenarioPnl(marks, positions, prod, horizon=1):
+    # PnL de cada cenário: variação em horizon dias x posição x conversão.
+    # Chave sem marca ainda no início da janela conta variação zero.
+    pos = positions[positions['prod'] == prod].set_index(KEY)['pos']
+    exposure = pos.reindex(marks.columns).fillna(0).to_numpy(np.float64) * float(get_conversion_value(prod))
+    values = marks.to_numpy(np.float64)
+    change = values[horizon:] - values[:-horizon]
+    change[np.isnan(change)] = 0
+    return change @ exposure
+
+
+def tail(pnl, confidence):
+    # VaR e ES históricos como perdas (positivos): com n cenários, os
+    # k = piso(n x (1 - confiança)) piores (mínimo 1); VaR é o k-ésimo pior e
+    # ES a média dos k piores
+    pnl = np.asarray(pnl, dtype=np.float64)
+    if not len(pnl):
+        return np.nan, np.nan
+    k = max(int(np.floor(len(pnl) * (1 - confidence) + 1e-9)), 1)
+    worst = np.partition(pnl, k - 1)[:k]
+    return -worst.max(), -worst.mean()
+
+
+def summarize(scenarios, confidence=RISK_CONFIDENCE):
+    # Uma linha por coluna de cenários (produtos e Total)
+    rows = []
+    for column in scenarios.columns:
+        pnl = scenarios[column].to_numpy()
+        row = {'prod': column, 'scenarios': len(pnl),
+               'mean': pnl.mean() if len(pnl) else np.nan, 'worst': pnl.min() if len(pnl) else np.nan}
+        for c in confidence:
+            row[f'VaR {c:.0%}'], row[f'ES {c:.0%}'] = tail(pnl, c)
+        rows.append(row)
+    summary = pd.DataFrame(rows)
+    # + 0.0 tira o -0.00 das perdas zero negadas (produto sem exposição)
+    numeric = summary.columns.drop(['prod', 'scenarios'])
+    summary[numeric] = summary[numeric].round(2) + 0.0
+    return summary
+
+
+@instrumented
+def riskReport(asOf=None, days=RISK_DAYS, horizon=1, products=None, confidence=RISK_CONFIDENCE, workers=None):
+    # Relatório na data-base = último dia útil até asOf (padrão: hoje).
+    # Devolve dict com a data-base, os cenários (dia final x produtos + Total)
+    # e o resumo de VaR/ES por produto e total.
+    products = tuple(prodKey(p) for p in (products or PRODUCTS))
+    asOf = pd.Timestamp(asOf or date.today()).date()
+    dates = dbRiskDates(asOf, days + horizon, products)
+    businessDate = dates[-1] if dates else None
+    key = (businessDate, days, horizon, products, tuple(confidence))
+    versions = dbDataVersion('mtmtb', 'posTb')
+    hit, report = _cache.get(key, versions)
+    if hit:
+        return dict(report, cached=True)
+
+    t0 = time.perf_counter()
+    columns = list(products) + ['Total']
+    if len(dates) <= horizon:
+        scenarios, parallel = pd.DataFrame(columns=columns, dtype='float64'), False
+    else:
+        # asOf de hoje em diante: posição corrente; antes disso, a de posTb no dia
+        positions = dbLoadRiskPositions(None if asOf >= date.today() else businessDate, products)
+        marks, parallel = loadMarks(products, dates, workers)
+        scenarios = pd.DataFrame({prod: scenarioPnl(marks[prod], positions, prod, horizon) for prod in products},
+                                 index=pd.DatetimeIndex(dates[horizon:], name='date'))
+        scenarios['Total'] = scenarios.sum(axis=1)
+    report = {
+        'asOf': businessDate, 'requested': asOf, 'days': len(scenarios), 'horizon': horizon,
+        'scenarios': scenarios, 'summary': summarize(scenarios, confidence),
+        'parallel': parallel, 'seconds': round(time.perf_counter() - t0, 3), 'cached': False,
+    }
+    _cache.put(key, versions, report)
+    return report
+
+
+def riskCacheClear():
+    _cache.clear()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='VaR/ES por simulação histórica sobre as marcas de mtmtb')
+    parser.add_argument('--as-of', dest='asOf', help='data-base (YYYY-MM-DD, padrão: hoje)')
+    parser.add_argument('--days', type=int, default=RISK_DAYS, help='cenários (dias úteis de histórico)')
+    parser.add_argument('--horizon', type=int, default=1, help='horizonte em dias úteis')
+    parser.add_argument('--prod', nargs='*', help='produtos (padrão: todos)')
+    parser.add_argument('--workers', type=int, help='processos (1 = sem pool)')
+    args = parser.parse_args()
+
+    report = riskReport(args.asOf, args.days, args.horizon, args.prod, workers=args.workers)
+    print(f"data-base {report['asOf']}  {report['days']} cenários de {report['horizon']} dia(s)  "
+          f"{report['seconds']:.2f}s{' (pool)' if report['parallel'] else ''}")
+    print(report['summary'].to_string(index=False))
@@ -1,3 +1,10 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+import uuid
+
 import streamlit as st
 import pandas as pd
 from decimal import Decimal
@@ -5,36 +12,94 @@ from datetime import datetime
 
 # importe suas funções do módulo data (mesmo nomes usados no Flask)
 from data import (
-    dbInsertTrade, dbInsertPnl, dbInsertPos,
-    dbFetchMtM, dbFetchTrade,
-    dbLoadPnl, dbLoadPos, dbLoadMtm, dbLoadTrade,
-    dbLoadGraphPnl
+    dbLoadPanels, dbLoadTradePage, dbEstimateTrades,
+    dbLoadBook, dbPoolStats, dbCacheStats, dbDataVersion,
+    dbMetrics, dbSlowQueries, dbMetricsText, dbWarmPool, dbReplicaStats, dbReplicaSettled,
+    PRODUCTS, CATEGORIES, CACHE_TTL, get_conversion_value
 )
+# export (pyarrow), pnl, timeseries e plotly são importados dentro das views
+# que os usam: a partida não paga por eles e o sys.modules evita reimportar
+# nos reruns.
+
+from jobs import jobSubmitRevalue, jobSubmitTrades, jobStatus, jobList, jobStats, startWorkers
 
-# optional: if you have a pxLoadGraph in graphs.py
-try:
-    from graphs import pxLoadGraph
-    HAS_PX = True
-except Exception:
-    HAS_PX = False
+# abre as primeiras conexões em background enquanto a página monta
+dbWarmPool()
+startWorkers()
 
 st.set_page_config(page_title="PNL Dashboard", layout="wide")
 
 # --- helpers ---
-PRODUCTS = ["SoyBean", "SoyMeal", "YelCorn"]
-CATEGORIES = ["FOB Vessel", "FOB Paper", "C&F Vessel"]
 # ship codes are 3 chars in your DB; choose defaults (you can adjust)
 SHIPMENTS = ["VSL", "PPR", "CNF"]
 
-def get_conversion_value(prod: str) -> Decimal:
-    if prod == "SoyBean":
-        return Decimal("36.7454")
-    elif prod == "SoyMeal":
-        return Decimal("1.1023")
-    elif prod == "YelCorn":
-        return Decimal("39.3678")
-    else:
-        return Decimal("1")
+
+# Dados de uma view guardados na sessão (um item por view): reaproveitados
+# entre reruns enquanto a chave for a mesma, nenhuma das tabelas tiver
+# recebido escrita e o TTL do cache não tiver vencido. Logo após uma escrita
+# (dbReplicaSettled falso) a leitura pode vir de réplica ainda sem ela: a
+# versão volta None e o resultado não é guardado.
+def view_cache_get(view, key, tables):
+    version = dbDataVersion(*tables)
+    item = st.session_state.setdefault("view_data", {}).get(view)
+    if item and item[0] == key and item[1] == version and item[2] > time.monotonic():
+        return True, item[3], version
+    return False, None, version if dbReplicaSettled() else None
+
+def view_cache_put(view, key, version, value):
+    if version is None:
+        return
+    st.session_state.setdefault("view_data", {})[view] = (key, version, time.monotonic() + CACHE_TTL, value)
+
+def view_data(view, key, tables, loader):
+    hit, value, version = view_cache_get(view, key, tables)
+    if not hit:
+        value = loader()
+        view_cache_put(view, key, version, value)
+    return value
+
+# Escritas vão para a fila (jobs.py) e a view só acompanha o progresso.
+# A idempotency key é o token do formulário + o conteúdo: um clique duplo ou
+# reenvio do mesmo formulário devolve o mesmo job. O token só muda quando o
+# job termina, liberando um novo envio igual.
+def job_key(form, params):
+    token = st.session_state.setdefault(f"{form}_token", uuid.uuid4().hex)
+    digest = hashlib.sha1(json.dumps(params, default=str, sort_keys=True).encode()).hexdigest()[:16]
+    return f"{token}:{digest}"
+
+def job_track(form, job_id):
+    ids = st.session_state.setdefault("jobs", {}).setdefault(form, [])
+    if job_id not in ids:
+        ids.append(job_id)
+
+def job_panel(form):
+    ids = st.session_state.get("jobs", {}).get(form, [])
+    if not ids:
+        return
+    statuses = st.session_state.setdefault("job_status", {})
+    active = any(statuses.get(i, "queued") in ("queued", "running") for i in ids)
+
+    # enquanto houver job aberto, só este trecho roda de novo a cada segundo
+    @st.fragment(run_every=1.0 if active else None)
+    def panel():
+        still_active = False
+        for job_id in reversed(ids[-5:]):
+            job = jobStatus(job_id)
+            if job is None:
+                continue
+            if statuses.get(job_id, "queued") in ("queued", "running") and job["status"] not in ("queued", "running"):
+                st.session_state.pop(f"{form}_token", None)
+            statuses[job_id] = job["status"]
+            still_active |= job["status"] in ("queued", "running")
+            label = f"Job {job_id} — {job['status']} — {job['done']:,} of {job['total'] or 0:,} rows"
+            st.progress(job["progress"], text=label)
+            if job["error"]:
+                st.error(f"Job {job_id}: {job['error']}")
+        if active and not still_active:
+            # terminou: rerun completo para parar o polling
+            st.rerun()
+
+    panel()
 
 # --- UI ---
 st.title("PNL System — Streamlit")
@@ -59,38 +124,49 @@ with st.sidebar:
             # para debug local você pode descomentar a linha abaixo (não deixe em produção)
             # st.write(f"Detalhe técnico: {e}")
 
+    with st.expander("DB pool / cache"):
+        st.json({"pool": dbPoolStats(), "cache": dbCacheStats()})
 
-tabs = st.tabs(["Overview", "Insert Trade", "Insert MTM", "Trade Log", "Graphs"])
+# Navegação: só a view escolhida roda (st.tabs executaria todas a cada rerun)
+VIEW_NAMES = ["Overview", "Insert Trade", "Insert MTM", "Trade Log", "Graphs", "Risk", "Admin"]
+view = st.radio("View", VIEW_NAMES, horizontal=True, key="view", label_visibility="collapsed")
 
-# --- Overview tab: show tables for each product ---
-with tabs[0]:
+# --- Overview: show tables for each product ---
+def view_overview():
     st.header("Overview")
-    cols = st.columns(3)
-    for i, prod in enumerate(PRODUCTS):
-        with cols[i]:
-            st.subheader(prod)
-            with st.spinner("Loading MTM / PNL / POS..."):
-                try:
-                    mtm_df = dbLoadMtm(prod, int(current_year))
-                    pnl_df = dbLoadPnl(prod, int(current_year))
-                    pos_df = dbLoadPos(prod, int(current_year))
-                except Exception as e:
-                    st.error(f"Erro ao carregar dados: {e}")
-                    mtm_df = pd.DataFrame()
-                    pnl_df = pd.DataFrame()
-                    pos_df = pd.DataFrame()
-
-            st.markdown("**MTM (latest per ship)**")
-            st.dataframe(mtm_df)
-
-            st.markdown("**PNL (monthly)**")
-            st.dataframe(pnl_df)
-
-            st.markdown("**POS (latest per ship)**")
-            st.dataframe(pos_df)
-
-# --- Insert Trade tab ---
-with tabs[1]:
+    # um placeholder por painel; cada um é preenchido assim que sua consulta
+    # termina (dbLoadPanels roda em paralelo, reruns sem escrita vêm do cache)
+    panel_titles = {"mtm": "MTM (latest per ship)", "pnl": "PNL (monthly)", "pos": "POS (latest per ship)"}
+    slots = {}
+    per_row = 3
+    for start in range(0, len(PRODUCTS), per_row):
+        cols = st.columns(per_row)
+        for col, prod in zip(cols, PRODUCTS[start:start + per_row]):
+            with col:
+                st.subheader(prod)
+                for kind, title in panel_titles.items():
+                    st.markdown(f"**{title}**")
+                    slots[(prod, kind)] = st.empty()
+                    slots[(prod, kind)].caption("Loading...")
+    year = int(current_year)
+    hit, frames, version = view_cache_get("overview", year, ("mtmtb", "posTb"))
+    if hit:
+        for (prod, kind), df in frames.items():
+            slots[(prod, kind)].dataframe(df)
+        return
+    frames = {}
+    for prod, kind, df, error in dbLoadPanels(year, PRODUCTS, tuple(panel_titles)):
+        if error is not None:
+            slots[(prod, kind)].error(f"Erro ao carregar {kind}: {error}")
+        else:
+            frames[(prod, kind)] = df
+            slots[(prod, kind)].dataframe(df)
+    # só guarda na sessão se todos os painéis carregaram
+    if len(frames) == len(slots):
+        view_cache_put("overview", year, version, frames)
+
+# --- Insert Trade ---
+def view_insert_trade():
     st.header("Insert Trade")
     with st.form("trade_form"):
         prod = st.selectbox("Product", PRODUCTS, index=PRODUCTS.index(prod_sidebar) if prod_sidebar in PRODUCTS else 0)
@@ -107,91 +183,162 @@ with tabs[1]:
             lvl = Decimal(str(lvl_pct)) / Decimal("100")
             ton_dec = Decimal(str(ton))
             conV = get_conversion_value(prod)
-            inserted = 0
-            for cat in categories:
-                for ship in shipments:
-                    notion = conV * lvl * ton_dec
-                    oldPos = dbFetchMtM  # noop to avoid lint; actual pos fetched below using dbFetchTrade/dbFetchMtM/dbFetchPos
-                    # get current pos (dbFetchPos exists in your data.py)
-                    try:
-                        from data import dbFetchPos
-                        old_pos_val = dbFetchPos(prod, cat, ship, int(year))
-                    except Exception:
-                        old_pos_val = 0
-                    if op == "Purchase":
-                        curPos = old_pos_val + int(ton_dec)
-                    else:
-                        curPos = old_pos_val - int(ton_dec)
-                    dbInsertTrade(prod, cat, ship, int(year), op, int(ton_dec), lvl, notion)
-                    dbInsertPos(prod, cat, ship, int(year), curPos)
-                    inserted += 1
-            st.success(f"Inserted {inserted} trade(s) and updated positions.")
+            notion = conV * lvl * ton_dec
+            # todas as pernas e posições numa única transação
+            legs = [
+                (prod, cat, ship, int(year), op, int(ton_dec), lvl, notion)
+                for cat in categories
+                for ship in shipments
+            ]
+            job_id = jobSubmitTrades(legs, key=job_key("trade", legs))
+            job_track("trade", job_id)
+            st.success(f"Queued {len(legs)} trade(s) as job {job_id}.")
         except Exception as e:
             st.error(f"Erro insertTrade: {e}")
+    job_panel("trade")
 
-# --- Insert MTM tab ---
-with tabs[2]:
+
+# --- Insert MTM ---
+def view_insert_mtm():
     st.header("Insert MTM (mark-to-market)")
+    from pnl import Book, summarize
     with st.form("mtm_form"):
         prod_mtm = st.selectbox("Product", PRODUCTS, index=PRODUCTS.index(prod_sidebar) if prod_sidebar in PRODUCTS else 0)
         year_mtm = st.number_input("Year", min_value=2000, max_value=2100, value=current_year, key="year_mtm")
         mtm_pct = st.number_input("MTM Level (%)", min_value=-100.0, max_value=1000.0, value=0.0)
         categories_mtm = st.multiselect("Categories", CATEGORIES, default=CATEGORIES, key="cat_mtm")
         shipments_mtm = st.multiselect("Shipments (3-char codes)", SHIPMENTS, default=SHIPMENTS, key="ship_mtm")
-        submit_mtm = st.form_submit_button("Insert MTM")
+        fc_mtm = st.columns(2)
+        preview_mtm = fc_mtm[0].form_submit_button("Preview (what-if)")
+        submit_mtm = fc_mtm[1].form_submit_button("Insert MTM")
+
+    if preview_mtm:
+        try:
+            mtm = Decimal(str(mtm_pct)) / Decimal("100")
+            # reavaliação em memória (pnl.py): nada é gravado
+            book = Book.fromFrame(dbLoadBook(prod_mtm, int(year_mtm), categories_mtm, shipments_mtm))
+            if len(book) == 0:
+                st.info("No trades for this selection.")
+            else:
+                result = book.revalue(mtm, decimals=False)
+                total = summarize(result, by=['year']).sum()
+                st.metric("What-if PnL", f"{total:,.2f}", help=f"{len(book)} trades revalued at {mtm}")
+                st.dataframe(summarize(result).unstack(fill_value=0))
+        except Exception as e:
+            st.error(f"Erro preview MTM: {e}")
 
     if submit_mtm:
         try:
             mtm = Decimal(str(mtm_pct)) / Decimal("100")
-            updated = 0
-            for cat in categories_mtm:
-                for ship in shipments_mtm:
-                    trading = dbFetchTrade(prod_mtm, cat, ship, int(year_mtm))
-                    # trading rows are (id, op, ton, lvl)
-                    for trade in trading:
-                        try:
-                            id_trade, op_trade, ton_trade, lvl_trade = trade
-                        except Exception:
-                            # If your dbFetchTrade returns different ordering, try to adapt
-                            st.warning("Unexpected trade tuple shape; skipping one trade row.")
-                            continue
-                        mtmOld = dbFetchMtM(id_trade)
-                        if mtmOld is None:
-                            if op_trade == "Sale":
-                                diff = lvl_trade - mtm
-                            else:  # Purchase
-                                diff = mtm - lvl_trade
-                        else:
-                            if op_trade == "Sale":
-                                diff = mtmOld - mtm
-                            else:
-                                diff = mtm - mtmOld
-
-                        conV = get_conversion_value(prod_mtm)
-                        # ensure numeric types: ton_trade may be int or Decimal
-                        ton_dec = Decimal(str(ton_trade))
-                        pnl = diff * conV * ton_dec
-
-                        dbInsertPnl(id_trade, prod_mtm, cat, ship, int(year_mtm), mtm, pnl)
-                        updated += 1
-            st.success(f"Inserted/updated MTM for {updated} trade-entries.")
+            # a reavaliação roda no banco, em lotes, pelo worker da fila
+            params = (prod_mtm, int(year_mtm), mtm, categories_mtm, shipments_mtm)
+            job_id = jobSubmitRevalue(*params, key=job_key("mtm", params))
+            job_track("mtm", job_id)
+            st.success(f"Queued MTM revaluation as job {job_id}.")
         except Exception as e:
             st.error(f"Erro insertMTM: {e}")
+    job_panel("mtm")
 
-# --- Trade Log tab ---
-with tabs[3]:
+
+# --- Trade Log ---
+def view_trade_log():
+    import export
     st.header("Trade Log")
+    fc = st.columns(6)
+    log_prod = fc[0].selectbox("Product", ["All"] + PRODUCTS, key="log_prod")
+    log_year = fc[1].number_input("Year (0 = all)", min_value=0, max_value=2100, value=0, key="log_year")
+    log_cat = fc[2].selectbox("Category", ["All"] + CATEGORIES, key="log_cat")
+    log_op = fc[3].selectbox("Operation", ["All", "Purchase", "Sale"], key="log_op")
+    log_dates = fc[4].date_input("Date range", value=(), key="log_dates")
+    log_size = fc[5].selectbox("Rows/page", [25, 50, 100, 250], index=1, key="log_size")
+
+    log_filters = dict(
+        prod=None if log_prod == "All" else log_prod,
+        year=int(log_year) or None,
+        cat=None if log_cat == "All" else log_cat,
+        op=None if log_op == "All" else log_op,
+        dateFrom=log_dates[0] if len(log_dates) > 0 else None,
+        dateTo=log_dates[1] if len(log_dates) > 1 else None,
+    )
+    # pilha de cursores (keyset): reinicia quando os filtros mudam
+    filters_key = (tuple(sorted(log_filters.items(), key=lambda kv: kv[0])), log_size)
+    if st.session_state.get("log_filters_key") != filters_key:
+        st.session_state["log_filters_key"] = filters_key
+        st.session_state["log_cursors"] = [None]
+    cursors = st.session_state["log_cursors"]
+
     with st.spinner("Loading trade log..."):
         try:
-            df_trades = dbLoadTrade()
+            df_trades, total = view_data(
+                "trade_log", (filters_key, cursors[-1]), ("tradeTb",),
+                lambda: (dbLoadTradePage(**log_filters, after=cursors[-1], limit=log_size),
+                         dbEstimateTrades(**log_filters)))
+            st.caption(f"Page {len(cursors)} — ~{total:,} trades (estimate)")
             st.dataframe(df_trades)
+
+            nav = st.columns(2)
+            if nav[0].button("◀ Previous", disabled=len(cursors) == 1):
+                cursors.pop()
+                st.rerun()
+            if nav[1].button("Next ▶", disabled=len(df_trades) < log_size):
+                cursors.append(int(df_trades["id"].min()))
+                st.rerun()
         except Exception as e:
             st.error(f"Erro ao carregar trade log: {e}")
 
-# --- Graphs tab ---
-with tabs[4]:
+    # exportação em streaming (COPY -> arquivo temporário); usa os filtros acima,
+    # exceto categoria/operação, que não se aplicam a mtmtb/posTb. O download
+    # passa pela memória do servidor: acima de export.APP_MAX_BYTES o app só
+    # mostra o comando equivalente de export.py. O temporário sai logo após a leitura.
+    with st.expander("Export"):
+        ec = st.columns(3)
+        exp_table = ec[0].selectbox("Table", list(export.EXPORT_TABLES), key="exp_table")
+        exp_fmt = ec[1].selectbox("Format", ["csv", "parquet"] if export.HAS_PARQUET else ["csv"], key="exp_fmt")
+        if ec[2].button("Prepare export"):
+            st.session_state.pop("exp_file", None)
+            exp_filters = {k: log_filters[k] for k in ("prod", "year", "dateFrom", "dateTo")}
+            path = None
+            try:
+                with st.spinner("Exporting..."):
+                    with tempfile.NamedTemporaryFile(suffix=f".{exp_fmt}", delete=False) as out:
+                        path = out.name
+                        stats = export.export(exp_table, exp_fmt, out, **exp_filters)
+                size = os.path.getsize(path)
+                payload = None
+                if size <= export.APP_MAX_BYTES:
+                    with open(path, "rb") as f:
+                        payload = f.read()
+                st.session_state["exp_file"] = (payload, f"{exp_table}.{exp_fmt}", stats["rows"], size,
+                                                export.cliCommand(exp_table, exp_fmt, **exp_filters))
+            except Exception as e:
+                st.error(f"Erro export: {e}")
+            finally:
+                if path and os.path.exists(path):
+                    os.remove(path)
+        if "exp_file" in st.session_state:
+            payload, name, rows, size, command = st.session_state["exp_file"]
+            if payload is not None:
+                st.download_button(f"Download {name} ({rows:,} rows)", payload, file_name=name)
+            else:
+                st.warning(f"{name} has {rows:,} rows ({size / 2**20:,.0f} MB), above the in-app limit of "
+                           f"{export.APP_MAX_BYTES >> 20} MB. Run the export from the command line:")
+                st.code(command, language="bash")
+
+
+# --- Graphs ---
+def view_graphs():
     st.header("PNL Graphs")
-    prod_for_graph = st.selectbox("Product for graph", PRODUCTS, index=0)
+    gc = st.columns(4)
+    prod_for_graph = gc[0].selectbox("Product for graph", PRODUCTS, index=0)
+    graph_res = gc[1].selectbox("Resolution", ["day", "week", "month"], key="graph_res")
+    graph_budget = gc[2].number_input("Max points", min_value=30, max_value=5000, value=500, step=50, key="graph_budget")
+    graph_cum = gc[3].checkbox("Cumulative", value=False, key="graph_cum")
+    # optional: if you have a pxLoadGraph in graphs.py
+    try:
+        from graphs import pxLoadGraph
+        HAS_PX = True
+    except Exception:
+        HAS_PX = False
     with st.spinner("Loading PNL timeseries..."):
         try:
             # Prefer pxLoadGraph if available (your existing function)
@@ -199,23 +346,122 @@ with tabs[4]:
                 fig = pxLoadGraph(prod_for_graph)
                 st.plotly_chart(fig, use_container_width=True)
             else:
-                df_graph = dbLoadGraphPnl(prod_for_graph)
-                if df_graph is None or df_graph.empty:
+                # série carregada uma vez por sessão e depois só atualizada
+                # com as linhas novas de mtmtb (timeseries.py)
+                series_key = (prod_for_graph, graph_res)
+                all_series = st.session_state.setdefault("pnl_series", {})
+                if series_key in all_series:
+                    series = all_series[series_key]
+                    added = series.refresh()
+                else:
+                    from timeseries import PnlSeries
+                    series = all_series[series_key] = PnlSeries(prod_for_graph, graph_res)
+                    added = None
+                df_graph = series.frame(budget=graph_budget, cumulative=graph_cum)
+                if df_graph.empty:
                     st.info("No PNL timeseries available.")
                 else:
-                    # ensure date is datetime
-                    if 'date' in df_graph.columns:
-                        df_graph['date'] = pd.to_datetime(df_graph['date'])
-                        df_graph = df_graph.sort_values('date')
-                        import plotly.express as px
-                        fig = px.line(df_graph, x='date', y='pnl', color='cat', markers=True,
-                                      title=f"PNL timeseries — {prod_for_graph}")
-                        st.plotly_chart(fig, use_container_width=True)
-                    else:
-                        st.write(df_graph)
+                    import plotly.express as px
+                    fig = px.line(df_graph, x='date', y='pnl', color='cat', markers=len(df_graph) <= 200,
+                                  title=f"PNL timeseries — {prod_for_graph} ({graph_res})")
+                    st.plotly_chart(fig, use_container_width=True)
+                    st.caption(f"{len(df_graph)} of {len(series.points)} points"
+                               + ("" if added is None else f" — refreshed, {added} new rows"))
         except Exception as e:
             st.error(f"Erro ao gerar gráfico: {e}")
 
+
+def view_risk():
+    st.header("PnL at risk — historical simulation")
+    rc = st.columns(4)
+    risk_as_of = rc[0].date_input("As of", value=datetime.now().date(), key="risk_as_of")
+    risk_days = rc[1].selectbox("Look-back (business days)", [250, 500, 1000, 2000], index=1, key="risk_days")
+    risk_horizon = rc[2].selectbox("Horizon (days)", [1, 5, 10], index=0, key="risk_horizon")
+    risk_prods = rc[3].multiselect("Products", PRODUCTS, default=PRODUCTS, key="risk_prods")
+    if not risk_prods:
+        st.info("Select at least one product.")
+        return
+    # risk.py guarda o relatório por data-base; só recalcula após escrita em mtmtb/posTb
+    from risk import riskReport
+    with st.spinner("Computing VaR / ES..."):
+        try:
+            report = riskReport(risk_as_of, risk_days, risk_horizon, risk_prods)
+        except Exception as e:
+            st.error(f"Erro ao calcular risco: {e}")
+            return
+    if not report["days"]:
+        st.info("Not enough mark history up to this date.")
+        return
+    st.caption(f"Business date {report['asOf']} — {report['days']} scenarios of {report['horizon']} day(s)"
+               + (" — cached" if report["cached"] else f" — computed in {report['seconds']:.2f}s"
+                  + (" (process pool)" if report["parallel"] else "")))
+    summary = report["summary"].set_index("prod")
+    mc = st.columns(4)
+    for col, name in zip(mc, ["VaR 95%", "ES 95%", "VaR 99%", "ES 99%"]):
+        col.metric(f"Total {name}", f"{summary.loc['Total', name]:,.2f}")
+    st.dataframe(report["summary"], use_container_width=True, hide_index=True)
+    import plotly.express as px
+    scenarios = report["scenarios"]
+    fig = px.histogram(scenarios, x="Total", nbins=60, title="Total scenario PnL")
+    fig.add_vline(x=-summary.loc["Total", "VaR 99%"], line_dash="dash", annotation_text="VaR 99%")
+    fig.add_vline(x=-summary.loc["Total", "VaR 95%"], line_dash="dot", annotation_text="VaR 95%")
+    st.plotly_chart(fig, use_container_width=True)
+    st.markdown("**Worst scenarios**")
+    st.dataframe(scenarios.nsmallest(10, "Total").round(2), use_container_width=True)
+
+
+def view_admin():
+    st.subheader("Admin — data layer metrics")
+    # contadores do processo (todas as sessões), ver metrics.py
+    df_metrics = pd.DataFrame(dbMetrics())
+    if df_metrics.empty:
+        st.info("No data-layer calls recorded yet.")
+    else:
+        st.dataframe(df_metrics.round(2), use_container_width=True, hide_index=True)
+    slow = dbSlowQueries()
+    st.markdown(f"**Slow queries** ({len(slow)})")
+    for entry in slow:
+        with st.expander(f"{entry['at']} — {entry['ms']} ms — {entry['sql'][:80]}"):
+            st.code(entry["sql"], language="sql")
+            st.caption(f"params: {entry['params']}")
+            if entry["explain"]:
+                st.code(entry["explain"])
+    st.markdown("**Write queue**")
+    try:
+        stats = jobStats()
+        jc = st.columns(4)
+        jc[0].metric("Queued", stats["queued"])
+        jc[1].metric("Running", stats["running"])
+        jc[2].metric("Backlog rows", f"{stats['backlogRows']:,}")
+        jc[3].metric("Rows/s (1h)", "—" if stats["rowsPerSec"] is None else f"{stats['rowsPerSec']:,.0f}")
+        st.dataframe(jobList(20), use_container_width=True, hide_index=True)
+    except Exception as e:
+        st.error(f"Erro ao carregar fila: {e}")
+    replicas = dbReplicaStats()
+    if replicas:
+        # leituras do dashboard por réplica; escritas ficam no primário
+        st.markdown("**Read replicas**")
+        st.dataframe(pd.DataFrame([
+            {"replica": name, "host": r["host"], "up": r["up"], "retry in (s)": r["retryIn"],
+             "lag (s)": r["lag"], "reads": r["reads"], "failures": r["failures"],
+             "in use": r["pool"]["inUse"], "error": r["error"]}
+            for name, r in replicas.items()
+        ]), use_container_width=True, hide_index=True)
+    with st.expander("Prometheus text"):
+        st.code(dbMetricsText())
+
+
+VIEWS = {
+    "Overview": view_overview,
+    "Insert Trade": view_insert_trade,
+    "Insert MTM": view_insert_mtm,
+    "Trade Log": view_trade_log,
+    "Graphs": view_graphs,
+    "Risk": view_risk,
+    "Admin": view_admin,
+}
+VIEWS[view]()
+
 # small footer
 st.markdown("---")
 st.caption("App convertido from Flask → Streamlit. Use the sidebar to change year and refresh.")
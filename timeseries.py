@@ -0,0 +1,102 @@
+# Séries de PnL para a aba Graphs.
+#
+# A série é carregada uma vez já agregada no banco, a partir do rollup diário
+# pnltb (dbLoadPnlBuckets), e depois atualizada só com as linhas novas de
+# mtmtb (dbFetchPnlSince): como cada ponto é uma soma, basta somar o pnl das
+# linhas novas ao período delas. Para o
+# gráfico, cada categoria é reduzida a um orçamento de pontos com LTTB
+# (Largest-Triangle-Three-Buckets), que preserva picos e vales.
+import numpy as np
+import pandas as pd
+
+from data import dbLoadPnlBuckets, dbFetchPnlSince, GRAPH_OVERLAP
+
+
+def bucketOf(dates, resolution):
+    # Mesmo truncamento do date_trunc do banco (semana começa na segunda)
+    dates = pd.to_datetime(dates)
+    if resolution == 'day':
+        return dates.dt.normalize()
+    if resolution == 'week':
+        return (dates - pd.to_timedelta(dates.dt.weekday, unit='D')).dt.normalize()
+    return dates.dt.to_period('M').dt.to_timestamp()
+
+
+class PnlSeries:
+    # Estado de uma série (produto x resolução): pontos agregados, último reg
+    # visto e os idPnl recentes já somados (janela de sobreposição)
+    def __init__(self, prod, resolution='day'):
+        self.prod, self.resolution = prod, resolution
+        df = dbLoadPnlBuckets(prod, resolution)
+        self.lastReg = df.attrs.get('lastReg')
+        self.recent = dict(df.attrs.get('recent', {}))
+        self.points = self._normalize(df)
+        self.refreshes = 0
+
+    @staticmethod
+    def _normalize(df):
+        out = df[['date', 'cat', 'pnl']].copy()
+        out['date'] = pd.to_datetime(out['date'])
+        out['pnl'] = out['pnl'].astype('float64')
+        return out
+
+    def refresh(self):
+        # Soma as linhas novas; devolve quantas entraram
+        rows = dbFetchPnlSince(self.prod, self.lastReg if self.lastReg is not None else '-infinity')
+        if not rows.empty:
+            rows = rows[~rows['idpnl'].isin(self.recent.keys())]
+        if rows.empty:
+            return 0
+        self.recent.update(zip(rows['idpnl'], rows['reg']))
+        self.lastReg = max(r for r in [self.lastReg, rows['reg'].max()] if r is not None)
+        horizon = pd.Timestamp(self.lastReg) - pd.Timedelta(GRAPH_OVERLAP)
+        self.recent = {i: r for i, r in self.recent.items() if pd.Timestamp(r) > horizon}
+        delta = rows.assign(date=bucketOf(rows['date'], self.resolution))
+        delta = self._normalize(delta.groupby(['date', 'cat'], as_index=False)['pnl'].sum())
+        self.points = (pd.concat([self.points, delta])
+                       .groupby(['date', 'cat'], as_index=False)['pnl'].sum()
+                       .sort_values(['date', 'cat'], ignore_index=True))
+        self.refreshes += 1
+        return len(rows)
+
+    def frame(self, budget=None, cumulative=False):
+        # Pontos por categoria, opcionalmente acumulados e reduzidos por LTTB
+        # para no máximo budget pontos no total
+        parts = []
+        cats = self.points['cat'].unique()
+        for cat in cats:
+            part = self.points[self.points['cat'] == cat].sort_values('date')
+            if cumulative:
+                part = part.assign(pnl=part['pnl'].cumsum())
+            if budget:
+                keep = lttb(part['date'].to_numpy('datetime64[ns]').astype(np.int64),
+                            part['pnl'].to_numpy(), max(budget // len(cats), 3))
+                part = part.iloc[keep]
+            parts.append(part)
+        if not parts:
+            return self.points.iloc[0:0]
+        return pd.concat(parts, ignore_index=True)
+
+
+def lttb(x, y, threshold):
+    # Índices dos pontos escolhidos pelo LTTB (primeiro e último sempre)
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    keep = np.empty(threshold, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        # média do próximo bucket (ou o último ponto)
+        nextStart, nextEnd = end, edges[i + 2] if i + 2 < len(edges) else n
+        if nextStart >= nextEnd:
+            avgX, avgY = x[-1], y[-1]
+        else:
+            avgX, avgY = x[nextStart:nextEnd].mean(), y[nextStart:nextEnd].mean()
+        area = np.abs((x[a] - avgX) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avgY - y[a]))
+        a = start + int(np.argmax(area))
+        keep[i + 1] = a
+    return keep